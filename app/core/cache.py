@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+CACHE_DB = Path("/data/metadata_cache.db")
+
+# Únicos campos de la metadata que se usan después
+FIELDS = ("timestamp", "release_timestamp", "upload_date", "duration", "title", "live_status")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key         TEXT PRIMARY KEY,
+    data        TEXT NOT NULL,
+    fetched_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_metadata_accessed ON metadata (accessed_at);
+"""
+
+
+class MetadataCache:
+    """
+    Caché en disco de metadata de vídeos de yt-dlp.
+
+    Las claves llevan prefijo de fuente ("yt:<id>"). Twitch y Kick no la
+    usan: su listado ya trae la metadata completa de cada VOD.
+    Cada entrada caduca a las ttl_hours y se vuelve a pedir (revalidación);
+    si hay más de max_entries se expulsan las menos usadas (LRU).
+    """
+
+    def __init__(self, path: Path | None = None, ttl_hours: float = 24, max_entries: int = 5000):
+        path = Path(path or CACHE_DB)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM metadata WHERE key = ? AND fetched_at >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE metadata SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, info: dict):
+        data = {k: info.get(k) for k in FIELDS if info.get(k) is not None}
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (key, data, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(data), now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM metadata WHERE key IN "
+                "(SELECT key FROM metadata ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = f" ({100 * self.hits / total:.0f}%)" if total else ""
+        return f"{self.hits} aciertos, {self.misses} fallos{ratio}"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def metadata_cache(config: dict) -> MetadataCache:
+    """
+    Caché compartida por todos los downloaders (se abre una sola vez;
+    ttl_hours y max_entries se toman de la config de cada llamada).
+    """
+    global _cache
+    cfg = config.get("cache", {})
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache()
+        # en cada llamada: en modo daemon config.yaml puede haber cambiado
+        _cache.ttl = cfg.get("ttl_hours", 24) * 3600
+        _cache.max_entries = cfg.get("max_entries", 5000)
+    return _cache
@@ -0,0 +1,85 @@
+import time
+from datetime import datetime, timezone
+from statistics import median
+
+from app.core.state import EpisodeStore
+
+
+DEFAULTS = {
+    "adaptive": True,
+    "min_minutes": 30,        # intervalo mínimo entre sondeos de un canal
+    "max_minutes": 4320,      # máximo (3 días) para canales inactivos
+    "backoff": 2,             # multiplicador por cada sondeo sin novedades
+}
+
+
+def _parse(ts: str) -> float | None:
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class ChannelPoller:
+    """
+    Decide qué canales de una fuente toca sondear en esta pasada.
+
+    El intervalo de cada canal sale de su ritmo de publicación (mediana
+    entre published_at del histórico): se sondea unas 4 veces por cada
+    intervalo típico entre vídeos, con backoff exponencial por cada
+    sondeo sin novedades. Un canal que acaba de publicar vuelve al
+    intervalo mínimo. Sin histórico suficiente se sondea siempre.
+    """
+
+    def __init__(self, config: dict, state: EpisodeStore, source: str, tag: str):
+        self.cfg = dict(DEFAULTS, **config.get("polling", {}))
+        self.state = state
+        self.source = source
+        self.tag = tag
+        self.history = state.published_history(source)
+        self.now = time.time()
+
+    def interval(self, channel: str, misses: int) -> float:
+        """Intervalo de sondeo del canal, en segundos."""
+        min_s = self.cfg["min_minutes"] * 60
+        max_s = self.cfg["max_minutes"] * 60
+
+        published = sorted(t for t in map(_parse, self.history.get(channel, [])) if t)
+        if len(published) < 2:
+            return min_s
+
+        gaps = [b - a for a, b in zip(published, published[1:]) if b > a]
+        typical = median(gaps) if gaps else max_s
+
+        # acaba de publicar: puede que venga otro pronto
+        if self.now - published[-1] < typical / 2:
+            return min_s
+
+        base = typical / 4
+        return max(min_s, min(max_s, base * self.cfg["backoff"] ** misses))
+
+    def due(self, channel: str) -> bool:
+        if not self.cfg["adaptive"]:
+            return True
+
+        poll = self.state.poll(self.source, channel)
+        last = poll.get("last_poll")
+        if last is None:
+            return True
+
+        wait = self.interval(channel, poll.get("misses", 0))
+        if self.now - last >= wait:
+            return True
+
+        left = (wait - (self.now - last)) / 60
+        print(f"[{self.tag}] {channel}: próximo sondeo en {left:.0f} min, saltando")
+        return False
+
+    def done(self, channel: str, new_episodes: int):
+        """Registra el sondeo; sin novedades aumenta el backoff."""
+        poll = self.state.poll(self.source, channel)
+        misses = 0 if new_episodes else min(poll.get("misses", 0) + 1, 20)
+        self.state.set_poll(self.source, channel, self.now, misses)
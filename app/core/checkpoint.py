@@ -0,0 +1,59 @@
+import json
+import os
+import time
+from pathlib import Path
+
+
+def temp_dir(config: dict) -> Path:
+    """Directorio de temporales/checkpoints (storage.temp_dir)."""
+    storage = config.get("storage", {})
+    path = Path(storage.get("base_path", "/data")) / storage.get("temp_dir", "tmp")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _checkpoint_file(work_dir: Path, ep_id: str) -> Path:
+    return Path(work_dir) / f"{ep_id}.ckpt.json"
+
+
+def load_checkpoint(work_dir: Path, ep_id: str) -> dict:
+    """
+    Devuelve el checkpoint guardado para el episodio, o {} si no hay
+    (o si está corrupto: en ese caso se empieza de cero).
+    """
+    path = _checkpoint_file(work_dir, ep_id)
+    if not path.exists():
+        return {}
+    try:
+        with path.open("r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def save_checkpoint(work_dir: Path, ep_id: str, data: dict):
+    """Guarda el checkpoint de forma atómica (fichero temporal + rename)."""
+    path = _checkpoint_file(work_dir, ep_id)
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def clear_checkpoint(work_dir: Path, ep_id: str):
+    _checkpoint_file(work_dir, ep_id).unlink(missing_ok=True)
+
+
+def prune_temp_dir(work_dir: Path, max_age_days: int = 7):
+    """
+    Borra checkpoints y descargas parciales abandonados (episodios que ya
+    no se van a reintentar) con más de max_age_days sin tocar.
+    """
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for path in Path(work_dir).iterdir():
+        if path.is_file() and path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            removed += 1
+    if removed:
+        print(f"[Ck] {removed} temporales antiguos borrados de {work_dir}")
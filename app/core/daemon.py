@@ -0,0 +1,100 @@
+import os
+import time
+
+import schedule
+
+from app.core.config import CONFIG_FILE, load_config
+from app.core.state import load_state
+from app.core.scheduler import SOURCES
+from app.core.public import STATUS_DIR
+from app.core.prom import serve_metrics
+
+
+DEFAULT_POLL_MINUTES = 60
+SOURCE_ORDER = [key for key, *_ in SOURCES]
+
+
+def _config_mtime():
+    try:
+        return os.stat(CONFIG_FILE).st_mtime
+    except OSError:
+        return None
+
+
+def _schedule_sources(config: dict, due: set, intervals: dict):
+    """
+    Programa el sondeo de cada fuente según su poll_minutes.
+
+    'intervals' guarda el intervalo con el que está programada cada fuente
+    (None si está desactivada): al recargar config.yaml sólo se
+    reprograman las que cambian, y las demás conservan su próxima pasada.
+    """
+    src = config.get("sources", {})
+
+    for key in SOURCE_ORDER:
+        src_cfg = src.get(key, {})
+        minutes = None
+        if src_cfg.get("enabled", True):
+            minutes = src_cfg.get("poll_minutes", DEFAULT_POLL_MINUTES)
+        if intervals.get(key) == minutes:
+            continue
+
+        schedule.clear(key)
+        intervals[key] = minutes
+        if minutes is None:
+            print(f"[Dm] {key}: desactivada")
+            continue
+        schedule.every(minutes).minutes.do(due.add, key).tag(key)
+        print(f"[Dm] {key}: cada {minutes} min")
+
+
+def run_daemon(run_pass):
+    """
+    Modo daemon: un único proceso que mantiene config, estado y cachés en
+    memoria y lanza run_pass(config, state, fuentes) cuando toca sondear
+    alguna fuente. config.yaml se recarga en caliente si cambia: la caché
+    de metadata y el backend de rclone toman la nueva config en la
+    siguiente pasada.
+    """
+    config = load_config()
+    state = load_state()
+    mtime = _config_mtime()
+
+    metrics_cfg = config.get("metrics", {})
+    if metrics_cfg.get("serve", True):
+        try:
+            serve_metrics(os.path.join(STATUS_DIR, "metrics.prom"), port=metrics_cfg.get("port", 8085))
+        except OSError as e:
+            print(f"[Dm] No se pudo abrir el puerto de métricas: {e}")
+
+    # la primera pasada incluye todas las fuentes
+    due = set(SOURCE_ORDER)
+    intervals = {}
+    _schedule_sources(config, due, intervals)
+    print("[Dm] Daemon iniciado")
+
+    while True:
+        current = _config_mtime()
+        if current != mtime:
+            mtime = current
+            try:
+                config = load_config()
+            except Exception as e:
+                print(f"[Dm] Error recargando {CONFIG_FILE}, se mantiene la anterior: {e}")
+            else:
+                print(f"[Dm] {CONFIG_FILE} recargado")
+                _schedule_sources(config, due, intervals)
+
+        schedule.run_pending()
+
+        if due:
+            sources = [key for key in SOURCE_ORDER if key in due]
+            due.clear()
+            try:
+                run_pass(config, state, sources)
+            except Exception as e:
+                # que una pasada fallida no tire el daemon (run ya ha
+                # cerrado su TeeLogger y restaurado stdout/stderr)
+                print(f"[Dm] Error en la pasada ({', '.join(sources)}): {e}")
+
+        time.sleep(config.get("daemon", {}).get("tick_seconds", 30))
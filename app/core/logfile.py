@@ -0,0 +1,193 @@
+import gzip
+import os
+import re
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+MAX_BYTES = 20 * 1024 * 1024   # tamaño de cada trozo de last_run.log
+BACKUPS = 4                    # trozos comprimidos que se conservan
+MAX_LINE = 64 * 1024           # caracteres leídos de golpe al recorrer un log
+COMPRESSLEVEL = 6              # el 9 por defecto de gzip es mucho más lento y apenas comprime más
+
+
+def segments(path) -> list:
+    """
+    Trozos de un log rotado, del más antiguo al más reciente:
+    [path.N.gz, ..., path.1.gz, path]. Sólo los que existen.
+    """
+    path = Path(path)
+    pattern = re.compile(re.escape(path.name) + r"\.(\d+)\.gz$")
+    rotated = []
+    if path.parent.is_dir():
+        for entry in os.listdir(path.parent):
+            m = pattern.match(entry)
+            if m:
+                rotated.append((int(m.group(1)), path.parent / entry))
+    rotated.sort(reverse=True)
+    out = [p for _, p in rotated]
+    if path.is_file():
+        out.append(path)
+    return out
+
+
+def iter_lines(paths, max_line: int = MAX_LINE):
+    """
+    Líneas de uno o varios logs (planos o .gz) sin cargarlos enteros.
+
+    Una línea de más de max_line caracteres (p.ej. el progreso de ffmpeg,
+    que sólo usa '\\r') sale en varios trozos, así que la memoria no
+    depende del tamaño del log ni de sus líneas.
+    """
+    for path in paths:
+        path = Path(path)
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", errors="replace") as f:
+            while True:
+                line = f.readline(max_line)
+                if not line:
+                    break
+                yield line
+
+
+class RotatingLog:
+    """
+    Archivo de texto que se rota por tamaño mientras se escribe.
+
+    Al pasar de max_bytes, el trozo actual se comprime a path.1.gz (los
+    anteriores pasan a .2.gz, .3.gz...) y se sigue en un path vacío. Se
+    conservan 'backups' trozos comprimidos; si hay que descartar el más
+    antiguo, al cerrar se deja un único aviso al principio del trozo más
+    antiguo que queda. Así un ffmpeg muy verboso no puede llenar el disco
+    ni la página de estado.
+
+    max_bytes cuenta bytes del archivo (UTF-8), no caracteres.
+    """
+
+    def __init__(self, path, max_bytes: int = MAX_BYTES, backups: int = BACKUPS):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = max(0, backups)
+        self.dropped = 0
+        self._sizes = []   # tamaño sin comprimir de .1.gz, .2.gz...
+        self._lock = threading.Lock()
+
+        # trozos de la ejecución anterior
+        for old in segments(self.path):
+            if old != self.path:
+                old.unlink()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "w", buffering=1, encoding="utf-8", errors="replace")
+        self.size = 0
+
+    def write(self, data: str):
+        with self._lock:
+            if self.file.closed:   # algún hilo rezagado tras close()
+                return
+            self.file.write(data)
+            # bytes, no caracteres; casi todo el log es ASCII y ahí coinciden
+            self.size += len(data) if data.isascii() else len(data.encode("utf-8", "replace"))
+            # sólo en fin de línea, para no partir líneas entre trozos
+            if self.size >= self.max_bytes and data.endswith("\n"):
+                self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+
+        self._sizes.insert(0, self.size)
+        if len(self._sizes) > self.backups:
+            self.dropped += self._sizes.pop()
+
+        name = self.path.name
+        self.path.with_name(f"{name}.{self.backups}.gz").unlink(missing_ok=True)
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{name}.{i}.gz")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{name}.{i + 1}.gz"))
+        if self.backups:
+            with open(self.path, "rb") as src, gzip.open(self.path.with_name(f"{name}.1.gz"), "wb", COMPRESSLEVEL) as dst:
+                shutil.copyfileobj(src, dst)
+
+        self.file = open(self.path, "w", buffering=1, encoding="utf-8", errors="replace")
+        self.size = 0
+
+    def _mark_dropped(self):
+        """
+        Escribe el aviso de log recortado como primera línea del trozo más
+        antiguo que se conserva (path.N.gz, o path si no hay backups).
+
+        En un .gz basta con anteponer un miembro gzip con el aviso y copiar
+        el resto tal cual; no se descomprime nada.
+        """
+        warning = f"[Warn] Log recortado: descartados {self.dropped / 1e6:.1f} MB del principio\n".encode()
+        oldest = self.path.with_name(f"{self.path.name}.{len(self._sizes)}.gz") if self._sizes else self.path
+        tmp = oldest.with_name(oldest.name + ".tmp")
+        with open(tmp, "wb") as out, open(oldest, "rb") as src:
+            if oldest.suffix == ".gz":
+                with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=COMPRESSLEVEL) as gz:
+                    gz.write(warning)
+            else:
+                out.write(warning)
+            shutil.copyfileobj(src, out)
+        os.replace(tmp, oldest)
+
+    def flush(self):
+        with self._lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self._lock:
+            if self.file.closed:
+                return
+            self.file.close()
+            if self.dropped:
+                self._mark_dropped()
+
+
+@contextmanager
+def log_block():
+    """
+    Agrupa lo que imprime este hilo dentro del bloque y lo escribe de una
+    vez al salir (ver TeeLogger.block), para que las líneas de un canal no
+    se intercalen con las de otros workers. Sin TeeLogger no hace nada.
+    """
+    block = getattr(sys.stdout, "block", None)
+    if block is None:
+        yield
+        return
+    with block():
+        yield
+
+
+def archive(path, dst) -> Path:
+    """
+    Junta todos los trozos de 'path' en un único dst (.gz) y vacía path.
+
+    Los trozos ya comprimidos se copian tal cual (un .gz con varios
+    miembros se lee como uno solo) y sólo se comprime el último, así que
+    no se descomprime nada ni se carga el log en memoria.
+    """
+    path, dst = Path(path), Path(dst)
+    parts = segments(path)
+    tmp = dst.with_name(dst.name + ".tmp")
+    with open(tmp, "wb") as out:
+        for part in parts:
+            with open(part, "rb") as src:
+                if part.suffix == ".gz":
+                    shutil.copyfileobj(src, out)
+                else:
+                    with gzip.GzipFile(fileobj=out, mode="wb", compresslevel=COMPRESSLEVEL) as gz:
+                        shutil.copyfileobj(src, gz)
+    os.replace(tmp, dst)
+
+    for part in parts:
+        if part.suffix == ".gz":
+            part.unlink()
+    if path.is_file():
+        open(path, "w").close()
+    return dst
@@ -0,0 +1,223 @@
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+RUNS_FILE = Path("/data/runs.jsonl")
+
+PHASES = ("listing", "download", "encode", "upload", "feed", "publish")
+SLOWEST_SPANS = 10
+
+# Límites (s) de los histogramas de duración por episodio y etapa
+BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class RunMetrics:
+    """
+    Métricas de una pasada, en lugar de contar líneas del log.
+
+    - phase(nombre): tiempo acumulado por fase. Las fases que corren en
+      varios hilos (descargas, subidas...) suman el tiempo de todos, así
+      que pueden superar la duración total de la pasada.
+    - add(clave, n): contadores globales (bytes_downloaded, bytes_uploaded)
+    - episodes(lista): episodios nuevos por fuente y canal, con sus bytes
+    - observe(etapa, s) / fail(etapa): duración de cada episodio en una
+      etapa (download, encode, upload) y fallos por etapa
+    - add_span(...): lo llama span() al cerrar cada tramo cronometrado
+
+    record() devuelve el registro completo; write() lo añade como una
+    línea JSON a runs.jsonl.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.phases = {name: 0.0 for name in PHASES}
+        self.counters = {"bytes_downloaded": 0, "bytes_uploaded": 0}
+        self.sources = {}
+        self.spans = {}      # nombre → count, wall, cpu, child_cpu
+        self.folded = {}     # "a;b;c" → ms de tiempo propio (flamegraph)
+        self.slowest = []
+        self.histograms = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def add(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def episodes(self, episodes: list):
+        with self._lock:
+            for ep in episodes:
+                src = self.sources.setdefault(
+                    ep.get("source", "?"), {"episodes": 0, "bytes": 0, "channels": {}}
+                )
+                src["episodes"] += 1
+                src["bytes"] += ep.get("size", 0)
+                channel = ep.get("channel") or "?"
+                src["channels"][channel] = src["channels"].get(channel, 0) + 1
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            hist = self.histograms.setdefault(
+                stage, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            )
+            for i, le in enumerate(BUCKETS):
+                if seconds <= le:
+                    hist["buckets"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+
+    def fail(self, stage: str):
+        with self._lock:
+            self.failures[stage] = self.failures.get(stage, 0) + 1
+
+    def add_span(self, path: tuple, wall: float, self_wall: float, cpu: float,
+                 child_cpu: float, attrs: dict):
+        name = path[-1]
+        with self._lock:
+            agg = self.spans.setdefault(name, {"count": 0, "wall": 0.0, "cpu": 0.0, "child_cpu": 0.0})
+            agg["count"] += 1
+            agg["wall"] += wall
+            agg["cpu"] += cpu
+            agg["child_cpu"] += child_cpu
+
+            key = ";".join(path)
+            self.folded[key] = self.folded.get(key, 0) + self_wall * 1000
+
+            if attrs:
+                self.slowest.append({"span": name, "wall": round(wall, 2), **attrs})
+                self.slowest.sort(key=lambda s: s["wall"], reverse=True)
+                del self.slowest[SLOWEST_SPANS:]
+
+    def write_folded(self, path: Path):
+        """Pilas de spans en formato 'folded' (flamegraph.pl, speedscope)."""
+        with self._lock:
+            lines = [f"{stack} {ms:.0f}" for stack, ms in sorted(self.folded.items()) if ms >= 1]
+        path.write_text("\n".join(lines) + "\n")
+
+    def finish(self):
+        self.finished = time.time()
+
+    def record(self) -> dict:
+        end = self.finished or time.time()
+        with self._lock:
+            return {
+                "timestamp": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+                "duration": round(end - self.started, 2),
+                "episodes": sum(s["episodes"] for s in self.sources.values()),
+                "phases": {k: round(v, 2) for k, v in self.phases.items()},
+                "sources": json.loads(json.dumps(self.sources)),
+                "spans": {
+                    name: {k: round(v, 2) if isinstance(v, float) else v for k, v in agg.items()}
+                    for name, agg in sorted(self.spans.items())
+                },
+                "slowest": list(self.slowest),
+                "histograms": json.loads(json.dumps(self.histograms)),
+                "failures": dict(self.failures),
+                **self.counters,
+            }
+
+    def write(self, path: Path | None = None):
+        path = path or RUNS_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a") as f:
+            f.write(json.dumps(self.record(), ensure_ascii=False) + "\n")
+
+
+def last_record(path: Path | None = None) -> dict | None:
+    """Último registro de runs.jsonl (leyendo sólo el final del archivo)."""
+    try:
+        with (path or RUNS_FILE).open("rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(0, size - 65536))
+            lines = f.read().splitlines()
+        return json.loads(lines[-1]) if lines else None
+    except Exception:
+        return None
+
+
+_current = RunMetrics()
+
+
+def start_run() -> RunMetrics:
+    """Empieza las métricas de una pasada nueva (una por run())."""
+    global _current
+    _current = RunMetrics()
+    return _current
+
+
+def run_metrics() -> RunMetrics:
+    """Métricas de la pasada en curso."""
+    return _current
+
+
+_local = threading.local()
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Cronometra un tramo: tiempo real, CPU del propio hilo y CPU de los
+    procesos hijos terminados dentro del tramo (ffmpeg, twitch-dl...).
+
+    La CPU de hijos sale de getrusage(RUSAGE_CHILDREN), que es de todo el
+    proceso: con varios hilos lanzando subprocesos a la vez es aproximada.
+    Los spans anidados en el mismo hilo forman la pila del flamegraph;
+    'attrs' (p.ej. episode=...) sirven para la lista de los más lentos.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+
+    frame = {"name": name, "child_wall": 0.0}
+    stack.append(frame)
+    wall0 = time.monotonic()
+    cpu0 = time.thread_time()
+    child0 = _children_cpu()
+    try:
+        yield
+    finally:
+        wall = time.monotonic() - wall0
+        cpu = time.thread_time() - cpu0
+        child_cpu = _children_cpu() - child0
+        path = tuple(f["name"] for f in stack)
+        stack.pop()
+        if stack:
+            stack[-1]["child_wall"] += wall
+        run_metrics().add_span(path, wall, max(0.0, wall - frame["child_wall"]), cpu, child_cpu, attrs)
+
+
+def run_cmd(cmd: list, name: str | None = None, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run dentro de un span. Por defecto el span se llama como el
+    ejecutable y su subcomando ("twitch-dl.download", "ffmpeg").
+    """
+    if name is None:
+        name = os.path.basename(cmd[0])
+        if len(cmd) > 1 and not str(cmd[1]).startswith("-"):
+            name += f".{cmd[1]}"
+    with span(name):
+        return subprocess.run(cmd, **kwargs)
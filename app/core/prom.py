@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from app.core.metrics import BUCKETS
+from app.core.scheduler import SOURCES as SOURCE_JOBS
+from app.core.state import EpisodeStore
+
+
+TOTALS_FILE = Path("/data/metrics_totals.json")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+SOURCES = tuple(key for key, *_ in SOURCE_JOBS)
+
+
+def _load_totals(path: Path) -> dict:
+    try:
+        with path.open("r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_totals(path: Path, totals: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    with tmp.open("w") as f:
+        json.dump(totals, f)
+    os.replace(tmp, path)
+
+
+def accumulate(record: dict, path: Path | None = None) -> dict:
+    """
+    Suma el registro de la pasada a los totales acumulados entre
+    ejecuciones (metrics_totals.json), para que counters e histogramas
+    sean monótonos aunque metrics.prom se reescriba en cada pasada.
+    """
+    path = path or TOTALS_FILE
+    totals = _load_totals(path)
+    totals["runs"] = totals.get("runs", 0) + 1
+
+    for key in ("bytes_downloaded", "bytes_uploaded"):
+        totals[key] = totals.get(key, 0) + record.get(key, 0)
+
+    episodes = totals.setdefault("episodes", {})
+    for src, data in record.get("sources", {}).items():
+        episodes[src] = episodes.get(src, 0) + data.get("episodes", 0)
+
+    failures = totals.setdefault("failures", {})
+    for stage, n in record.get("failures", {}).items():
+        failures[stage] = failures.get(stage, 0) + n
+
+    hists = totals.setdefault("histograms", {})
+    for stage, hist in record.get("histograms", {}).items():
+        acc = hists.setdefault(stage, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        acc["buckets"] = [a + b for a, b in zip(acc["buckets"], hist["buckets"])]
+        acc["sum"] += hist["sum"]
+        acc["count"] += hist["count"]
+
+    _save_totals(path, totals)
+    return totals
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _newest_ages(state: EpisodeStore, now: float) -> list:
+    """[(fuente, canal, segundos desde su episodio más reciente)]."""
+    ages = []
+    for src in SOURCES:
+        for channel, dates in sorted(state.published_history(src).items()):
+            newest = None
+            for ts in dates:
+                try:
+                    dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+                except Exception:
+                    continue
+                if dt.tzinfo is None:
+                    dt = dt.replace(tzinfo=timezone.utc)
+                newest = max(newest or dt.timestamp(), dt.timestamp())
+            if newest is not None:
+                ages.append((src, channel, now - newest))
+    return ages
+
+
+def render_metrics(record: dict, totals: dict, state: EpisodeStore) -> str:
+    """Exposición en formato texto de Prometheus (también válido OpenMetrics)."""
+    now = time.time()
+    out = []
+    try:
+        finished = datetime.fromisoformat(record["timestamp"]).timestamp()
+    except Exception:
+        finished = now
+
+    def metric(name, kind, help_text, samples):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lbl = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            out.append(f"{name}{{{lbl}}} {value}" if lbl else f"{name} {value}")
+
+    metric("sherlocaster_runs_total", "counter", "Pasadas completadas.",
+           [({}, totals.get("runs", 0))])
+    metric("sherlocaster_last_run_timestamp_seconds", "gauge", "Fin de la última pasada (epoch).",
+           [({}, round(finished, 3))])
+    metric("sherlocaster_last_run_duration_seconds", "gauge", "Duración de la última pasada.",
+           [({}, record.get("duration", 0))])
+
+    metric("sherlocaster_episodes_added_total", "counter", "Episodios añadidos por fuente.",
+           [({"source": src}, totals.get("episodes", {}).get(src, 0)) for src in SOURCES])
+    metric("sherlocaster_last_run_episodes_added", "gauge", "Episodios añadidos en la última pasada.",
+           [({"source": src}, record.get("sources", {}).get(src, {}).get("episodes", 0))
+            for src in SOURCES])
+    metric("sherlocaster_episodes_stored", "gauge", "Episodios en el estado.",
+           [({}, state.count())])
+
+    metric("sherlocaster_downloaded_bytes_total", "counter", "Bytes descargados.",
+           [({}, totals.get("bytes_downloaded", 0))])
+    metric("sherlocaster_uploaded_bytes_total", "counter", "Bytes subidos y verificados.",
+           [({}, totals.get("bytes_uploaded", 0))])
+
+    metric("sherlocaster_failures_total", "counter", "Fallos por etapa.",
+           [({"stage": stage}, n) for stage, n in sorted(totals.get("failures", {}).items())])
+
+    name = "sherlocaster_episode_stage_duration_seconds"
+    out.append(f"# HELP {name} Duración por episodio de cada etapa.")
+    out.append(f"# TYPE {name} histogram")
+    for stage, hist in sorted(totals.get("histograms", {}).items()):
+        for le, count in zip(BUCKETS, hist["buckets"]):
+            out.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {count}')
+        out.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+        out.append(f'{name}_sum{{stage="{stage}"}} {round(hist["sum"], 3)}')
+        out.append(f'{name}_count{{stage="{stage}"}} {hist["count"]}')
+
+    metric("sherlocaster_phase_duration_seconds", "gauge",
+           "Tiempo acumulado por fase en la última pasada.",
+           [({"phase": phase}, secs) for phase, secs in record.get("phases", {}).items()])
+
+    metric("sherlocaster_newest_episode_age_seconds", "gauge",
+           "Antigüedad del episodio más reciente de cada canal.",
+           [({"source": src, "channel": ch}, round(age)) for src, ch, age in _newest_ages(state, now)])
+
+    return "\n".join(out) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    path_to_file = None
+
+    def do_GET(self):
+        if self.path not in ("/metrics", "/metrics.prom"):
+            self.send_error(404)
+            return
+        try:
+            body = Path(self.path_to_file).read_bytes()
+        except OSError:
+            self.send_error(503, "metrics.prom aún no generado")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(prom_file: str, port: int = 8085, host: str = "0.0.0.0"):
+    """
+    Sirve metrics.prom en http://host:port/metrics desde un hilo aparte
+    (modo daemon). Siempre devuelve el último archivo escrito.
+    """
+    handler = type("MetricsHandler", (_Handler,), {"path_to_file": prom_file})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    print(f"[Pm] Métricas en http://{host}:{port}/metrics")
+    return server
@@ -1,12 +1,16 @@
+import html
+import json
 import os
+import re
 from pathlib import Path
 from datetime import datetime, timezone
-import shutil
+from app.core.logfile import segments, iter_lines, archive, MAX_LINE
+from app.core.metrics import last_record
+from app.core.prom import accumulate, render_metrics
 
 
 STATUS_DIR = "/data/html"
 LAST_RUN = "/data/last_run.log"
-META = "/data/last_run.meta"
 LOG_DIR = "/data/logs"
 MAX_LOGS = 10
 
@@ -41,98 +45,253 @@ def _format_timestamp(ts: str) -> str:
     except Exception:
         return ts  # fallback si algo no cuadra
 
+EPISODE_TAGS = {
+    "youtube": "[Yt] Añadido:",
+    "twitch": "[Tw] Añadido:",
+    "kick": "[Kick] Añadido episodio:",
+}
+ERROR_TAGS = ("[Error]", "[ERROR]")
+WARN_TAGS = ("[Warn]", "[WARNING]")
+HIGHLIGHT = re.compile(r"\[(Error|ERROR|Warn|WARNING)\]")
+ERROR_RE = re.compile("|".join(map(re.escape, ERROR_TAGS)))
+WARN_RE = re.compile("|".join(map(re.escape, WARN_TAGS)))
+
+
+def _log_base(name: str) -> str:
+    """'20250101-120000.log(.gz)' → '20250101-120000'."""
+    return name.removesuffix(".gz").removesuffix(".log")
+
+
+def _log_file(base: str) -> str:
+    """Log archivado: comprimido, o plano si es anterior a la compresión."""
+    gz = os.path.join(LOG_DIR, f"{base}.log.gz")
+    return gz if os.path.isfile(gz) else os.path.join(LOG_DIR, f"{base}.log")
+
+
+def _list_logs() -> list:
+    """Bases de los logs archivados, de la más reciente a la más antigua."""
+    names = [f for f in os.listdir(LOG_DIR) if f.endswith((".log", ".log.gz"))]
+    return sorted({_log_base(f) for f in names}, reverse=True)
+
+
+def _read_duration(meta_file: str) -> float | None:
+    if not os.path.isfile(meta_file):
+        return None
+    with open(meta_file) as meta:
+        for line in meta:
+            if line.startswith("duration="):
+                try:
+                    return float(line.split("=", 1)[1].strip())
+                except ValueError:
+                    return None
+    return None
+
+
+def _summarize_log(base: str, record: dict | None = None) -> dict:
+    """
+    Resumen de un log archivado (se calcula una sola vez y se guarda en
+    {base}.json junto al log): duración, episodios por fuente y número de
+    líneas con error / warning.
+
+    Duración y episodios salen del registro de métricas de la pasada; sólo
+    los logs antiguos, sin registro, se cuentan buscando en el texto.
+    """
+    summary = {
+        "duration": _read_duration(os.path.join(LOG_DIR, f"{base}.meta")),
+        "episodes": {src: 0 for src in EPISODE_TAGS},
+        "errors": 0,
+        "warnings": 0,
+    }
+    if record:
+        summary["duration"] = record.get("duration")
+        for src, data in record.get("sources", {}).items():
+            summary["episodes"][src] = data.get("episodes", 0)
+
+    for line in iter_lines([_log_file(base)]):
+        if not record:
+            for src, tag in EPISODE_TAGS.items():
+                if tag in line:
+                    summary["episodes"][src] += 1
+        if ERROR_RE.search(line):
+            summary["errors"] += 1
+        if WARN_RE.search(line):
+            summary["warnings"] += 1
+
+    with open(os.path.join(LOG_DIR, f"{base}.json"), "w") as f:
+        json.dump(summary, f)
+    return summary
+
+
+def _load_summary(base: str) -> dict:
+    try:
+        with open(os.path.join(LOG_DIR, f"{base}.json")) as f:
+            return json.load(f)
+    except Exception:
+        # logs archivados antes de existir el resumen (o resumen roto)
+        return _summarize_log(base)
+
+
+def _highlight(text: str) -> str:
+    """Escapa texto de log para HTML y resalta errores y warnings."""
+    return HIGHLIGHT.sub(
+        lambda m: f"<span class='{'err' if m.group(1).lower() == 'error' else 'warn'}'>{m.group(0)}</span>",
+        html.escape(text, quote=False),
+    )
+
+
+def _write_html(path: str, head: str, log_paths: list, tail: str):
+    """
+    Escribe una página con el log dentro de <pre>, línea a línea (memoria
+    constante aunque el log sea enorme). Se escribe a un temporal y se
+    renombra para que nginx nunca sirva una página a medias.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(head)
+        # por bloques de líneas: las etiquetas nunca cruzan de una línea a otra
+        batch, size = [], 0
+        for line in iter_lines(log_paths):
+            batch.append(line)
+            size += len(line)
+            if size >= MAX_LINE:
+                f.write(_highlight("".join(batch)))
+                batch, size = [], 0
+        f.write(_highlight("".join(batch)))
+        f.write(tail)
+    os.replace(tmp, path)
+
+
 def rotate_logs():
     os.makedirs(LOG_DIR, exist_ok=True)
 
-    logs = [f for f in os.listdir(LOG_DIR) if f.endswith(".log")]
-    logs.sort(reverse=True)  # por timestamp lexicográfico = por fecha
-
-    for old in logs[MAX_LOGS:]:
-        base = old.replace(".log", "")
-        os.remove(os.path.join(LOG_DIR, old))
-        meta = os.path.join(LOG_DIR, f"{base}.meta")
-        if os.path.exists(meta):
-            os.remove(meta)
+    # por timestamp lexicográfico = por fecha
+    for base in _list_logs()[MAX_LOGS:]:
+        for ext in (".log", ".log.gz", ".meta", ".json"):
+            path = os.path.join(LOG_DIR, f"{base}{ext}")
+            if os.path.exists(path):
+                os.remove(path)
 
 
-def archive_last_run():
+def archive_last_run(record: dict | None = None):
+    """
+    Archiva last_run.log (con sus trozos rotados) como logs/{ts}.log.gz,
+    lo deja vacío para la próxima pasada y calcula el resumen del índice.
+    """
     os.makedirs(LOG_DIR, exist_ok=True)
 
-    if not os.path.isfile(LAST_RUN):
+    if not segments(LAST_RUN):
         return
 
     ts = datetime.now().strftime("%Y%m%d-%H%M%S")
-    log_dst = os.path.join(LOG_DIR, f"{ts}.log")
-    meta_dst = os.path.join(LOG_DIR, f"{ts}.meta")
+    archive(LAST_RUN, os.path.join(LOG_DIR, f"{ts}.log.gz"))
 
-    # copiar el log actual
-    shutil.copyfile(LAST_RUN, log_dst)
+    # resumen para el índice: así no hay que releer el log en cada publicación
+    _summarize_log(ts, record)
 
-    # copiar metadata
-    if os.path.isfile(META):
-        shutil.copyfile(META, meta_dst)
+    rotate_logs()
 
-    # truncar last_run.log para el próximo run
-    open(LAST_RUN, "w").close()
 
-    rotate_logs()
+def _write_log_page(path: str, base: str, summary: dict, title: str):
+    ts = _parse_log_timestamp(base)
+    duration = "N/D" if summary["duration"] is None else f"{summary['duration']:.1f} s"
+    episodios = sum(summary["episodes"].values())
+    extra = f" — {episodios} new" if episodios > 0 else ""
+
+    head = f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8" />
+<title>{title}</title>
+<meta name="viewport" content="width=device-width, initial-scale=1" />
+<style>
+
+body {{
+    font-family: Arial, sans-serif;
+    padding: 20px;
+}}
+pre {{
+    white-space: pre-wrap;
+    background: #f4f4f4;
+    padding: 10px;
+    border-radius: 5px;
+    font-size: 14px;
+}}
+.err {{ color: red; font-weight: bold; }}
+.warn {{ color: orange; font-weight: bold; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<div><b>Fecha:</b> {ts}</div>
+<div><b>Duración:</b> {duration}{extra}</div>
 
+<h2>Log</h2>
+<pre>"""
+    tail = """</pre>
+
+<a href="logs.html">Volver al histórico</a>
+</body>
+</html>
+"""
+    _write_html(path, head, [_log_file(base)], tail)
 
 
 def publish_logs(title="Histórico de logs"):
+    """
+    Publica el histórico de forma incremental: el índice sale de los
+    resúmenes {base}.json y sólo se renderizan las páginas de logs que
+    aún no existen. Las páginas de logs ya rotados se borran.
+    """
     os.makedirs(LOG_DIR, exist_ok=True)
     os.makedirs(STATUS_DIR, exist_ok=True)
 
-    logs = [f for f in os.listdir(LOG_DIR) if f.endswith(".log")]
-    logs.sort(reverse=True)
+    bases = _list_logs()
 
     # ==========================
-    # 1. Generar logs.html (índice)
+    # 1. Páginas individuales (sólo las nuevas)
     # ==========================
-    if not logs:
+    existing = {
+        f for f in os.listdir(STATUS_DIR)
+        if f.startswith("logs_") and f.endswith(".html")
+    }
+    wanted = {f"logs_{base}.html" for base in bases}
+
+    for stale in existing - wanted:
+        os.remove(os.path.join(STATUS_DIR, stale))
+
+    summaries = {}
+    rendered = 0
+    for base in bases:
+        summaries[base] = _load_summary(base)
+        page = f"logs_{base}.html"
+        if page in existing:
+            continue
+        _write_log_page(os.path.join(STATUS_DIR, page), base, summaries[base], title)
+        rendered += 1
+
+    # ==========================
+    # 2. Generar logs.html (índice)
+    # ==========================
+    if not bases:
         index_html = "<h1>No hay logs disponibles</h1>"
         with open(os.path.join(STATUS_DIR, "logs.html"), "w") as f:
             f.write(index_html)
         return
 
-    # Para el índice necesitamos contar episodios para cada log
     items = []
-    for log in logs:
-        base = log.replace(".log", "")
-        meta_file = os.path.join(LOG_DIR, f"{base}.meta")
-
-        # leer duración si existe
-        duration = "N/D"
-        if os.path.isfile(meta_file):
-            with open(meta_file) as meta:
-                for line in meta:
-                    if line.startswith("duration="):
-                        s = float(line.split("=",1)[1].strip())
-                        duration = f"{s:.1f} s"
-
-        # leer log para contar episodios
-        with open(os.path.join(LOG_DIR, log)) as f:
-            content = f.read()
-
-        episodios = sum(
-            content.count(tag) for tag in ("[Yt] Añadido:", "[Tw] Añadido:")
-        )
+    for base in bases:
+        summary = summaries[base]
 
         # construir texto del enlace
-        ts = _parse_log_timestamp(log).rsplit(":", 1)[0]
-
-        dur = duration
-        try:
-            dur_val = float(duration.replace(" s",""))
-            dur = f"{int(dur_val)} s"
-        except:
-            pass
-
+        ts = _parse_log_timestamp(base).rsplit(":", 1)[0]
+        dur = "N/D" if summary["duration"] is None else f"{int(summary['duration'])} s"
         txt = f"{ts} - {dur}"
 
-        
+        episodios = sum(summary["episodes"].values())
         if episodios > 0:
             txt += f" — {episodios} new"
+        if summary["errors"] > 0:
+            txt += f" — <span class='err'>{summary['errors']} err</span>"
 
         items.append(f"<li><a href='logs_{base}.html'>{txt}</a></li>")
 
@@ -156,6 +315,7 @@ ul {{
 li {{
     margin: 6px 0;
 }}
+.err {{ color: red; font-weight: bold; }}
 </style>
 </head>
 <body>
@@ -171,129 +331,71 @@ li {{
     with open(os.path.join(STATUS_DIR, "logs.html"), "w") as f:
         f.write(index_html)
 
-    # ==========================
-    # 2. Generar logs individuales
-    # ==========================
-
-    for log in logs:
-        with open(os.path.join(LOG_DIR, log)) as f:
-            log_content = f.read()
-
-        base = log.replace(".log", "")
-        meta_file = os.path.join(LOG_DIR, f"{base}.meta")
-
-        ts = _parse_log_timestamp(log)
-        duration = "N/D"
+    print(f"[Pb] logs.html actualizado ({rendered} páginas nuevas de {len(bases)})")
 
-        if os.path.isfile(meta_file):
-            with open(meta_file) as meta:
-                for line in meta:
-                    if line.startswith("duration="):
-                        s = float(line.split("=",1)[1].strip())
-                        duration = f"{s:.1f} s"
 
-        episodios = sum(
-            log_content.count(tag) for tag in ("[Yt] Añadido:", "[Tw] Añadido:")
-        )
+def _format_bytes(n: int) -> str:
+    return f"{n / 1e6:.1f} MB"
 
-        extra = f" — {episodios} new" if episodios > 0 else ""
 
-        html_log = (
-            log_content
-            .replace("\n", "<br>")
-            .replace("[Error]", "<span class='err'>[Error]</span>")
-            .replace("[ERROR]", "<span class='err'>[ERROR]</span>")
-            .replace("[Warn]", "<span class='warn'>[Warn]</span>")
-            .replace("[WARNING]", "<span class='warn'>[WARNING]</span>")
-        )
-
-        html = f"""<!DOCTYPE html>
-<html>
-<head>
-<meta charset="utf-8" />
-<title>{title}</title>
-<meta name="viewport" content="width=device-width, initial-scale=1" />
-<style>
+def _metrics_html(record: dict) -> str:
+    """Fases y episodios por fuente/canal de la última pasada."""
+    phases = ", ".join(
+        f"{name} {secs:.1f} s" for name, secs in record.get("phases", {}).items() if secs
+    )
+    rows = []
+    for src, data in sorted(record.get("sources", {}).items()):
+        channels = ", ".join(f"{ch} ({n})" for ch, n in sorted(data.get("channels", {}).items()))
+        rows.append(f"<li><b>{src}</b>: {data['episodes']} — {channels}</li>")
+
+    return (
+        f"<div class=\"metric\"><b>Fases:</b> {phases or 'N/D'}</div>\n"
+        f"<div class=\"metric\"><b>Descargado:</b> {_format_bytes(record.get('bytes_downloaded', 0))}"
+        f" · <b>Subido:</b> {_format_bytes(record.get('bytes_uploaded', 0))}</div>\n"
+        + (f"<ul>{''.join(rows)}</ul>" if rows else "")
+    )
 
-body {{
-    font-family: Arial, sans-serif;
-    padding: 20px;
-}}
-pre {{
-    white-space: pre-wrap;
-    background: #f4f4f4;
-    padding: 10px;
-    border-radius: 5px;
-    font-size: 14px;
-}}
-.err {{ color: red; font-weight: bold; }}
-.warn {{ color: orange; font-weight: bold; }}
-</style>
-</head>
-<body>
-<h1>{title}</h1>
-<div><b>Fecha:</b> {ts}</div>
-<div><b>Duración:</b> {duration}{extra}</div>
 
-<h2>Log</h2>
-<pre>{html_log}</pre>
+def publish_metrics(record: dict, state) -> str:
+    """
+    Escribe metrics.prom (formato Prometheus) junto a index.html a partir
+    del registro de la pasada y el estado. Devuelve la ruta del archivo.
+    """
+    os.makedirs(STATUS_DIR, exist_ok=True)
+    text = render_metrics(record, accumulate(record), state)
 
-<a href="logs.html">Volver al histórico</a>
-</body>
-</html>
-"""
+    path = os.path.join(STATUS_DIR, "metrics.prom")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
 
-        with open(os.path.join(STATUS_DIR, f"logs_{base}.html"), "w") as f:
-            f.write(html)
+    print("[Pb] metrics.prom actualizado")
+    return path
 
 
-def publish_status(title="Sherlocaster"):
+def publish_status(title="Sherlocaster", record: dict | None = None):
+    """
+    index.html con el log de la última pasada y sus métricas ('record',
+    o si no se pasa, la última línea de runs.jsonl).
+    """
     os.makedirs(STATUS_DIR, exist_ok=True)
+    record = record or last_record() or {}
 
-    # Leer el log
-    if os.path.isfile(LAST_RUN):
-        with open(LAST_RUN, "r") as f:
-            log_content = f.read()
-    else:
-        log_content = "Sin log disponible."
+    # Trozos del log (se leen al escribir la página, línea a línea)
+    log_paths = segments(LAST_RUN)
 
-    # Contar episodios añadidos en esta ejecución
-    episodios = sum(
-        log_content.count(tag) for tag in ("[Yt] Añadido:", "[Tw] Añadido:")
-    )
+    # Episodios añadidos en esta ejecución
+    episodios = record.get("episodes", 0)
 
     # Construir parte opcional
     extra = f" - {episodios} episodios añadidos" if episodios > 0 else ""
 
+    timestamp = record.get("timestamp")
+    timestamp = _format_timestamp(timestamp) if timestamp else "N/D"
+    duration = f"{record['duration']:.1f} s" if record.get("duration") is not None else "N/D"
 
-    # Leer metadata
-    timestamp = "N/D"
-    duration = "N/D"
-
-    if os.path.isfile(META):
-        with open(META, "r") as meta:
-            for line in meta:
-                if line.startswith("timestamp="):
-                    timestamp = line.split("=",1)[1].strip()
-                elif line.startswith("duration="):
-                    s = float(line.split("=",1)[1].strip())
-                    duration = f"{s:.1f} s"
-
-    if timestamp not in ("N/D", None):
-        timestamp = _format_timestamp(timestamp)
-
-
-    # Resaltar errores y warnings
-    html_log = (
-        log_content
-        .replace("\n", "<br>")
-        .replace("[Error]", "<span class='err'>[Error]</span>")
-        .replace("[ERROR]", "<span class='err'>[ERROR]</span>")
-        .replace("[Warn]", "<span class='warn'>[Warn]</span>")
-        .replace("[WARNING]", "<span class='warn'>[WARNING]</span>")
-    )
-
-    html = f"""<!DOCTYPE html>
+    head = f"""<!DOCTYPE html>
 <html>
 <head>
 <meta charset="utf-8" />
@@ -328,15 +430,16 @@ pre {{
 <h1>{title}</h1>
 
 <div class="metric"><b>Última ejecución:</b> {timestamp} ({duration}{extra})</div>
+{_metrics_html(record) if record else ""}
 
 <h2>Log <small><a href="logs.html">(Últimas ejecuciones)</a></small></h2>
-<pre>{html_log}</pre>
+<pre>"""
+    tail = ("" if log_paths else "Sin log disponible.") + """</pre>
 
 </body>
 </html>
 """
 
-    with open(os.path.join(STATUS_DIR, "index.html"), "w") as f:
-        f.write(html)
+    _write_html(os.path.join(STATUS_DIR, "index.html"), head, log_paths, tail)
 
     print("[Pb] index.html actualizado")
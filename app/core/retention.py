@@ -0,0 +1,143 @@
+import os
+from datetime import datetime, timezone
+
+from app.core.state import EpisodeStore
+from app.uploader.rclone import upload_manifest
+
+
+DEFAULTS = {
+    "days": 0,            # 0 → sin límite por antigüedad
+    "max_items": 100,     # episodios que se conservan como mucho
+    "purge_audio": True,  # borrar también el audio (remoto y local)
+}
+
+PENDING_KEY = "retention:pending"  # borrados remotos que fallaron
+
+
+def _episode_time(ep: dict) -> float | None:
+    ts = ep.get("published_at") or ep.get("downloaded_at")
+    if not ts:
+        return None
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def retention_config(config: dict) -> dict:
+    """
+    retention: de config.yaml sobre DEFAULTS.
+
+    Un config.yaml antiguo con rclone.retention_days (que borraba del
+    remoto los MP3 de más de N días) y sin retention.days se traduce a
+    retention.days = N con purge_audio, para no dejar de limpiar el remoto.
+    """
+    retention = config.get("retention") or {}
+    cfg = dict(DEFAULTS, **retention)
+    legacy = config.get("rclone", {}).get("retention_days")
+    if legacy and "days" not in retention:
+        cfg["days"] = legacy
+        cfg["purge_audio"] = True
+    return cfg
+
+
+def expired_episodes(config: dict, episodes: list, now: float | None = None) -> dict:
+    """
+    Calcula una sola vez qué episodios caducan.
+
+    'episodes' va en orden de inserción (como EpisodeStore.episodes()).
+    Devuelve {id: motivo} con motivo "antiguo" (más de retention.days) o
+    "max_items" (fuera de los retention.max_items más recientes).
+    """
+    cfg = retention_config(config)
+    now = now or datetime.now(timezone.utc).timestamp()
+    expired = {}
+
+    if cfg["days"] and cfg["days"] > 0:
+        limit = now - cfg["days"] * 86400
+        for ep in episodes:
+            ts = _episode_time(ep)
+            if ts is not None and ts < limit:
+                expired[ep["id"]] = "antiguo"
+
+    max_items = cfg["max_items"]
+    if max_items is not None and len(episodes) > max_items:
+        for ep in episodes[:len(episodes) - max_items]:
+            expired.setdefault(ep["id"], "max_items")
+
+    return expired
+
+
+def apply_retention(config: dict, state: EpisodeStore, rc=None, dry_run: bool = False) -> dict:
+    """
+    Aplica la retención a la vez en estado, feed y almacenamiento.
+
+    Los episodios caducados se borran del estado (y con ello del feed, que
+    se genera a partir del estado). Con retention.purge_audio sus MP3 se
+    borran del remoto en un único trabajo por lista de archivos, sin
+    recorrer el directorio remoto, y de audio/ si quedaba copia local. Los
+    borrados remotos que fallan se guardan y se reintentan la próxima vez.
+
+    Con dry_run sólo se informa de lo que se haría.
+    """
+    cfg = retention_config(config)
+    if config.get("rclone", {}).get("retention_days"):
+        print("[Rt] Aviso: rclone.retention_days está obsoleto, usa retention.days y retention.purge_audio")
+    episodes = state.episodes()
+    expired = expired_episodes(config, episodes)
+    by_id = {ep["id"]: ep for ep in episodes}
+
+    reasons = {}
+    for reason in expired.values():
+        reasons[reason] = reasons.get(reason, 0) + 1
+    detail = ", ".join(f"{n} {r}" for r, n in sorted(reasons.items())) or "ninguno"
+    prefix = "[Rt][dry-run]" if dry_run else "[Rt]"
+    print(f"{prefix} {len(expired)} de {len(episodes)} episodios caducados ({detail})")
+
+    files = sorted(os.path.basename(by_id[i]["file_path"]) for i in expired if by_id[i].get("file_path"))
+    pending = state.watermark(PENDING_KEY).get("files", [])
+
+    if dry_run:
+        for ep_id, reason in expired.items():
+            print(f"{prefix}   {reason:9} {ep_id} — {by_id[ep_id].get('title', '')}")
+        if cfg["purge_audio"]:
+            print(f"{prefix} Se borrarían {len(files) + len(pending)} archivos remotos")
+        return expired
+
+    if expired:
+        state.delete(expired)
+
+    if not cfg["purge_audio"]:
+        return expired
+
+    # copia local de episodios que no llegaron a subirse
+    audio_dir = os.path.join(
+        config.get("storage", {}).get("base_path", "/data"),
+        config.get("storage", {}).get("audio_dir", "audio"),
+    )
+    for name in files:
+        try:
+            os.remove(os.path.join(audio_dir, name))
+        except OSError:
+            pass
+
+    to_delete = sorted(set(files) | set(pending))
+    if not to_delete or rc is None:
+        return expired
+
+    remote = config.get("rclone", {}).get("remote")
+    remote_path = config.get("rclone", {}).get("path", "")
+    try:
+        rc.delete_files(f"{remote}:{remote_path}", to_delete)
+    except Exception as e:
+        print(f"[Rt] Error borrando {len(to_delete)} archivos remotos, se reintentará: {e}")
+        state.set_watermark(PENDING_KEY, {"files": to_delete})
+        return expired
+
+    upload_manifest().forget(to_delete)
+    state.set_watermark(PENDING_KEY, {"files": []})
+    print(f"[Rt] Borrados {len(to_delete)} archivos remotos")
+    return expired
@@ -1,23 +1,99 @@
 from feedgen.feed import FeedGenerator
+import hashlib
+import json
+import os
 from datetime import datetime, timezone
 from pathlib import Path
+from app.core.state import EpisodeStore
+
+
+DATA_DIR = Path("/data")
+FEED_STATE = DATA_DIR / "feed_state.json"
+ITEM_CACHE = DATA_DIR / "feed_items.json"
+
+
+def _parse_iso(ts: str | None) -> datetime | None:
+    if not ts:
+        return None
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def feed_path(config) -> Path:
+    """Ruta de feed.xml: la misma para generate_feed y para upload_feed."""
+    return DATA_DIR / config['feed']['file_name']
+
+
+def _load_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    try:
+        with path.open("r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_json(path: Path, data: dict):
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _load_feed_state() -> dict:
+    """{"inputs": hash de lo que entra en el feed, "uploaded": hash del último feed subido}"""
+    return _load_json(FEED_STATE)
+
+
+def _save_feed_state(data: dict):
+    _save_json(FEED_STATE, data)
 
-def generate_feed(config, state):
-    feed_file = config['feed']['file_name']
-    base = config['feed']['url_base']
 
+def _item_fields(ep: dict, base: str) -> dict:
+    """
+    Campos del episodio que aparecen en su <item>.
+    Sin accesos al disco: el tamaño se guarda en el episodio al descargarlo.
+    """
+    file_name = ep['file_path'].rsplit("/", 1)[-1]
+
+    return {
+        "title": ep['title'],
+        "guid": ep['id'],
+        "url": f"{base}{file_name}",
+        "length": str(ep.get('size', 0)),
+        "pub_date": ep.get('published_at') or ep.get('downloaded_at'),
+    }
+
+
+def _add_entry(fg: FeedGenerator, fields: dict):
+    fe = fg.add_entry()
+    fe.title(fields['title'])
+    fe.guid(fields['guid'], permalink=False)
+    fe.enclosure(url=fields['url'], type="audio/mpeg", length=fields['length'])
+    if _parse_iso(fields['pub_date']):
+        fe.pubDate(_parse_iso(fields['pub_date']))
+
+
+def _build_feed(feed_cfg: dict, last_build: datetime) -> FeedGenerator:
+    """Canal del feed (metadata e imagen), sin items."""
     fg = FeedGenerator()
     fg.load_extension('podcast')
 
     # --- Metadata opcional ---
-    title = config['feed'].get('title', 'SherloCaster2')
-    link = config['feed'].get('link', 'https://www.sherblog.es')
-    copyright = config['feed'].get('copyright')
-    author = config['feed'].get('author')
+    title = feed_cfg.get('title', 'SherloCaster2')
+    link = feed_cfg.get('link', 'https://www.sherblog.es')
+    copyright = feed_cfg.get('copyright')
+    author = feed_cfg.get('author')
 
     fg.title(title)
     fg.link(href=link, rel='alternate')
-    fg.description(config['feed'].get('description', 'Podcast automatizado desde YouTube y Twitch'))
+    fg.description(feed_cfg.get('description', 'Podcast automatizado desde YouTube y Twitch'))
     fg.language('es')
 
     if copyright:
@@ -27,44 +103,114 @@ def generate_feed(config, state):
         fg.author({'name': author})
 
     # --- Imagen del feed ---
-    image_url = config['feed'].get('image')
+    image_url = feed_cfg.get('image')
     if image_url:
         # RSS estándar
         fg.image(image_url)
 
-    fg.lastBuildDate(datetime.now(timezone.utc))
+    fg.lastBuildDate(last_build)
+    return fg
+
 
-    if "episodes" not in state:
+def _render_item(fields: dict) -> str:
+    """
+    <item> de un episodio tal como lo escribe feedgen en el feed completo
+    (con su sangría y el salto de línea final), renderizado aparte para
+    poder guardarlo en caché.
+    """
+    fg = FeedGenerator()
+    fg.title("item")
+    fg.link(href="http://localhost", rel='alternate')
+    fg.description("item")
+    _add_entry(fg, fields)
+
+    xml = fg.rss_str(pretty=True).decode("utf-8")
+    start = xml.rindex("\n", 0, xml.index("<item>")) + 1
+    end = xml.index("</item>") + len("</item>\n")
+    return xml[start:end]
+
+
+def generate_feed(config, state: EpisodeStore) -> str:
+    """
+    Genera feed.xml con feedgen y devuelve el hash (sha1) de su contenido.
+
+    Cada <item> renderizado se guarda en feed_items.json junto con un hash
+    de sus campos, así que feedgen sólo renderiza los episodios nuevos o
+    modificados; el canal (metadata, autor, imagen) se construye aparte y
+    los items se insertan en él. Si no ha cambiado nada de lo que entra en
+    el feed (hash en feed_state.json) se reutiliza el feed.xml que ya hay
+    en disco. lastBuildDate es la fecha de descarga más reciente (no
+    'ahora'), de modo que el mismo estado produce siempre el mismo feed.
+
+    Sólo entran episodios cuyo MP3 está confirmado en el remoto
+    (uploaded; los anteriores a este campo se dan por subidos).
+    """
+    base = config['feed']['url_base']
+    out_path = feed_path(config)
+
+    episodes = [ep for ep in state.episodes() if ep.get('uploaded', True)]
+    if not episodes:
         print("[Fd] No hay episodios en el estado, feed vacío")
-        state["episodes"] = []
-    
-    episodes = state.get("episodes", [])
-    for ep in episodes:
-        fe = fg.add_entry()
-        fe.title(ep['title'])
-        fe.guid(ep['id'], permalink=False)
 
-        # obtener nombre del archivo real
-        audio_path = Path(ep['file_path'])
-        file_name = audio_path.name
+    cache = _load_json(ITEM_CACHE)
+    new_cache = {}
+    items = []
+    rendered = 0
+
+    # los más recientes primero, como feedgen (add_entry los antepone)
+    for ep in reversed(episodes):
+        fields = _item_fields(ep, base)
+        digest = hashlib.sha1(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+        cached = cache.get(ep['id'])
+        if cached and cached.get("hash") == digest:
+            xml = cached["xml"]
+        else:
+            xml = _render_item(fields)
+            rendered += 1
+
+        new_cache[ep['id']] = {"hash": digest, "xml": xml}
+        items.append(xml)
+
+    if new_cache != cache:
+        _save_json(ITEM_CACHE, new_cache)
+
+    inputs = hashlib.sha1(
+        json.dumps([config['feed'], [c["hash"] for c in new_cache.values()]],
+                   sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+    feed_state = _load_feed_state()
+    if feed_state.get("inputs") == inputs and out_path.exists():
+        print(f"[Fd] Sin cambios en {out_path}")
+        return hashlib.sha1(out_path.read_bytes()).hexdigest()
 
-        # construir url de descarga
-        enclosure_url = f"{base}{file_name}"
+    # lastBuildDate determinista: si no hay episodios nuevos, el feed no cambia
+    build_dates = [_parse_iso(ep.get('downloaded_at')) for ep in episodes]
+    build_dates = [d for d in build_dates if d]
+    last_build = max(build_dates) if build_dates else datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-        # obtener tamaño para <length>
-        length = audio_path.stat().st_size if audio_path.exists() else ep.get('size', 0)
+    channel = _build_feed(config['feed'], last_build).rss_str(pretty=True).decode("utf-8")
+    close = channel.rindex("  </channel>")
+    xml = (channel[:close] + "".join(items) + channel[close:]).encode("utf-8")
 
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(xml)
+    os.replace(tmp, out_path)
 
-        fe.enclosure(
-            url=enclosure_url,
-            type="audio/mpeg",
-            length=str(length)
-        )
+    feed_state["inputs"] = inputs
+    _save_feed_state(feed_state)
+    print(f"[Fd] generado en {out_path} ({rendered} items renderizados)")
+    return hashlib.sha1(xml).hexdigest()
 
-        fe.pubDate(ep['published_at'])
 
-    out_path = Path("/data") / feed_file
-    fg.rss_file(str(out_path))
+def feed_uploaded(digest: str) -> bool:
+    """True si el feed con este hash es el último que se subió bien."""
+    return _load_feed_state().get("uploaded") == digest
 
-    print(f"[Fd] generado en {out_path}")
 
+def mark_feed_uploaded(digest: str):
+    feed_state = _load_feed_state()
+    feed_state["uploaded"] = digest
+    _save_feed_state(feed_state)
@@ -0,0 +1,103 @@
+import copy
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from app.core.state import EpisodeStore
+from app.core.metrics import span
+
+
+# Orden fijo de las fuentes: también es el orden en el que se guardan
+# los episodios nuevos en state.
+SOURCES = [
+    ("youtube", "Yt", "app.downloader.youtube", "process_youtube_source"),
+    ("twitch", "Tw", "app.downloader.twitch", "process_twitch_source"),
+    ("kick", "Kc", "app.downloader.kick", "process_kick_source"),
+]
+
+
+def _split_channels(channels: list, parts: int) -> list:
+    """
+    Reparte los canales en 'parts' bloques contiguos, conservando el orden.
+    """
+    parts = max(1, min(parts, len(channels)))
+    size, extra = divmod(len(channels), parts)
+
+    chunks = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(channels[start:end])
+        start = end
+    return chunks
+
+
+def _build_jobs(config: dict, only=None) -> list:
+    """
+    Construye la lista de trabajos (fuente, bloque de canales) a ejecutar.
+    Cada fuente se divide en tantos bloques como indique 'workers'.
+    Con 'only' se limita a esas fuentes (modo daemon).
+    """
+    src = config.get("sources", {})
+    jobs = []
+
+    for key, tag, module, func in SOURCES:
+        if only is not None and key not in only:
+            continue
+
+        src_cfg = src.get(key, {})
+        if not src_cfg.get("enabled", True):
+            print(f"[{tag}] Disabled → saltando")
+            continue
+
+        channels = src_cfg.get("channels", [])
+        if not channels:
+            print(f"[{tag}] No hay canales definidos en config")
+            continue
+
+        workers = int(src_cfg.get("workers", 1) or 1)
+
+        for idx, chunk in enumerate(_split_channels(channels, workers)):
+            job_cfg = copy.deepcopy(config)
+            job_cfg["sources"][key]["channels"] = chunk
+            jobs.append((key, tag, idx, module, func, job_cfg))
+
+    return jobs
+
+
+def _run_job(job: tuple, state: EpisodeStore) -> list:
+    key, tag, idx, module, func, job_cfg = job
+    try:
+        process = getattr(importlib.import_module(module), func)
+        with span(f"source.{key}"):
+            return process(job_cfg, state) or []
+    except Exception as e:
+        print(f"[{tag}] Error en worker {idx}: {e}")
+        return []
+
+
+def run_sources(config: dict, state: EpisodeStore, only=None) -> list:
+    """
+    Ejecuta todas las fuentes habilitadas en paralelo.
+
+    - sources.<fuente>.workers: nº de workers (bloques de canales) por fuente.
+    - scheduler.max_workers: límite global de workers simultáneos.
+
+    Devuelve los episodios nuevos en orden determinista (orden de SOURCES
+    y, dentro de cada fuente, orden de canales en config.yaml), con
+    independencia de qué worker termine antes.
+    """
+    jobs = _build_jobs(config, only)
+    if not jobs:
+        return []
+
+    max_workers = config.get("scheduler", {}).get("max_workers", len(jobs))
+    max_workers = max(1, min(int(max_workers), len(jobs)))
+    print(f"[Sc] {len(jobs)} workers de fuentes (máx. {max_workers} simultáneos)")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_run_job, job, state) for job in jobs]
+
+    new_episodes = []
+    for fut in futures:
+        new_episodes.extend(fut.result())
+
+    return new_episodes
@@ -1,40 +1,307 @@
 import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
 
 
-STATE_FILE = Path("/data/state.json")
+STATE_FILE = Path("/data/state.json")   # formato antiguo, se migra solo
+STATE_DB = Path("/data/state.db")
 
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    seq          INTEGER PRIMARY KEY AUTOINCREMENT,
+    id           TEXT NOT NULL UNIQUE,
+    source       TEXT,
+    channel      TEXT,
+    published_at TEXT,
+    data         TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_episodes_source ON episodes (source, channel);
 
-def load_state() -> dict:
+CREATE TABLE IF NOT EXISTS rejections (
+    id         TEXT PRIMARY KEY,
+    source     TEXT,
+    reason     TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS watermarks (
+    key        TEXT PRIMARY KEY,
+    data       TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS polls (
+    source    TEXT NOT NULL,
+    channel   TEXT NOT NULL,
+    last_poll REAL NOT NULL,
+    misses    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, channel)
+);
+"""
+
+# Días que se recuerda cada tipo de descarte antes de volver a evaluarlo.
+# Se puede sobrescribir con rejections.ttl_days en config.yaml.
+REJECT_TTL_DAYS = {
+    "antiguo": 365,     # fuera de limit_days
+    "corto": 365,       # por debajo de min_minutes
+    "sin_fecha": 7,
+    "sin_datos": 1,     # fallo al sacar metadata: se reintenta pronto
+}
+
+
+class EpisodeStore:
+    """
+    Almacén de episodios sobre SQLite.
+
+    - has(id): consulta por índice, sin cargar el histórico
+    - add(episodes): inserciones append-only en una transacción
+    - episodes(): lista completa en orden de inserción (para el feed)
+    - reject(id)/rejection(id): índice persistente de vídeos descartados
+    - watermark(key)/set_watermark(key): estado por canal entre ejecuciones
+    - poll(source, channel)/set_poll(...): último sondeo de cada canal (cadence)
+
+    La conexión se comparte entre los workers del scheduler, así que todas
+    las operaciones van protegidas por un lock.
+    """
+
+    def __init__(self, path: Path = STATE_DB):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.execute("DELETE FROM rejections WHERE expires_at < ?", (time.time(),))
+        self._migrate_polls()
+
+    @contextmanager
+    def transaction(self):
+        """Agrupa varias escrituras: o se aplican todas o ninguna."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def has(self, ep_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM episodes WHERE id = ?", (ep_id,)
+            ).fetchone()
+        return row is not None
+
+    def add(self, episodes: list) -> int:
+        """Inserta episodios nuevos (ignora ids ya existentes). Devuelve cuántos."""
+        added = 0
+        with self.transaction() as conn:
+            for ep in episodes:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO episodes (id, source, channel, published_at, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        ep["id"],
+                        ep.get("source"),
+                        ep.get("channel"),
+                        ep.get("published_at"),
+                        json.dumps(ep, ensure_ascii=False),
+                    ),
+                )
+                added += cur.rowcount
+        return added
+
+    def episodes(self, source: str | None = None) -> list:
+        """Episodios en orden de inserción (opcionalmente de una fuente)."""
+        sql = "SELECT data FROM episodes"
+        args = ()
+        if source:
+            sql += " WHERE source = ?"
+            args = (source,)
+        sql += " ORDER BY seq"
+
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [json.loads(r["data"]) for r in rows]
+
+    def published_history(self, source: str) -> dict:
+        """{canal: [published_at, ...]} de una fuente (sin decodificar JSON)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT channel, published_at FROM episodes "
+                "WHERE source = ? AND published_at IS NOT NULL",
+                (source,),
+            ).fetchall()
+
+        history = {}
+        for r in rows:
+            history.setdefault(r["channel"], []).append(r["published_at"])
+        return history
+
+    def set_uploaded(self, ids) -> int:
+        """Marca como subidos (uploaded=True) los episodios indicados."""
+        updated = 0
+        with self.transaction() as conn:
+            for ep_id in ids:
+                row = conn.execute("SELECT data FROM episodes WHERE id = ?", (ep_id,)).fetchone()
+                if row is None:
+                    continue
+                ep = json.loads(row["data"])
+                ep["uploaded"] = True
+                conn.execute(
+                    "UPDATE episodes SET data = ? WHERE id = ?",
+                    (json.dumps(ep, ensure_ascii=False), ep_id),
+                )
+                updated += 1
+        return updated
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+
+    def delete(self, ids) -> int:
+        ids = list(ids)
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM episodes WHERE id = ?", [(i,) for i in ids])
+        return len(ids)
+
+    def trim(self, max_items: int) -> int:
+        """Conserva sólo los max_items episodios más recientes (por inserción)."""
+        with self.transaction() as conn:
+            cur = conn.execute(
+                "DELETE FROM episodes WHERE seq NOT IN "
+                "(SELECT seq FROM episodes ORDER BY seq DESC LIMIT ?)",
+                (max_items,),
+            )
+        return cur.rowcount
+
+    def reject(self, ep_id: str, source: str, reason: str, ttl_days: float):
+        """Recuerda que ep_id se descartó por 'reason' durante ttl_days."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rejections (id, source, reason, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (ep_id, source, reason, time.time() + ttl_days * 86400),
+            )
+
+    def rejection(self, ep_id: str, limit_days=None) -> str | None:
+        """
+        Motivo por el que ep_id está descartado, o None si no lo está.
+
+        Los descartes 'antiguo' se guardan con el limit_days con el que se
+        hicieron (ver old_reason): si ahora limit_days es mayor (o no hay
+        límite), el vídeo se vuelve a evaluar.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reason FROM rejections WHERE id = ? AND expires_at >= ?",
+                (ep_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+
+        reason, _, days = row["reason"].partition(":")
+        if reason == "antiguo":
+            try:
+                if limit_days is None or float(days) < limit_days:
+                    return None
+            except ValueError:
+                return None   # formato antiguo, sin límite guardado
+        return reason
+
+    def watermark(self, key: str) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM watermarks WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row["data"]) if row else {}
+
+    def set_watermark(self, key: str, data: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watermarks (key, data, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(data), time.time()),
+            )
+
+    def poll(self, source: str, channel: str) -> dict:
+        """{"last_poll": epoch, "misses": n} del canal, o {} si nunca se sondeó."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_poll, misses FROM polls WHERE source = ? AND channel = ?",
+                (source, channel),
+            ).fetchone()
+        return dict(row) if row else {}
+
+    def set_poll(self, source: str, channel: str, last_poll: float, misses: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO polls (source, channel, last_poll, misses) VALUES (?, ?, ?, ?)",
+                (source, channel, last_poll, misses),
+            )
+
+    def _migrate_polls(self):
+        """Pasa a 'polls' el estado de sondeo guardado antes en watermarks (poll:<fuente>:<canal>)."""
+        with self.transaction() as conn:
+            rows = conn.execute("SELECT key, data FROM watermarks WHERE key LIKE 'poll:%'").fetchall()
+            for row in rows:
+                _, source, channel = row["key"].split(":", 2)
+                data = json.loads(row["data"])
+                conn.execute(
+                    "INSERT OR IGNORE INTO polls (source, channel, last_poll, misses) VALUES (?, ?, ?, ?)",
+                    (source, channel, data.get("last_poll", 0), data.get("misses", 0)),
+                )
+            conn.execute("DELETE FROM watermarks WHERE key LIKE 'poll:%'")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _migrate_json(store: EpisodeStore):
     """
-    Carga el estado desde state.json.
-    Si no existe, devuelve un estado inicial válido.
+    Importa state.json (formato antiguo) si la base de datos está vacía.
+    El JSON se renombra a state.json.migrated para no volver a importarlo.
     """
-    if not STATE_FILE.exists():
-        return {"episodes": []}
+    if not STATE_FILE.exists() or store.count() > 0:
+        return
 
     try:
         with STATE_FILE.open("r") as f:
-            return json.load(f)
-    except Exception:
-        return {"episodes": []}
+            episodes = json.load(f).get("episodes", [])
+    except Exception as e:
+        # no lo tocamos: mejor revisar a mano que perder el histórico
+        print(f"[St] Error leyendo {STATE_FILE}, no se migra: {e}")
+        return
+
+    added = store.add([ep for ep in episodes if isinstance(ep, dict) and "id" in ep])
+    os.replace(STATE_FILE, STATE_FILE.with_suffix(".json.migrated"))
+    print(f"[St] Migrados {added} episodios de {STATE_FILE} a {store.path}")
+
+
+def old_reason(limit_days) -> str:
+    """Motivo de descarte 'antiguo' ligado al limit_days que lo provocó."""
+    return f"antiguo:{limit_days}"
+
+
+def rejection_ttl(config: dict, reason: str) -> float:
+    """TTL en días para un motivo de descarte (config.yaml o por defecto)."""
+    ttl = config.get("rejections", {}).get("ttl_days", {})
+    return ttl.get(reason, REJECT_TTL_DAYS.get(reason, 7))
 
 
-def save_state(state: dict, config=None):
+def load_state() -> EpisodeStore:
     """
-    Guarda el estado y aplica retención.
+    Abre el almacén de episodios (state.db), migrando state.json si existe.
     """
-    max_items = 100
-    if config:
-        max_items = config.get("max_items", max_items)
-
-    # aplicar retención
-    episodes = state.get("episodes", [])
-    episodes = episodes[-max_items:]
-    state["episodes"] = episodes
-
-    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with STATE_FILE.open("w") as f:
-        json.dump(state, f, indent=2)
+    store = EpisodeStore(STATE_DB)
+    _migrate_json(store)
+    return store
 
@@ -0,0 +1,273 @@
+import os
+import re
+import shutil
+import subprocess
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+from app.core.checkpoint import load_checkpoint, save_checkpoint, clear_checkpoint
+from app.core.metrics import run_metrics, run_cmd, span
+
+
+# segmentos entre checkpoints de la descarga (~10-20 min de audio en Twitch/Kick)
+CHUNK_SEGMENTS = 100
+
+
+def http_get(url: str, timeout: int = 30) -> bytes:
+    """GET sencillo con urllib; lanza excepción si algo falla."""
+    req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        return r.read()
+
+
+def parse_media_playlist(text: str, base_url: str) -> tuple:
+    """
+    Parsea una media playlist (.m3u8 de variante).
+
+    Devuelve (init_url | None, [segment_url, ...]) con URLs absolutas.
+    init_url es el segmento de inicialización (#EXT-X-MAP) de los VODs fMP4.
+    """
+    init_url = None
+    segments = []
+
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MAP:"):
+            m = re.search(r'URI="([^"]+)"', line)
+            if m:
+                init_url = urljoin(base_url, m.group(1))
+        elif line and not line.startswith("#"):
+            segments.append(urljoin(base_url, line))
+
+    return init_url, segments
+
+
+def _fetch_with_retries(url: str, fetch, retries: int) -> bytes:
+    for attempt in range(retries + 1):
+        try:
+            data = fetch(url)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+            continue
+        run_metrics().add("bytes_downloaded", len(data))
+        return data
+
+
+def iter_segments(init_url, segments: list, fetch=http_get, workers: int = 1, retries: int = 2):
+    """
+    Descarga los segmentos con un pool acotado de 'workers' hilos y los
+    devuelve uno a uno (bytes) en el orden de la playlist.
+
+    Como mucho hay 2 * workers segmentos en vuelo o en memoria, así que el
+    consumo no depende de la duración del VOD. Cada segmento se reintenta
+    'retries' veces con espera exponencial antes de abortar.
+    """
+    urls = ([init_url] if init_url else []) + list(segments)
+    workers = max(1, int(workers))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        it = iter(urls)
+
+        def _submit_next():
+            url = next(it, None)
+            if url is not None:
+                pending.append(pool.submit(_fetch_with_retries, url, fetch, retries))
+
+        for _ in range(2 * workers):
+            _submit_next()
+
+        try:
+            while pending:
+                data = pending.popleft().result()
+                _submit_next()
+                yield data
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
+def encode_stream(chunks, output_path: Path, bitrate: str, tag: str = "Hls") -> bool:
+    """
+    Alimenta un único ffmpeg por stdin con los trozos recibidos y los
+    codifica a MP3 mono. El único fichero que se escribe es output_path.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    cmd = [
+        "ffmpeg", "-y",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", "pipe:0",
+        "-vn",
+        "-ac", "1",
+        "-acodec", "libmp3lame",
+        "-b:a", bitrate,
+        str(output_path),
+    ]
+
+    # el span incluye la descarga de segmentos que alimenta a ffmpeg
+    with span("ffmpeg.stream", file=output_path.name):
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+            proc.stdin.close()
+        except Exception as e:
+            print(f"[{tag}] Error en streaming a ffmpeg: {e}")
+            proc.kill()
+            proc.wait()
+            output_path.unlink(missing_ok=True)
+            return False
+
+        proc.wait()
+
+    if proc.returncode != 0:
+        print(f"[{tag}] ffmpeg falló con código {proc.returncode}")
+        output_path.unlink(missing_ok=True)
+        return False
+
+    return True
+
+
+def encode_streamed(init_url, segments: list, output_path: Path, bitrate: str,
+                    work_dir: Path, ep_id: str, fetch=http_get, workers: int = 1,
+                    retries: int = 2, tag: str = "Hls") -> bool:
+    """
+    iter_segments + encode_stream: los segmentos van de la red a ffmpeg sin
+    pasar por disco y el único fichero escrito es el MP3.
+
+    El MP3 se escribe en work_dir y se mueve a output_path al terminar,
+    así que en audio/ nunca hay un MP3 a medias. No es reanudable: si se
+    interrumpe, el episodio empieza de cero (ver encode_resumable).
+    """
+    if not segments:
+        print(f"[{tag}] {ep_id}: playlist sin segmentos")
+        return False
+
+    output_path = Path(output_path)
+    tmp_path = Path(work_dir) / f"{ep_id}.tmp.mp3"
+    chunks = iter_segments(init_url, segments, fetch=fetch, workers=workers, retries=retries)
+    if not encode_stream(chunks, tmp_path, bitrate, tag=tag):
+        return False
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(tmp_path, output_path)
+    return True
+
+
+def fetch_resumable(init_url, segments: list, work_dir: Path, ep_id: str, fetch=http_get,
+                    workers: int = 1, retries: int = 2, chunk_segments: int = CHUNK_SEGMENTS,
+                    tag: str = "Hls") -> Path | None:
+    """
+    Descarga los segmentos tal cual (TS o fMP4, sin recodificar) a un único
+    fichero work_dir/<ep_id>.ts, reanudable entre ejecuciones.
+
+    Tras cada bloque de 'chunk_segments' segmentos se guarda un checkpoint
+    con el índice del siguiente segmento y los bytes escritos; si el
+    proceso muere, la siguiente ejecución recorta el fichero a ese tamaño
+    y continúa desde ahí. Devuelve la ruta del fichero o None si falla.
+    """
+    if not segments:
+        print(f"[{tag}] {ep_id}: playlist sin segmentos")
+        return None
+
+    work_dir = Path(work_dir)
+    raw = work_dir / f"{ep_id}.ts"
+    ckpt = load_checkpoint(work_dir, ep_id)
+
+    # si la playlist ha cambiado o el fichero no cuadra, el checkpoint no sirve
+    if (ckpt.get("total") != len(segments) or "bytes" not in ckpt
+            or not raw.exists() or raw.stat().st_size < ckpt["bytes"]):
+        ckpt = {}
+
+    next_segment = ckpt.get("segment", 0)
+    if next_segment:
+        print(f"[{tag}] {ep_id}: reanudando en el segmento {next_segment}/{len(segments)}")
+
+    chunk_segments = max(1, int(chunk_segments))
+    try:
+        with raw.open("r+b" if ckpt else "wb") as f:
+            f.truncate(ckpt.get("bytes", 0))
+            f.seek(0, os.SEEK_END)
+
+            # en VODs fMP4 el segmento de inicialización va una vez, al principio
+            init = None if next_segment else init_url
+            for start in range(next_segment, len(segments), chunk_segments):
+                end = min(start + chunk_segments, len(segments))
+                for data in iter_segments(init, segments[start:end], fetch=fetch,
+                                          workers=workers, retries=retries):
+                    f.write(data)
+                init = None
+
+                f.flush()
+                save_checkpoint(work_dir, ep_id, {"total": len(segments), "segment": end, "bytes": f.tell()})
+    except Exception as e:
+        print(f"[{tag}] {ep_id}: error descargando segmentos: {e}")
+        return None
+
+    return raw
+
+
+def encode_fetched(raw: Path, output_path: Path, bitrate: str, work_dir: Path,
+                   ep_id: str, tag: str = "Hls") -> bool:
+    """
+    Codifica lo descargado con fetch_resumable a MP3 mono con un único
+    ffmpeg (sin uniones entre bloques, que dejarían huecos audibles).
+
+    El MP3 se escribe en work_dir y se mueve a output_path al terminar,
+    así que en audio/ nunca hay un MP3 a medias. Si todo va bien se borran
+    el fichero descargado y el checkpoint.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = Path(work_dir) / f"{ep_id}.tmp.mp3"
+
+    cmd = [
+        "ffmpeg", "-y",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", str(raw),
+        "-vn",
+        "-ac", "1",
+        "-acodec", "libmp3lame",
+        "-b:a", bitrate,
+        str(tmp_path),
+    ]
+    res = run_cmd(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if res.returncode != 0:
+        print(f"[{tag}] ffmpeg falló con código {res.returncode}")
+        tmp_path.unlink(missing_ok=True)
+        return False
+
+    shutil.move(tmp_path, output_path)
+    Path(raw).unlink(missing_ok=True)
+    clear_checkpoint(work_dir, ep_id)
+    return True
+
+
+def encode_resumable(init_url, segments: list, output_path: Path, bitrate: str,
+                     work_dir: Path, ep_id: str, fetch=http_get, workers: int = 1,
+                     retries: int = 2, chunk_segments: int = CHUNK_SEGMENTS, tag: str = "Hls") -> bool:
+    """
+    fetch_resumable + encode_fetched: descarga reanudable de los segmentos
+    a work_dir (storage.temp_dir) y una sola codificación a output_path.
+    A cambio, el VOD entero pasa por disco antes de codificarse.
+    """
+    raw = fetch_resumable(init_url, segments, work_dir, ep_id, fetch=fetch, workers=workers,
+                          retries=retries, chunk_segments=chunk_segments, tag=tag)
+    if raw is None:
+        return False
+    return encode_fetched(raw, output_path, bitrate, work_dir, ep_id, tag=tag)
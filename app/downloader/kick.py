@@ -1,7 +1,34 @@
 import os
 import datetime
 import subprocess
+import threading
+import time
 from curl_cffi import requests as cf
+from pathlib import Path
+from app.core.cadence import ChannelPoller
+from app.uploader.rclone import upload_stage
+from app.core.checkpoint import temp_dir
+from app.core.logfile import log_block
+from app.core.state import EpisodeStore, rejection_ttl
+from app.core.metrics import run_metrics, run_cmd
+from app.downloader.hls import parse_media_playlist, encode_streamed, encode_resumable
+
+
+_local = threading.local()
+
+
+def _session():
+    """Sesión curl_cffi (impersonando Chrome) reutilizada por cada hilo."""
+    if getattr(_local, "session", None) is None:
+        _local.session = cf.Session(impersonate="chrome120")
+    return _local.session
+
+
+def _fetch(url: str) -> bytes:
+    r = _session().get(url, timeout=30)
+    if r.status_code != 200:
+        raise RuntimeError(f"HTTP {r.status_code} en {url}")
+    return r.content
 
 
 def fetch_vods(channel: str, limit: int = 30, limit_days: int = 0):
@@ -13,7 +40,8 @@ def fetch_vods(channel: str, limit: int = 30, limit_days: int = 0):
         "id": ...,
         "title": ...,
         "date": ...,
-        "m3u8": ...
+        "m3u8": ...,
+        "duration_sec": ...   (0 si la API no lo da)
     }
     """
     url = f"https://kick.com/api/v2/channels/{channel}/videos?limit={limit}"
@@ -29,6 +57,7 @@ def fetch_vods(channel: str, limit: int = 30, limit_days: int = 0):
     r = cf.get(url, headers=headers, impersonate="chrome120")
     if r.status_code != 200:
         print(f"[Kick] HTTP {r.status_code}: {r.text[:200]}")
+        run_metrics().fail("listing")
         return []
 
     vods = r.json()
@@ -64,6 +93,8 @@ def fetch_vods(channel: str, limit: int = 30, limit_days: int = 0):
                 "title": title,
                 "date": date,
                 "m3u8": m3u8,
+                # la API da la duración en milisegundos
+                "duration_sec": int(v.get("duration") or 0) // 1000,
             }
         )
 
@@ -91,13 +122,21 @@ def _build_variant_m3u8(master_url: str, text: str) -> str:
     return f"{base}/{variant}"
 
 
-def download_kick_audio(m3u8_master_url: str, output_path: str, audio_bitrate: str = "64k") -> bool:
+def download_kick_audio(m3u8_master_url: str, output_path: str, work_dir: Path,
+                        audio_bitrate: str = "64k", segment_workers: int = 4,
+                        retries: int = 3, resume: bool = False) -> bool:
     """
-    Descarga el audio desde un master.m3u8 de Kick y lo convierte a MP3
-    usando ffmpeg. Devuelve True si todo va bien.
+    Descarga el audio desde un master.m3u8 de Kick y lo convierte a MP3.
+
+    Los segmentos de la variante se descargan en paralelo (pool acotado,
+    con reintentos) y se pasan en orden a ffmpeg por stdin; en disco sólo
+    queda el MP3 (a medias en work_dir hasta terminar). Con resume se
+    guardan antes en work_dir con checkpoints (se reanuda si se
+    interrumpe) y se codifican al final con un único ffmpeg.
+    Devuelve True si todo va bien.
     """
     try:
-        r = cf.get(m3u8_master_url, impersonate="chrome120")
+        r = _session().get(m3u8_master_url, timeout=30)
         if r.status_code != 200:
             print(f"[Kick] Error al obtener master.m3u8 ({r.status_code})")
             return False
@@ -106,38 +145,23 @@ def download_kick_audio(m3u8_master_url: str, output_path: str, audio_bitrate: s
         variant_url = _build_variant_m3u8(m3u8_master_url, text)
         print(f"[Kick] Descargando audio desde: {variant_url}")
 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-hide_banner",
-            "-loglevel", "error",
-            "-headers",
-            "User-Agent: Mozilla/5.0",
-            "-i",
-            variant_url,
-            "-map",
-            "-ac", "1",
-            "0:a:0",
-            "-acodec",
-            "libmp3lame",
-            "-b:a",
-            audio_bitrate,
-            output_path,
-        ]
-
-        res = subprocess.run(
-            cmd,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        r = _session().get(variant_url, timeout=30)
+        if r.status_code != 200:
+            print(f"[Kick] Error al obtener la variante ({r.status_code})")
+            return False
 
-        if res.returncode != 0:
-            print(f"[Kick] ffmpeg falló con código {res.returncode}")
+        init_url, segments = parse_media_playlist(r.text, variant_url)
+        if not segments:
+            print("[Kick] Variante sin segmentos")
             return False
 
-        return True
+        print(f"[Kick] {len(segments)} segmentos, {segment_workers} en paralelo")
+        encode = encode_resumable if resume else encode_streamed
+        return encode(
+            init_url, segments, output_path, audio_bitrate,
+            work_dir, Path(output_path).stem, fetch=_fetch,
+            workers=segment_workers, retries=retries, tag="Kick",
+        )
     except Exception as e:
         print(f"[Kick] Excepción en download_kick_audio: {e}")
         return False
@@ -160,7 +184,7 @@ def get_audio_duration_sec(path: str) -> int:
             "-of",
             "csv=p=0",
         ]
-        out = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode().strip()
+        out = run_cmd(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
         if not out:
             return 0
         return int(float(out))
@@ -182,26 +206,36 @@ def _normalize_kick_date(date_str: str | None) -> str | None:
         return date_str
 
 
-def process_kick_source(config: dict, state: dict) -> dict:
+def process_kick_source(config: dict, state: EpisodeStore) -> list:
     """
     Función principal que espera main.py (misma firma que youtube/twitch).
 
     - Lee la configuración de Kick en config['sources']['kick'].
     - Lista VODs de los canales.
     - Descarga el audio completo de cada VOD (si no existe ya).
-    - Genera episodios en state['episodes'] con el mismo esquema que YouTube/Twitch.
+    - Devuelve los episodios nuevos con el mismo esquema que YouTube/Twitch
+      (main.py se encarga de guardarlos en state).
     """
 
     kick_cfg = config.get("sources", {}).get("kick", {})
     if not kick_cfg.get("enabled", False):
         print("[Kick] Disabled → saltando")
-        return state
+        return []
 
     channels_cfg = kick_cfg.get("channels", [])
     content = kick_cfg.get("content", "vods")
     limit_days = kick_cfg.get("limit_days", 0)
     limit = kick_cfg.get("limit", 30)
+    min_minutes = kick_cfg.get("min_minutes", 0)
     audio_bitrate = kick_cfg.get("audio_bitrate", "64k")
+    segment_workers = kick_cfg.get("segment_workers", 4)
+    segment_retries = kick_cfg.get("segment_retries", 3)
+    resume = kick_cfg.get("resume", False)  # True → segmentos a temp_dir, reanudables
+    storage = config.get("storage", {})
+    audio_dir = os.path.join(storage.get("base_path", "/data"), storage.get("audio_dir", "audio"))
+    work_dir = temp_dir(config)
+    uploads = upload_stage(config)
+    poller = ChannelPoller(config, state, "kick", "Kc")
     fmt = kick_cfg.get("format", "mp3")
 
     if fmt != "mp3":
@@ -209,73 +243,109 @@ def process_kick_source(config: dict, state: dict) -> dict:
 
     if not channels_cfg:
         print("[Kc] No hay canales definidos en config")
-        return state
+        return []
 
     print(
         f"[Kc] Config → content={content}, limit={limit}, "
         f"limit_days={limit_days}, audio_bitrate={audio_bitrate}"
     )
 
-    # aseguramos estructura de state
-    episodes = state.setdefault("episodes", [])
-
-    # conjunto de IDs ya descargados para evitar duplicados
-    existing_ids = {
-        ep.get("id")
-        for ep in episodes
-        if isinstance(ep, dict) and "id" in ep
-    }
+    # IDs vistos en esta ejecución; los ya guardados se consultan en state
+    existing_ids = set()
 
     new_eps = []
 
     for ch in channels_cfg:
-        # soporta tanto string como dict
-        if isinstance(ch, str):
-            channel_slug = ch
-            channel_name = ch
-        elif isinstance(ch, dict):
-            channel_slug = ch.get("channel") or ch.get("name")
-            channel_name = ch.get("name", channel_slug)
-        else:
-            print("[Kc] Entrada inválida en 'channels':", ch)
-            continue
+        with log_block():
+            # soporta tanto string como dict
+            if isinstance(ch, str):
+                channel_slug = ch
+                channel_name = ch
+            elif isinstance(ch, dict):
+                channel_slug = ch.get("channel") or ch.get("name")
+                channel_name = ch.get("name", channel_slug)
+            else:
+                print("[Kc] Entrada inválida en 'channels':", ch)
+                continue
 
-        if not channel_slug:
-            print("[Kc] Canal sin 'channel' ni 'name', saltando:", ch)
-            continue
+            if not channel_slug:
+                print("[Kc] Canal sin 'channel' ni 'name', saltando:", ch)
+                continue
 
-        print(f"[Kc] Procesando canal: {channel_name} ({channel_slug})")
+            if not poller.due(channel_name):
+                continue
 
-        vods = fetch_vods(channel_slug, limit=limit, limit_days=limit_days)
-        if not vods:
-            print(f"[Kick] Sin VODs para {channel_slug}")
-            continue
+            print(f"[Kc] Procesando canal: {channel_name} ({channel_slug})")
 
-        for v in vods:
-            raw_id = v.get("id")
-            if raw_id is None:
+            with run_metrics().phase("listing"):
+                vods = fetch_vods(channel_slug, limit=limit, limit_days=limit_days)
+            if not vods:
+                print(f"[Kick] Sin VODs para {channel_slug}")
+                poller.done(channel_name, 0)
                 continue
 
-            episode_id = f"kck_{raw_id}"
-            if episode_id in existing_ids:
-                print(f"[Kc] Ya existe episodio {episode_id}, saltando")
-                continue
+            # VODs a descargar: la descarga (horas) va fuera del bloque de
+            # log, para que su progreso salga línea a línea
+            pending = []
 
-            m3u8_url = v.get("m3u8")
-            if not m3u8_url:
-                continue
+            for v in vods:
+                raw_id = v.get("id")
+                if raw_id is None:
+                    continue
+
+                episode_id = f"kck_{raw_id}"
+
+                if episode_id in existing_ids or state.has(episode_id):
+                    print(f"[Kc] Ya existe episodio {episode_id}, saltando")
+                    continue
+
+                # Descartado en una ejecución anterior
+                reason = state.rejection(episode_id)
+                if reason:
+                    print(f"[Kc] {episode_id} descartado ({reason})")
+                    continue
+
+                # Descarta el episodio si es corto
+                api_duration = v.get("duration_sec", 0)
+                if api_duration > 0 and api_duration / 60 < min_minutes:
+                    print(f"[Kc] {episode_id} < {min_minutes} min")
+                    state.reject(episode_id, "kick", "corto", rejection_ttl(config, "corto"))
+                    continue
 
+                m3u8_url = v.get("m3u8")
+                if not m3u8_url:
+                    continue
+
+                pending.append((v, raw_id, episode_id, m3u8_url))
+
+        added = 0
+        for v, raw_id, episode_id, m3u8_url in pending:
             # nombre de archivo y ruta
             filename = f"{episode_id}.mp3"
-            file_path = os.path.join("/data/audio", filename)
-
-            # descargar audio
-            ok = download_kick_audio(m3u8_url, file_path, audio_bitrate=audio_bitrate)
+            file_path = os.path.join(audio_dir, filename)
+
+            # descargar audio (segmentos directos a ffmpeg: descarga y
+            # codificación van juntas y cuentan como descarga)
+            started = time.monotonic()
+            with run_metrics().phase("download"):
+                ok = download_kick_audio(
+                    m3u8_url,
+                    file_path,
+                    audio_bitrate=audio_bitrate,
+                    segment_workers=segment_workers,
+                    retries=segment_retries,
+                    work_dir=work_dir,
+                    resume=resume,
+                )
             if not ok:
                 print(f"[Kick] No se pudo descargar {episode_id}")
+                run_metrics().fail("download")
                 continue
+            run_metrics().observe("download", time.monotonic() - started)
 
             duration_sec = get_audio_duration_sec(file_path)
+            size = os.path.getsize(file_path)
+            uploads.submit(file_path)
             published_at = _normalize_kick_date(v.get("date"))
             downloaded_at = datetime.datetime.utcnow().isoformat() + "Z"
 
@@ -292,12 +362,15 @@ def process_kick_source(config: dict, state: dict) -> dict:
                 "published_at": published_at,
                 "downloaded_at": downloaded_at,
                 "file_path": file_path,
+                "size": size,
                 "duration_sec": duration_sec,
             }
 
-            episodes.append(episode)
             existing_ids.add(episode_id)
             new_eps.append(episode)
+            added += 1
             print(f"[Kick] Añadido episodio: {episode_id}")
 
+        poller.done(channel_name, added)
+
     return new_eps
@@ -0,0 +1,120 @@
+import queue
+import threading
+import time
+from app.core.metrics import run_metrics, span
+
+
+_STOP = object()
+
+
+def _job_id(job):
+    return job.get("ep_id") if isinstance(job, dict) else None
+
+
+class Pipeline:
+    """
+    Pipeline de dos etapas: descarga (red) → codificación (CPU).
+
+    Los trabajos se encolan con submit(); cada etapa tiene su propio nº de
+    workers y entre ambas hay una cola acotada, de modo que mientras ffmpeg
+    codifica el episodio N ya se está descargando el N+1.
+
+    - download(job) -> intermedio | None
+    - encode(job, intermedio) -> resultado | None
+
+    Un None o una excepción en cualquier etapa marca el trabajo como fallido.
+    """
+
+    def __init__(self, download, encode, download_workers: int = 1,
+                 encode_workers: int = 1, tag: str = "Pp"):
+        self._download = download
+        self._encode = encode
+        self._tag = tag
+        self._jobs = []
+        self._results = {}
+        self._lock = threading.Lock()
+
+        download_workers = max(1, int(download_workers))
+        encode_workers = max(1, int(encode_workers))
+
+        self._dl_queue = queue.Queue()
+        # cola acotada: si la codificación va por detrás, la descarga espera
+        self._enc_queue = queue.Queue(maxsize=download_workers + encode_workers)
+
+        self._dl_threads = [
+            threading.Thread(target=self._download_worker, daemon=True)
+            for _ in range(download_workers)
+        ]
+        self._enc_threads = [
+            threading.Thread(target=self._encode_worker, daemon=True)
+            for _ in range(encode_workers)
+        ]
+        for t in self._dl_threads + self._enc_threads:
+            t.start()
+
+    def submit(self, job):
+        idx = len(self._jobs)
+        self._jobs.append(job)
+        self._dl_queue.put((idx, job))
+
+    def _set_result(self, idx, result):
+        with self._lock:
+            self._results[idx] = result
+
+    def _run_stage(self, stage: str, label: str, fn, job, *args):
+        """Ejecuta una etapa con su fase, span, duración y fallos en métricas."""
+        metrics = run_metrics()
+        start = time.monotonic()
+        try:
+            # sin log_block: una descarga puede durar horas y su progreso
+            # tiene que ir saliendo línea a línea
+            with metrics.phase(stage), span(f"{self._tag}.{stage}", episode=_job_id(job)):
+                result = fn(job, *args)
+        except Exception as e:
+            print(f"[{self._tag}] Error en {label}: {e}")
+            result = None
+
+        if result is None:
+            metrics.fail(stage)
+        else:
+            metrics.observe(stage, time.monotonic() - start)
+        return result
+
+    def _download_worker(self):
+        while True:
+            item = self._dl_queue.get()
+            if item is _STOP:
+                return
+            idx, job = item
+            intermediate = self._run_stage("download", "descarga", self._download, job)
+
+            if intermediate is None:
+                self._set_result(idx, None)
+                continue
+            self._enc_queue.put((idx, job, intermediate))
+
+    def _encode_worker(self):
+        while True:
+            item = self._enc_queue.get()
+            if item is _STOP:
+                return
+            idx, job, intermediate = item
+            result = self._run_stage("encode", "codificación", self._encode, job, intermediate)
+            self._set_result(idx, result)
+
+    def results(self) -> list:
+        """
+        Espera a que terminen todos los trabajos y devuelve
+        [(job, resultado | None)] en el orden en que se encolaron.
+        """
+        for _ in self._dl_threads:
+            self._dl_queue.put(_STOP)
+        for t in self._dl_threads:
+            t.join()
+
+        for _ in self._enc_threads:
+            self._enc_queue.put(_STOP)
+        for t in self._enc_threads:
+            t.join()
+
+        return [(job, self._results.get(idx)) for idx, job in enumerate(self._jobs)]
@@ -1,15 +1,24 @@
-import subprocess
+import json
+import time
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 import os
+from app.core.cadence import ChannelPoller
+from app.core.state import EpisodeStore, rejection_ttl, old_reason
+from app.core.logfile import log_block
+from app.core.metrics import run_metrics, run_cmd
+from app.downloader.pipeline import Pipeline
+from app.uploader.rclone import upload_stage
+from app.downloader.hls import http_get, parse_media_playlist, encode_streamed, fetch_resumable, encode_fetched
 
 def _run(cmd: list):
     """Ejecuta un comando y devuelve stdout como texto, lanza error si algo falla."""
-    return subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return run_cmd(cmd, capture_output=True, text=True, check=True)
 
 
-def _download_mkv(video_id: str, out_path: Path, token: str):
+def _download_mkv(video_id: str, out_path: Path, token: str) -> Path:
     """Descarga el audio_only de Twitch en MKV usando twitch-dl."""
+    out_path.unlink(missing_ok=True)  # MKV a medias de una ejecución cortada
     cmd = [
         "twitch-dl", "download", video_id,
         "-q", "audio_only",
@@ -18,12 +27,15 @@ def _download_mkv(video_id: str, out_path: Path, token: str):
     ]
     print(f"[Tw] Ejecutando: {' '.join(cmd)}")
     _run(cmd)
+    return out_path
 
 
-def _convert_to_mp3(mkv_path: Path, mp3_path: Path, bitrate: str):
-    """Convierte MKV -> MP3 usando ffmpeg."""
+def _convert_to_mp3(mkv_path: Path, mp3_path: Path, bitrate: str) -> Path:
+    """Convierte MKV -> MP3 usando ffmpeg y borra el MKV."""
     ffmpeg_cmd = [
         "ffmpeg", "-y",
+        "-hide_banner",
+        "-loglevel", "error",
         "-i", str(mkv_path),
         "-ac", "1",
         "-acodec", "libmp3lame",
@@ -32,9 +44,61 @@ def _convert_to_mp3(mkv_path: Path, mp3_path: Path, bitrate: str):
     ]
     print(f"[Tw] Convirtiendo a MP3: {' '.join(ffmpeg_cmd)}")
     _run(ffmpeg_cmd)
+    mkv_path.unlink(missing_ok=True)
+    return mp3_path
 
 
-def process_twitch_source(config: dict, state: dict) -> list:
+def _get_audio_playlist(video_id: str, token: str) -> tuple:
+    """
+    Obtiene con twitch-dl la playlist audio_only del VOD y la parsea.
+    Devuelve (init_url | None, [segment_url, ...]).
+    """
+    cmd = ["twitch-dl", "info", video_id, "--json", "--auth-token", token]
+    info = json.loads(_run(cmd).stdout)
+
+    url = None
+    for p in info.get("playlists", []):
+        name = p.get("name") or p.get("group_id") or p.get("video")
+        if name == "audio_only":
+            url = p.get("url") or p.get("uri")
+            break
+
+    if not url:
+        raise RuntimeError(f"{video_id} sin playlist audio_only")
+
+    init_url, segments = parse_media_playlist(http_get(url).decode(), url)
+
+    # los segmentos silenciados por copyright sólo existen como '-muted'
+    segments = [s.replace("-unmuted.ts", "-muted.ts") for s in segments]
+    return init_url, segments
+
+
+def _stream_to_mp3(video_id: str, ep_id: str, token: str, mp3_path: Path, bitrate: str,
+                   work_dir: Path, workers: int = 1) -> Path | None:
+    """
+    Resuelve la playlist audio_only y pasa sus segmentos (descargados en
+    paralelo) directamente a ffmpeg por stdin: el único fichero es el MP3.
+    """
+    init_url, segments = _get_audio_playlist(video_id, token)
+    print(f"[Tw] Streaming {len(segments)} segmentos → {mp3_path.name}")
+    ok = encode_streamed(init_url, segments, mp3_path, bitrate, work_dir, ep_id,
+                         workers=workers, tag="Tw")
+    return mp3_path if ok else None
+
+
+def _fetch_segments(video_id: str, ep_id: str, token: str, work_dir: Path,
+                    workers: int = 1) -> Path | None:
+    """
+    Con resume: resuelve la playlist audio_only y descarga sus segmentos en
+    paralelo a work_dir, con checkpoints para reanudar si se interrumpe.
+    ffmpeg (etapa de codificación) lee luego ese fichero.
+    """
+    init_url, segments = _get_audio_playlist(video_id, token)
+    print(f"[Tw] Descargando {len(segments)} segmentos de {ep_id}")
+    return fetch_resumable(init_url, segments, work_dir, ep_id, workers=workers, tag="Tw")
+
+
+def process_twitch_source(config: dict, state: EpisodeStore) -> list:
     tw_cfg = config.get("sources", {}).get("twitch", {})
     if not tw_cfg.get("enabled", False):
         return []
@@ -49,6 +113,9 @@ def process_twitch_source(config: dict, state: dict) -> list:
     limit = tw_cfg.get("limit")
     min_minutes = tw_cfg.get("min_minutes", 0)
     bitrate = tw_cfg.get("audio_bitrate", "64k")
+    stream = tw_cfg.get("stream", True)  # False → twitch-dl a MKV + ffmpeg
+    resume = tw_cfg.get("resume", False)  # True → segmentos a temp_dir, reanudables
+    segment_workers = tw_cfg.get("segment_workers", 4)
     channels = tw_cfg.get("channels", [])
     storage = config.get("storage", {})
     base_path = Path(storage.get("base_path", "/data"))
@@ -60,115 +127,187 @@ def process_twitch_source(config: dict, state: dict) -> list:
     temp_dir.mkdir(parents=True, exist_ok=True)
 
     # Escaneando canales
-    downloaded_ids = {ep["id"] for ep in state.get("episodes", [])}
+    downloaded_ids = set()  # vistos en esta ejecución; el histórico está en state
+    uploads = upload_stage(config)
+    poller = ChannelPoller(config, state, "twitch", "Tw")
+    polled = []  # canales listados en esta pasada
     new_eps = []
 
+    def _download(job):
+        job["started"] = time.monotonic()
+        if stream and resume:
+            return _fetch_segments(job["vid"], job["ep_id"], token, temp_dir, segment_workers)
+        if stream:
+            return _stream_to_mp3(job["vid"], job["ep_id"], token, audio_dir / f"{job['ep_id']}.mp3",
+                                  bitrate, temp_dir, segment_workers)
+        mkv = _download_mkv(job["vid"], temp_dir / f"{job['ep_id']}.mkv", token)
+        run_metrics().add("bytes_downloaded", mkv.stat().st_size)
+        return mkv
+
+    def _encode(job, intermediate):
+        mp3_path = audio_dir / f"{job['ep_id']}.mp3"
+        if stream and not resume:
+            # ya es el MP3: en disco no ha habido nada más
+            peak_bytes = 0
+        else:
+            # segmentos (o MKV) y MP3 coexisten en disco hasta que se borra el primero
+            peak_bytes = intermediate.stat().st_size
+            if stream:
+                ok = encode_fetched(intermediate, mp3_path, bitrate, temp_dir, job["ep_id"], tag="Tw")
+                mp3_path = mp3_path if ok else None
+            else:
+                mp3_path = _convert_to_mp3(intermediate, mp3_path, bitrate)
+
+        if mp3_path:
+            peak_bytes += mp3_path.stat().st_size
+            elapsed = time.monotonic() - job["started"]
+            print(f"[Tw] {job['ep_id']}: {elapsed:.1f} s, disco pico {peak_bytes / 1e6:.1f} MB")
+        return uploads.submit(mp3_path)
+
+    # descarga (red) y codificación (CPU) solapadas entre episodios; en
+    # modo stream los segmentos van directos a ffmpeg, así que descarga y
+    # codificación van juntas y cuentan como descarga (download_workers
+    # episodios a la vez) y la codificación sólo encola la subida
+    pipeline = Pipeline(
+        download=_download,
+        encode=_encode,
+        download_workers=tw_cfg.get("download_workers", 1),
+        encode_workers=tw_cfg.get("encode_workers", 1),
+        tag="Tw",
+    )
+
+    # listado y filtro de cada canal juntos en el log (log_block); las
+    # descargas van por el pipeline, fuera del bloque
     for ch in channels:
-        name = ch.get("name") or ch.get("channel")
-        channel = ch.get("channel")
-        if not channel:
-            print("[Tw] canal sin 'channel'")
-            continue
+        with log_block():
+            name = ch.get("name") or ch.get("channel")
+            channel = ch.get("channel")
+            if not channel:
+                print("[Tw] canal sin 'channel'")
+                continue
 
-        print(f"[Tw] Procesando canal: {name}")
+            if not poller.due(name):
+                continue
 
-        # obtenemos la lista de vídeos desde twitch-dl
-        cmd = ["twitch-dl", "videos", channel, "--json"]
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        except Exception as e:
-            print(f"[Tw] Error listando videos: {e}")
-            continue
+            print(f"[Tw] Procesando canal: {name}")
 
-        import json
-        try:
-            videos = json.loads(result.stdout)["videos"]
-            # aplicar limite de vídeos
-            if limit is not None:
-                videos = videos[:limit]
+            # obtenemos la lista de vídeos desde twitch-dl
+            cmd = ["twitch-dl", "videos", channel, "--json"]
+            try:
+                with run_metrics().phase("listing"):
+                    result = _run(cmd)
+            except Exception as e:
+                print(f"[Tw] Error listando videos: {e}")
+                run_metrics().fail("listing")
+                continue
 
-        except Exception:
-            print("[Tw] No se pudo parsear JSON")
-            continue
+            try:
+                videos = json.loads(result.stdout)["videos"]
+                # aplicar limite de vídeos
+                if limit is not None:
+                    videos = videos[:limit]
 
-        for v in videos:
-            vid = v.get("id")
-            if not vid:
+            except Exception:
+                print("[Tw] No se pudo parsear JSON")
                 continue
 
-            ep_id = f"twt_{vid}"
+            polled.append(name)
+
+            for v in videos:
+                vid = v.get("id")
+                if not vid:
+                    continue
+
+                ep_id = f"twt_{vid}"
 
-            # Obtener la hora de publicación
-            published_str = v.get("publishedAt")
-            now = datetime.now(timezone.utc)
+                # Obtener la hora de publicación
+                published_str = v.get("publishedAt")
+                now = datetime.now(timezone.utc)
 
-            if published_str:
-                try:
-                    published = datetime.fromisoformat(published_str.replace("Z", "+00:00"))
-                except Exception:
+                if published_str:
+                    try:
+                        published = datetime.fromisoformat(published_str.replace("Z", "+00:00"))
+                    except Exception:
+                        published = now
+                else:
                     published = now
-            else:
-                published = now
 
-            # Descarta el episodio si ya está descargado
-            if ep_id in downloaded_ids:
-                print(f"[Tw] {ep_id} ya procesado")
-                continue
+                # Descarta el episodio si ya está descargado
+                if ep_id in downloaded_ids or state.has(ep_id):
+                    print(f"[Tw] {ep_id} ya procesado")
+                    continue
 
-            # Descarta el episodio si no está marcado como 'recorded'
-            status = v.get("status", "").lower()
-            if status != "recorded":
-                print(f"[Tw] {ep_id} no finalizado, status={status!r}")
-                continue
+                # Descartado en una ejecución anterior
+                reason = state.rejection(ep_id, limit_days)
+                if reason:
+                    print(f"[Tw] {ep_id} descartado ({reason})")
+                    continue
 
-            # Descarta el episodio si se publicó hace menos de 3h
-            if published + timedelta(hours=3) > now:
-                print(f"[Tw] {ep_id} aún en emisión (pub={published.isoformat()})")
-                continue
+                # Descarta el episodio si no está marcado como 'recorded'
+                status = v.get("status", "").lower()
+                if status != "recorded":
+                    print(f"[Tw] {ep_id} no finalizado, status={status!r}")
+                    continue
 
-            # Descarta el episodio si tiene más de los días configurados
-            if limit_days is not None:
-                age_days = (now - published).days
-                if age_days > limit_days:
-                    print(f"[Tw] {ep_id} > {limit_days} días")
+                # Descarta el episodio si se publicó hace menos de 3h
+                if published + timedelta(hours=3) > now:
+                    print(f"[Tw] {ep_id} aún en emisión (pub={published.isoformat()})")
                     continue
+
+                # Descarta el episodio si tiene más de los días configurados
+                if limit_days is not None:
+                    age_days = (now - published).days
+                    if age_days > limit_days:
+                        print(f"[Tw] {ep_id} > {limit_days} días")
+                        state.reject(ep_id, "twitch", old_reason(limit_days), rejection_ttl(config, "antiguo"))
+                        continue
           
-            # Descarta el episodio si es corto
-            duration_sec = v.get("lengthSeconds", 0)
-            if duration_sec > 0:
-                if duration_sec / 60 < min_minutes:
-                    print(f"[Tw] {ep_id} < {min_minutes} min")
-                    downloaded_ids.add(ep_id)
-                    continue
+                # Descarta el episodio si es corto
+                duration_sec = v.get("lengthSeconds", 0)
+                if duration_sec > 0:
+                    if duration_sec / 60 < min_minutes:
+                        print(f"[Tw] {ep_id} < {min_minutes} min")
+                        downloaded_ids.add(ep_id)
+                        state.reject(ep_id, "twitch", "corto", rejection_ttl(config, "corto"))
+                        continue
 
-            # Descargando audio
-            print(f"[Tw] Bajando audio: {ep_id}")
+                # Descargando audio (en segundo plano)
+                print(f"[Tw] Bajando audio: {ep_id}")
 
-            mkv_path = audio_dir / f"{ep_id}.mkv"
-            mp3_path = audio_dir / f"{ep_id}.mp3"
+                pipeline.submit({
+                    "ep_id": ep_id,
+                    "vid": vid,
+                    "video": v,
+                    "name": name,
+                    "published": published,
+                    "duration_sec": duration_sec,
+                })
+                downloaded_ids.add(ep_id)
 
-            try:
-                _download_mkv(vid, mkv_path, token)
-                _convert_to_mp3(mkv_path, mp3_path, bitrate)
-                mkv_path.unlink(missing_ok=True)
-            except Exception as e:
-                print(f"[Tw] Error descargando {ep_id}: {e}")
-                continue
+    for job, mp3_path in pipeline.results():
+        ep_id = job["ep_id"]
+        if not mp3_path:
+            print(f"[Tw] Error descargando {ep_id}")
+            continue
+
+        v = job["video"]
+        episode = {
+            "id": ep_id,
+            "source": "twitch",
+            "title": f"{job['name']} — {v.get('title', 'Sin título')}",
+            "channel": job["name"],
+            "original_url": f"https://www.twitch.tv/videos/{job['vid']}",
+            "published_at": job["published"].isoformat().replace("+00:00", "Z"),
+            "downloaded_at": datetime.utcnow().isoformat() + "Z",
+            "file_path": str(mp3_path),
+            "size": mp3_path.stat().st_size,
+            "duration_sec": job["duration_sec"],
+        }
+
+        new_eps.append(episode)
+        print(f"[Tw] Añadido: {episode['title']}")
 
-            episode = {
-                "id": ep_id,
-                "source": "twitch",
-                "title": f"{name} — {v.get('title', 'Sin título')}",
-                "channel": name,
-                "original_url": f"https://www.twitch.tv/videos/{vid}",
-                "published_at": published.isoformat().replace("+00:00", "Z"),
-                "downloaded_at": datetime.utcnow().isoformat() + "Z",
-                "file_path": str(mp3_path),
-                "duration_sec": duration_sec,
-            }
-
-            new_eps.append(episode)
-            downloaded_ids.add(ep_id)
-            print(f"[Tw] Añadido: {episode['title']}")
+    for name in polled:
+        poller.done(name, sum(1 for ep in new_eps if ep["channel"] == name))
 
     return new_eps
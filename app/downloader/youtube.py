@@ -1,39 +1,60 @@
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import shutil
 from yt_dlp import YoutubeDL
+from app.core.cache import metadata_cache, MetadataCache
+from app.core.cadence import ChannelPoller
+from app.core.checkpoint import temp_dir
+from app.core.logfile import log_block
+from app.core.metrics import run_metrics, run_cmd, span
+from app.core.state import EpisodeStore, rejection_ttl, old_reason
+from app.downloader.pipeline import Pipeline
+from app.uploader.rclone import upload_stage
+from app.downloader.ytfeed import check_channel, FEED_URL
 
 
-def _get_bitrate_kbps(bitrate_str: str) -> str:
-    if not bitrate_str:
-        return "64"
-    return ''.join(ch for ch in bitrate_str if ch.isdigit()) or "64"
+# live_status de yt-dlp para directos en curso, programados o recién
+# terminados: aún no tienen duración ni fecha definitivas
+LIVE_STATUSES = ("is_live", "is_upcoming", "post_live")
 
 
-def _convert_mp3_to_mono(src: Path, bitrate: str):
-    tmp_path = src.with_suffix(".mono_tmp.mp3")
+def _encode_to_mono_mp3(src: Path, audio_dir: Path, bitrate: str) -> Path:
+    """
+    Codifica el audio descargado (webm/m4a...) a MP3 mono en una sola pasada.
+    Borra el original y devuelve la ruta del .mp3 dentro de audio_dir.
+
+    El MP3 se escribe junto a src (storage.temp_dir) y se mueve al acabar:
+    en audio_dir no hay nunca un MP3 a medias que la subida pueda recoger.
+    """
+    audio_dir.mkdir(parents=True, exist_ok=True)
+    dst = audio_dir / f"{src.stem}.mp3"
+    tmp_path = src.with_name(f"{src.stem}.tmp.mp3")
 
     cmd = [
         "ffmpeg", "-y",
+        "-hide_banner",
+        "-loglevel", "error",
         "-i", str(src),
+        "-vn",
         "-ac", "1",                # mono
         "-acodec", "libmp3lame",
         "-b:a", bitrate,
         str(tmp_path)
     ]
 
-    print(f"[Yt] Convirtiendo a mono: {' '.join(cmd)}")
-    subprocess.run(cmd, check=True)
+    print(f"[Yt] Codificando a MP3 mono: {' '.join(cmd)}")
+    run_cmd(cmd, check=True)
 
-    # reemplazar archivo original
     src.unlink()
-    tmp_path.rename(src)
-
+    shutil.move(tmp_path, dst)
+    return dst
 
 
-def fetch_videos(channel_url: str, limit: int) -> list:
+def fetch_channel(channel_url: str, limit: int) -> tuple:
     """
     Lista los últimos 'limit' vídeos del canal (metadatos planos).
+    Devuelve (channel_id | None, entries).
     """
     ydl_opts = {
         "quiet": True,
@@ -42,10 +63,54 @@ def fetch_videos(channel_url: str, limit: int) -> list:
         "playlistend": limit,
     }
 
-    with YoutubeDL(ydl_opts) as ydl:
+    with span("yt-dlp.listing", channel=channel_url), YoutubeDL(ydl_opts) as ydl:
         info = ydl.extract_info(channel_url, download=False)
 
-    return info.get("entries", [])[:limit]
+    return info.get("channel_id"), info.get("entries", [])[:limit]
+
+
+def fetch_videos(channel_url: str, limit: int) -> list:
+    """
+    Lista los últimos 'limit' vídeos del canal (metadatos planos).
+    """
+    return fetch_channel(channel_url, limit)[1]
+
+
+def _list_channels(channels: list, limit: int, workers: int, state: EpisodeStore,
+                   feed_url: str | None = FEED_URL) -> list:
+    """
+    Lista en paralelo los vídeos de todos los canales.
+
+    Si feed_url no es None, antes de llamar a yt-dlp se consulta el feed
+    Atom del canal (GET condicional) y, si el vídeo más reciente coincide
+    con la marca guardada, el canal se da por sin cambios y no se lista.
+
+    Devuelve [(canal, entries | None, error, watermark, sin_cambios)] en el
+    mismo orden que 'channels'.
+    """
+    def _list(ch):
+        wm = state.watermark(ch["url"]) if feed_url else {}
+        channel_id = ch.get("channel_id") or wm.get("channel_id")
+
+        if feed_url and channel_id and wm.get("newest_id"):
+            changed, wm = check_channel(channel_id, wm, feed_url)
+            if not changed:
+                return ch, [], None, wm, True
+
+        try:
+            listed_id, entries = fetch_channel(ch["url"], limit=limit)
+        except Exception as e:
+            return ch, None, e, wm, False
+
+        # primera vez: sólo para guardar la marca del feed
+        channel_id = channel_id or listed_id
+        if feed_url and channel_id and "feed_newest" not in wm:
+            _, wm = check_channel(channel_id, {}, feed_url)
+        wm["channel_id"] = channel_id
+        return ch, entries, None, wm, False
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(_list, channels))
 
 
 def fetch_video_details(video_url: str) -> dict | None:
@@ -58,7 +123,7 @@ def fetch_video_details(video_url: str) -> dict | None:
     }
 
     try:
-        with YoutubeDL(ydl_opts) as ydl:
+        with span("yt-dlp.details"), YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(video_url, download=False)
         return info
     except Exception as e:
@@ -66,32 +131,48 @@ def fetch_video_details(video_url: str) -> dict | None:
         return None
 
 
-def download_audio(video_url: str, video_id: str, audio_dir: Path, bitrate: str) -> Path | None:
+def cached_video_details(cache: MetadataCache, vid_id: str, video_url: str) -> dict | None:
+    """
+    fetch_video_details con caché en disco: si el vídeo se consultó hace
+    menos de cache.ttl_hours no se vuelve a llamar a yt-dlp.
+
+    Directos en curso, programados o sin duración no se guardan: su
+    metadata cambia en cuanto hay VOD y hay que volver a pedirla.
+    """
+    key = f"yt:{vid_id}"
+    details = cache.get(key)
+    if details is None:
+        details = fetch_video_details(video_url)
+        if details and details.get("duration") and details.get("live_status") not in LIVE_STATUSES:
+            cache.put(key, details)
+    return details
+
+
+def download_audio(video_url: str, video_id: str, work_dir: Path) -> Path | None:
     """
-    Descarga el audio del vídeo como mp3.
+    Descarga el mejor audio disponible tal cual, sin recodificar.
+    La conversión a MP3 mono es la etapa de codificación del pipeline.
+
+    Se descarga en work_dir (storage.temp_dir): si la ejecución se corta,
+    el fichero .part queda ahí y yt-dlp lo continúa en la siguiente.
     """
-    audio_dir.mkdir(parents=True, exist_ok=True)
-    outtmpl = str(audio_dir / f"yt_{video_id}.%(ext)s")
+    work_dir.mkdir(parents=True, exist_ok=True)
+    outtmpl = str(work_dir / f"yt_{video_id}.%(ext)s")
 
     ydl_opts = {
         "format": "bestaudio/best",
         "outtmpl": outtmpl,
         "quiet": True,
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": _get_bitrate_kbps(bitrate),
-            }
-        ],
+        "continuedl": True,  # reanudar el .part de una ejecución anterior
     }
 
     try:
-        with YoutubeDL(ydl_opts) as ydl:
+        with span("yt-dlp.download"), YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(video_url, download=True)
-        final_path = Path(ydl.prepare_filename(info)).with_suffix(".mp3")
+        downloads = info.get("requested_downloads") or [{}]
+        final_path = Path(downloads[0].get("filepath") or ydl.prepare_filename(info))
         if final_path.exists():
-            _convert_mp3_to_mono(final_path, bitrate)
+            run_metrics().add("bytes_downloaded", final_path.stat().st_size)
             return final_path
                 
         return None
@@ -124,6 +205,7 @@ def build_episode(entry: dict, channel_name: str, audio_path: Path, published_dt
         "published_at": published_dt.isoformat().replace("+00:00", "Z"),
         "downloaded_at": downloaded_dt.isoformat().replace("+00:00", "Z"),
         "file_path": str(audio_path),
+        "size": audio_path.stat().st_size,
         "duration_sec": entry.get("duration", 0),
     }
 
@@ -150,7 +232,7 @@ def _get_published_datetime(details: dict) -> datetime | None:
     return dt
 
 
-def process_youtube_source(config: dict, state: dict) -> list:
+def process_youtube_source(config: dict, state: EpisodeStore) -> list:
     """
     Pipeline YouTube:
     - Lista vídeos recientes por canal
@@ -168,91 +250,172 @@ def process_youtube_source(config: dict, state: dict) -> list:
     limit_days = yt_cfg.get("limit_days")  # puede ser None si no se quiere límite temporal
     bitrate = yt_cfg.get("audio_bitrate", "64k")
     min_minutes = yt_cfg.get("min_minutes", "15")
+    list_workers = int(yt_cfg.get("list_workers", 4))
+    feed_url = yt_cfg.get("feed_url", FEED_URL) if yt_cfg.get("precheck", True) else None
     
-    data_dir = Path("/data")
-    audio_dir = data_dir / "audio"
+    storage = config.get("storage", {})
+    audio_dir = Path(storage.get("base_path", "/data")) / storage.get("audio_dir", "audio")
+    work_dir = temp_dir(config)
+    cache = metadata_cache(config)
+    uploads = upload_stage(config)
 
-    downloaded_ids = {e["id"] for e in state.get("episodes", [])}
+    downloaded_ids = set()  # vistos en esta ejecución; el histórico está en state
     new_episodes = []
 
+    # Descarga y codificación solapadas: mientras ffmpeg convierte un
+    # episodio, yt-dlp ya está bajando el siguiente (y el anterior subiendo).
+    pipeline = Pipeline(
+        download=lambda job: download_audio(job["url"], job["vid_id"], work_dir),
+        encode=lambda job, path: uploads.submit(_encode_to_mono_mp3(path, audio_dir, bitrate)),
+        download_workers=yt_cfg.get("download_workers", 2),
+        encode_workers=yt_cfg.get("encode_workers", 1),
+        tag="Yt",
+    )
+
     cutoff = None
     if limit_days is not None:
         cutoff = datetime.now(timezone.utc) - timedelta(days=limit_days)
 
-    for ch in channels:
-        name = ch.get("name", "Canal")
-        url = ch.get("url")
-        if not url:
-            continue
-
-        print(f"[Yt] Canal: {name}")
-        entries = fetch_videos(url, limit=limit_items * 5 or 10)  # escaneamos algo más de margen
-
-        added_for_channel = 0
-
-        for entry in entries:
-            vid_id = entry.get("id") or entry.get("url")
-            if not vid_id:
+    # Fase de listado: en paralelo, sólo round trips de red
+    poller = ChannelPoller(config, state, "youtube", "Yt")
+    channels = [
+        ch for ch in channels
+        if ch.get("url") and poller.due(ch.get("name", "Canal"))
+    ]
+    polled = []  # canales listados (o sin cambios según el feed)
+    with run_metrics().phase("listing"):
+        listings = _list_channels(channels, limit_items * 5 or 10, list_workers, state, feed_url)  # escaneamos algo más de margen
+
+    # Canales revisados por completo: sólo en ellos se avanza la marca del
+    # feed (si se cortó por límite o algo falló, hay que volver a listarlos)
+    complete = {}
+
+    # Fase de filtrado: canal a canal, en el orden de config.yaml. Sus
+    # líneas salen juntas (log_block); las descargas van por el pipeline,
+    # fuera del bloque, y su progreso sale línea a línea
+    for ch, entries, error, watermark, unchanged in listings:
+        with log_block():
+            name = ch.get("name", "Canal")
+
+            print(f"[Yt] Canal: {name}")
+            if error is not None:
+                print(f"[Yt] Error listando {name}: {error}")
+                run_metrics().fail("listing")
                 continue
-
-            ep_id = f"yt_{vid_id}"
-            if ep_id in downloaded_ids:
-                print(f"[Yt] {ep_id} ya procesado")
+            polled.append(name)
+            if unchanged:
+                print(f"[Yt] {name} sin vídeos nuevos (feed)")
                 continue
 
-            # Si ya hemos añadido suficientes episodios de este canal, paramos.
-            if added_for_channel >= limit_items:
-                print(f"[Yt] Ya {limit_items} episodios {name}, stop")
-                break
-
-            video_url = entry.get("url") or entry.get("webpage_url") or f"https://www.youtube.com/watch?v={vid_id}"
+            added_for_channel = 0
+            complete[ch["url"]] = watermark
 
-            # Metadata completa del vídeo
-            details = fetch_video_details(video_url)
-            if not details:
-                print(f"[Yt] {ep_id} sin datos, saltando")
-                downloaded_ids.add(ep_id)  # lo marcamos como visto para no insistir
-                continue
+            for entry in entries:
+                vid_id = entry.get("id") or entry.get("url")
+                if not vid_id:
+                    continue
 
-            published_dt = _get_published_datetime(details)
+                ep_id = f"yt_{vid_id}"
+                if ep_id in downloaded_ids or state.has(ep_id):
+                    print(f"[Yt] {ep_id} ya procesado")
+                    continue
 
-            # Límite temporal: si hay cutoff y la fecha es anterior → marcar visto y detener escaneo en este canal
-            if cutoff is not None and published_dt is not None:
-                if published_dt < cutoff:
-                    print(f"[Yt] {ep_id} más de {limit_days} días")
-                    downloaded_ids.add(ep_id)
+                # Descartado en una ejecución anterior: sin volver a pedir metadata
+                reason = state.rejection(ep_id, limit_days)
+                if reason == "antiguo":
+                    print(f"[Yt] {ep_id} descartado ({reason}), stop")
+                    break
+                if reason:
+                    print(f"[Yt] {ep_id} descartado ({reason})")
+                    continue
+
+                # Si ya hemos añadido suficientes episodios de este canal, paramos.
+                if added_for_channel >= limit_items:
+                    print(f"[Yt] Ya {limit_items} episodios {name}, stop")
+                    complete.pop(ch["url"], None)
                     break
 
-            # Sin fecha fiable y hay límite de días: lo marcamos como visto y seguimos con el siguiente
-            if cutoff is not None and published_dt is None:
-                print(f"[Yt] {ep_id} sin fecha")
+                video_url = entry.get("url") or entry.get("webpage_url") or f"https://www.youtube.com/watch?v={vid_id}"
+
+                # Metadata completa del vídeo
+                details = cached_video_details(cache, vid_id, video_url)
+                if not details:
+                    print(f"[Yt] {ep_id} sin datos, saltando")
+                    downloaded_ids.add(ep_id)  # lo marcamos como visto para no insistir
+                    state.reject(ep_id, "youtube", "sin_datos", rejection_ttl(config, "sin_datos"))
+                    complete.pop(ch["url"], None)
+                    continue
+
+                published_dt = _get_published_datetime(details)
+
+                #duration_sec = details.get("duration") or entry.get("duration", 0)
+
+                duration_sec = details.get("duration") or entry.get("duration") or 0
+                duration_sec = int(duration_sec)
+                min_seconds = int(min_minutes) * 60
+
+                # Directos en curso, programados o recién acabados (p.ej. /streams):
+                # sin duración ni fecha definitivas, así que sus descartes sólo
+                # valen para esta ejecución; cuando exista el VOD se reevalúan
+                live_status = details.get("live_status") or entry.get("live_status")
+                settled = duration_sec > 0 and live_status not in LIVE_STATUSES
+
+                # Límite temporal: si hay cutoff y la fecha es anterior → marcar visto y detener escaneo en este canal
+                if cutoff is not None and published_dt is not None:
+                    if published_dt < cutoff:
+                        print(f"[Yt] {ep_id} más de {limit_days} días")
+                        downloaded_ids.add(ep_id)
+                        state.reject(ep_id, "youtube", old_reason(limit_days), rejection_ttl(config, "antiguo"))
+                        break
+
+                # Sin fecha fiable y hay límite de días: lo marcamos como visto y seguimos con el siguiente
+                if cutoff is not None and published_dt is None:
+                    print(f"[Yt] {ep_id} sin fecha")
+                    downloaded_ids.add(ep_id)
+                    if settled:
+                        state.reject(ep_id, "youtube", "sin_fecha", rejection_ttl(config, "sin_fecha"))
+                    continue
+
+                # Filtro por duración
+                if duration_sec < min_seconds:
+                    print(f"[Yt] {ep_id}. {duration_sec//60}m < {min_minutes}m"
+                          + ("" if settled else f" ({live_status or 'sin duración'}, sólo esta vez)"))
+                    downloaded_ids.add(ep_id)  # opción B: marcar como visto/descartado
+                    if settled:
+                        state.reject(ep_id, "youtube", "corto", rejection_ttl(config, "corto"))
+                    continue
+
+                # Descarga de audio (en segundo plano)
+                pipeline.submit({
+                    "ep_id": ep_id,
+                    "vid_id": vid_id,
+                    "url": video_url,
+                    "entry": entry,
+                    "channel": name,
+                    "channel_url": ch["url"],
+                    "published_dt": published_dt,
+                })
                 downloaded_ids.add(ep_id)
-                continue
-
-            # Filtro por duración
-            #duration_sec = details.get("duration") or entry.get("duration", 0)
+                added_for_channel += 1
 
-            duration_sec = details.get("duration") or entry.get("duration") or 0
-            duration_sec = int(duration_sec)
-            min_seconds = int(min_minutes) * 60
+    for job, audio_path in pipeline.results():
+        if not audio_path:
+            print(f"[Yt] Error descargando {job['ep_id']}")
+            complete.pop(job["channel_url"], None)
+            continue
 
-            if duration_sec < min_seconds:
-                print(f"[Yt] {ep_id}. {duration_sec//60}m < {min_minutes}m")
-                downloaded_ids.add(ep_id)  # opción B: marcar como visto/descartado
-                continue
+        episode = build_episode(job["entry"], job["channel"], audio_path, job["published_dt"])
+        new_episodes.append(episode)
 
-            # Descarga de audio
-            audio_path = download_audio(video_url, vid_id, audio_dir, bitrate)
-            if not audio_path:
-                print(f"[Yt] Error descargando {ep_id}")
-                downloaded_ids.add(ep_id)
-                continue
+        print(f"[Yt] Añadido: {episode['title']}")
 
-            episode = build_episode(entry, name, audio_path, published_dt)
-            new_episodes.append(episode)
-            downloaded_ids.add(ep_id)
-            added_for_channel += 1
+    for name in polled:
+        poller.done(name, sum(1 for ep in new_episodes if ep["channel"] == name))
 
-            print(f"[Yt] Añadido: {episode['title']}")
+    if feed_url:
+        for url, wm in complete.items():
+            if wm.get("feed_newest"):
+                wm["newest_id"] = wm["feed_newest"]
+                state.set_watermark(url, wm)
 
     return new_episodes
@@ -0,0 +1,64 @@
+import urllib.error
+import urllib.request
+import xml.etree.ElementTree as ET
+
+
+FEED_URL = "https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
+
+NS = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+
+def newest_video_id(xml_bytes: bytes) -> str | None:
+    """Id del vídeo más reciente de un feed Atom de YouTube."""
+    root = ET.fromstring(xml_bytes)
+    entry = root.find("atom:entry", NS)
+    if entry is None:
+        return None
+    vid = entry.find("yt:videoId", NS)
+    return vid.text if vid is not None else None
+
+
+def check_channel(channel_id: str, watermark: dict, feed_url: str = FEED_URL,
+                  timeout: int = 15) -> tuple:
+    """
+    Comprueba con el feed Atom público (GET condicional con ETag /
+    If-Modified-Since) si el canal tiene algo nuevo desde 'watermark'.
+
+    Devuelve (cambiado, watermark_nuevo). Ante cualquier error devuelve
+    cambiado=True para que se haga el listado completo con yt-dlp.
+    """
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if watermark.get("etag"):
+        headers["If-None-Match"] = watermark["etag"]
+    if watermark.get("last_modified"):
+        headers["If-Modified-Since"] = watermark["last_modified"]
+
+    url = feed_url.format(channel_id=channel_id)
+    req = urllib.request.Request(url, headers=headers)
+
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            body = r.read()
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return False, watermark
+        print(f"[Yt] Feed {channel_id}: HTTP {e.code}")
+        return True, watermark
+    except Exception as e:
+        print(f"[Yt] Feed {channel_id}: {e}")
+        return True, watermark
+
+    try:
+        newest = newest_video_id(body)
+    except ET.ParseError as e:
+        print(f"[Yt] Feed {channel_id} no válido: {e}")
+        return True, watermark
+
+    new_wm = dict(watermark, etag=etag, last_modified=last_modified, feed_newest=newest)
+    changed = newest is None or newest != watermark.get("newest_id")
+    return changed, new_wm
@@ -1,27 +1,77 @@
 from app.core.config import load_config
-from app.core.state import load_state, save_state
-from app.core.rss import generate_feed
-from app.uploader.rclone import upload_feed, rclone_cleanup, flush_pending_audio, upload_audio_dir
+from app.core.state import load_state
+from app.core.rss import generate_feed, feed_uploaded, mark_feed_uploaded
+from app.uploader.rclone import upload_feed, upload_audio_dir, rclone_backend, upload_stage
 from pathlib import Path
-from app.uploader.rclone import rclone_upload
-from app.core.public import publish_status, publish_logs, archive_last_run
+from app.core.public import publish_status, publish_logs, archive_last_run, publish_metrics
+from app.core.scheduler import run_sources
+from app.core.checkpoint import temp_dir, prune_temp_dir
+from app.core.cache import metadata_cache
+from app.core.retention import apply_retention
+from app.core.metrics import start_run, run_metrics, span
+from app.core.logfile import RotatingLog, MAX_BYTES, BACKUPS
+from contextlib import contextmanager
+from types import SimpleNamespace
+import argparse
+import cProfile
+import pstats
 import sys
-import shutil
 import os
-from datetime import datetime, timezone
+import threading
 
-start_time = datetime.now(timezone.utc)
+LAST_RUN_LOG = "/data/last_run.log"
+PROFILE_DIR = Path("/data/profile")
 
 
 class TeeLogger(object):
-    def __init__(self, filepath):
-        self.file = open(filepath, "w", buffering=1)
+    """
+    Copia stdout a last_run.log. Cada hilo acumula lo que imprime y lo
+    escribe por líneas completas, o por bloques enteros dentro de
+    block() (log_block), así que los workers en paralelo no mezclan líneas.
+    """
+
+    def __init__(self, filepath, max_bytes=MAX_BYTES, backups=BACKUPS):
+        # rotado y comprimido por tamaño (logs.max_mb / logs.backups)
+        self.file = RotatingLog(filepath, max_bytes, backups)
         self.stdout = sys.stdout
         self.stderr = sys.stderr   # para capturar stderr también
+        self._local = threading.local()
+        self._buffers = []   # los de todos los hilos, para vaciarlos en close()
+        self._lock = threading.Lock()
+
+    def _buffer(self):
+        local = getattr(self._local, "buffer", None)
+        if local is None:
+            # objeto normal (no el threading.local) para que close() vea el de cada hilo
+            local = self._local.buffer = SimpleNamespace(parts=[], depth=0)
+            with self._lock:
+                self._buffers.append(local)
+        return local
 
     def write(self, data):
-        self.stdout.write(data)
-        self.file.write(data)
+        local = self._buffer()
+        local.parts.append(data)
+        if local.depth == 0 and data.endswith("\n"):
+            self._emit(local)
+
+    def _emit(self, local):
+        text = "".join(local.parts)
+        local.parts = []
+        if text:
+            with self._lock:
+                self.stdout.write(text)
+                self.file.write(text)
+
+    @contextmanager
+    def block(self):
+        local = self._buffer()
+        local.depth += 1
+        try:
+            yield
+        finally:
+            local.depth -= 1
+            if local.depth == 0:
+                self._emit(local)
 
     def flush(self):
         self.stdout.flush()
@@ -29,103 +79,168 @@ class TeeLogger(object):
 
     def close(self):
         try:
+            # lo pendiente de cualquier hilo, no sólo del que cierra
+            with self._lock:
+                pending = list(self._buffers)
+            for local in pending:
+                self._emit(local)
             self.flush()
             self.file.close()
         except:
             pass
 
 
-
-# Activamos el logger
-tee = TeeLogger("/data/last_run.log")
-sys.stdout = tee
-sys.stderr = tee   # capturamos también stderr
-
-
-def run():
-    config = load_config()
-    state = load_state()
-
-    # Extraer variables de config.yaml
-    rclone_cfg = config.get("rclone", {})
-    remote = rclone_cfg.get("remote")
-    remote_path = rclone_cfg.get("path", "")
-    retention_days = rclone_cfg.get("retention_days", 0)
-    storage_cfg = config.get("storage", {})
-    base_path = storage_cfg.get("base_path","/data")
-    audio_dir = storage_cfg.get("audio_dir","audio")
-    src = config.get("sources", {})
-    
-    new_episodes = []
-
-    # YouTube
-    yt_cfg = src.get("youtube", {})
-    yt_enabled = yt_cfg.get("enabled", True)
-    if yt_enabled:
-        from app.downloader.youtube import process_youtube_source
-        yt_eps = process_youtube_source(config, state)
-        new_episodes.extend(yt_eps)
-    else:
-        print(f"[Yt] Disabled → saltando")
-
-    # Twitch
-    tw_cfg = src.get("twitch", {})
-    tw_enabled = tw_cfg.get("enabled", True)
-    if tw_enabled:
-        from app.downloader.twitch import process_twitch_source
-        tw_eps = process_twitch_source(config, state)
-        new_episodes.extend(tw_eps)
-    else:
-        print(f"[Tw] Disabled → saltando")
-
-    # Kick
-    kc_cfg = src.get("kick", {})
-    kc_enabled = kc_cfg.get("enabled", True)
-    if kc_enabled:
-        from app.downloader.kick import process_kick_source
-        kick_eps = process_kick_source(config, state)
-        new_episodes.extend(kick_eps)
+def run(config=None, state=None, sources=None):
+    """
+    Una pasada completa: fuentes → estado → feed → subida → publicación.
+
+    En modo one-shot carga config y estado; en modo daemon los recibe ya
+    cargados (y 'sources' limita la pasada a las fuentes que tocan).
+    """
+    metrics = start_run()
+
+    if config is None:
+        config = load_config()
+
+    # Activamos el logger
+    logs_cfg = config.get("logs", {})
+    tee = TeeLogger(
+        LAST_RUN_LOG,
+        max_bytes=int(logs_cfg.get("max_mb", MAX_BYTES / 2**20) * 2**20),
+        backups=logs_cfg.get("backups", BACKUPS),
+    )
+    sys.stdout = tee
+    sys.stderr = tee   # capturamos también stderr
+
+    try:
+        if state is None:
+            state = load_state()
+
+        # Extraer variables de config.yaml
+        rclone_cfg = config.get("rclone", {})
+        remote = rclone_cfg.get("remote")
+        remote_path = rclone_cfg.get("path", "")
+        storage_cfg = config.get("storage", {})
+        base_path = storage_cfg.get("base_path","/data")
+        audio_dir = storage_cfg.get("audio_dir","audio")
+        rc = rclone_backend(config)
+
+        # Descargas a medias demasiado antiguas para reanudarlas
+        prune_temp_dir(temp_dir(config))
+
+        # YouTube, Twitch y Kick en paralelo; cada MP3 se sube en cuanto
+        # se termina de codificar
+        with span("run.sources"):
+            new_episodes = run_sources(config, state, only=sources)
+        with span("run.upload_wait"):
+            uploaded = upload_stage(config).wait()
+        metrics.episodes(new_episodes)
+
+        # Añadir nuevos
+        if new_episodes:
+            for ep in new_episodes:
+                ep["uploaded"] = os.path.basename(ep["file_path"]) in uploaded
+            state.add(new_episodes)
+
+        # Reintentar de golpe lo que quede en audio/ (subidas fallidas)
+        with span("run.upload_retry"):
+            verified = upload_audio_dir(rc, base_path, audio_dir, remote, remote_path)
+        if verified:
+            state.set_uploaded(
+                ep["id"] for ep in state.episodes()
+                if ep.get("uploaded") is False and os.path.basename(ep["file_path"]) in verified
+            )
+
+        # Retención: estado, feed y remoto a la vez
+        with span("run.retention"):
+            apply_retention(config, state, rc)
+
+        # Generar Feed con los episodios ya subidos (sólo se sube si no es
+        # el mismo que se subió bien la última vez)
+        with metrics.phase("feed"), span("run.feed"):
+            feed_hash = generate_feed(config, state)
+        print(f"[Fd] Feed ok con {state.count()} episodios")
+        if feed_uploaded(feed_hash):
+            print("[Rc] Feed sin cambios desde la última subida, no se sube")
+        else:
+            with span("run.feed_upload"):
+                if upload_feed(rc, config):
+                    mark_feed_uploaded(feed_hash)
+
+        cache = metadata_cache(config)
+        print(f"[Ca] Caché de metadata: {cache.stats()}")
+        cache.reset_stats()
+
+        metrics.finish()
+    finally:
+        # Cerrar TeeLogger antes de rotar logs (también si la pasada falla,
+        # para no dejar abierto last_run.log en modo daemon)
+        tee.close()
+        sys.stdout = sys.__stdout__
+        sys.stderr = sys.__stderr__
+
+    # Publicar contenido en nginx (antes de archivar, que vacía last_run.log)
+    with metrics.phase("publish"), span("run.publish"):
+        publish_metrics(metrics.record(), state)
+        publish_status("Sherlocaster", metrics.record())
+        archive_last_run(metrics.record())
+        publish_logs()
+
+    # Registro de la pasada en runs.jsonl
+    metrics.write()
+
+
+def profiled(run_pass):
+    """
+    Envuelve run_pass con cProfile. Tras cada pasada deja en PROFILE_DIR:
+    - run.pstats: cProfile del hilo principal (snakeviz, flameprof...)
+    - spans.folded: pilas de spans de todos los hilos, para flamegraph.pl
+      o speedscope (los workers no salen en cProfile)
+    """
+    def _run(*args, **kwargs):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return run_pass(*args, **kwargs)
+        finally:
+            profiler.disable()
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(PROFILE_DIR / "run.pstats")
+            run_metrics().write_folded(PROFILE_DIR / "spans.folded")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+            print(f"[Pf] Perfil guardado en {PROFILE_DIR}")
+    return _run
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="sherlocaster")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="proceso continuo con sondeo por fuente (sources.<fuente>.poll_minutes)",
+    )
+    parser.add_argument(
+        "--retention-report",
+        action="store_true",
+        help="muestra qué episodios borraría la retención, sin borrar nada",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"perfila cada pasada (cProfile + spans en formato folded) en {PROFILE_DIR}",
+    )
+    args = parser.parse_args()
+
+    run_pass = profiled(run) if args.profile else run
+
+    if args.retention_report:
+        apply_retention(load_config(), load_state(), dry_run=True)
+    elif args.daemon:
+        from app.core.daemon import run_daemon
+        run_daemon(run_pass)
     else:
-        print(f"[Kc] Disabled → saltando")
-
-    # Añadir nuevos
-    if new_episodes:
-        if "episodes" not in state:
-            state["episodes"] = []
-        state["episodes"].extend(new_episodes)
-        save_state(state)
-
-    # Generar Feed
-    generate_feed(config, state)
-    print(f"[Fd] Feed ok con {len(state.get('episodes', []))} episodios")
-    upload_feed(config)
-
-    # Subir audios a remoto mediante Rclone
-    upload_audio_dir(base_path, audio_dir, remote, remote_path)
-                
-    # Limpieza remota: borrar archivos antiguos si retention_days > 0
-    rclone_cleanup(remote, remote_path, retention_days)
-
-    # Guardar estadísticas
-    end_time = datetime.now(timezone.utc)
-    duration = end_time - start_time
-
-    with open("/data/last_run.meta", "w") as meta:
-        meta.write(f"timestamp={end_time.isoformat()}Z\n")
-        meta.write(f"duration={duration.total_seconds():.2f}\n")
-
-
-    # Cerrar TeeLogger antes de rotar logs
-    sys.stdout.close()
-    sys.stdout = sys.__stdout__
-    sys.stderr = sys.__stderr__
-
-    # Publicar contenido en nginx
-    archive_last_run()
-    publish_status("Sherlocaster")
-    publish_logs()
+        run_pass()
 
 
-       
 if __name__ == "__main__":
-    run()
+    main()
@@ -1,147 +1,521 @@
+import atexit
+import base64
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import os
-import glob
-import shutil
+from app.core.metrics import run_metrics, span
+from app.core import state as state_store
+from app.core.rss import feed_path
 
 CONFIG_PATH = "/app/config/rclone.conf"
+RC_ADDR = "127.0.0.1:5572"
+MANIFEST_FILE = Path("/data/upload_manifest.json")   # formato antiguo, se migra solo
+
+# Un .mp3 modificado hace menos de esto puede estar escribiéndolo aún
+# otra ejecución: el barrido de audio/ no lo toca.
+SETTLE_SECONDS = 120
+
 
-def upload_audio_dir(base_path: str, audio_dir: str, remote: str, remote_path: str) -> bool:
+class RcloneError(Exception):
+    pass
+
+
+class RcloneRC:
     """
-    Sube de una sola vez todos los .mp3 de la carpeta /audio al remoto usando rclone.
-    - base_path: por ejemplo "/data"
-    - audio_dir: por ejemplo "audio"
-    - remote: nombre del remoto en rclone.conf (p.ej. "gdrive")
-    - remote_path: ruta remota (directorio), p.ej. "podcasts/sherlocaster"
+    Un único 'rclone rcd' por ejecución (o por vida del daemon).
+
+    Todas las copias y borrados van por su API RC (HTTP JSON en localhost),
+    así rclone lee la config y autentica con el remoto una sola vez.
+    transfers/checkers se mandan en cada llamada (_config), de modo que un
+    cambio en config.yaml se aplica sin reiniciar el proceso.
+
+    Con un remoto 'type = local' en el rclone.conf se puede probar sin red.
     """
-    audio_path = Path(base_path) / audio_dir
 
-    if not audio_path.is_dir():
-        print(f"[Rc] {audio_path} no existe o no es un directorio")
-        return False
+    def __init__(self, config_path: str = CONFIG_PATH, addr: str = RC_ADDR,
+                 transfers: int = 4, checkers: int = 8, binary: str = "rclone"):
+        self.config_path = config_path
+        self.addr = addr
+        self.transfers = transfers
+        self.checkers = checkers
+        self.binary = binary
+        self._proc = None
+        self._lock = threading.Lock()
+        # credenciales de un solo uso: el rcd sólo escucha en localhost,
+        # pero así nadie más en la máquina puede lanzarle trabajos
+        self._user = "sherlocaster"
+        self._pass = secrets.token_hex(16)
 
-    print(f"[Rc] Subiendo todos los .mp3 desde {audio_path} → {remote}:{remote_path}")
+    def start(self, timeout: float = 15):
+        with self._lock:
+            if self._proc and self._proc.poll() is None:
+                return
 
-    cmd = [
-        "rclone",
-        "--config", CONFIG_PATH,
-        "copy",                       # copia el contenido del dir
-        str(audio_path),
-        f"{remote}:{remote_path}",
-        "--include", "*.mp3",         # solo mp3
-    ]
+            cmd = [
+                self.binary,
+                "--config", self.config_path,
+                "rcd",
+                "--rc-addr", self.addr,
+            ]
+            # credenciales por entorno: en la línea de comandos las vería
+            # cualquiera que liste los procesos de la máquina
+            env = dict(os.environ, RCLONE_RC_USER=self._user, RCLONE_RC_PASS=self._pass)
+            self._proc = subprocess.Popen(
+                cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
 
-    proc = subprocess.run(cmd, capture_output=True, text=True)
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    self._post("rc/noop", {}, timeout=2)
+                    break
+                except Exception:
+                    if self._proc.poll() is not None:
+                        raise RcloneError(f"rclone rcd terminó al arrancar (código {self._proc.returncode})")
+                    if time.monotonic() > deadline:
+                        self._proc.kill()
+                        raise RcloneError(f"rclone rcd no responde en {self.addr}")
+                    time.sleep(0.2)
 
-    if proc.returncode != 0:
-        print("[Rc] Error subiendo carpeta audio:")
-        print(proc.stderr)
-        return False
+        print(f"[Rc] rclone rcd escuchando en {self.addr}")
 
-    print("[Rc] Subida de carpeta audio OK")
-    shutil.rmtree(os.path.join(base_path, audio_dir))
-    os.makedirs(os.path.join(base_path, audio_dir), exist_ok=True)
-    return True
+    def stop(self):
+        with self._lock:
+            if not self._proc or self._proc.poll() is not None:
+                return
+            try:
+                self._post("core/quit", {}, timeout=5)
+                self._proc.wait(timeout=10)
+            except Exception:
+                self._proc.kill()
+            self._proc = None
 
+    def _post(self, method: str, params: dict, timeout=None) -> dict:
+        auth = base64.b64encode(f"{self._user}:{self._pass}".encode()).decode()
+        req = urllib.request.Request(
+            f"http://{self.addr}/{method}",
+            data=json.dumps(params).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Basic {auth}"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as r:
+                return json.loads(r.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read()).get("error", "")
+            except Exception:
+                error = ""
+            raise RcloneError(f"{method}: HTTP {e.code} {error}".strip())
 
-def rclone_upload(mp3_path: Path, remote: str, remote_path: str):
-    mp3_path = Path(mp3_path)
-    target = f"{remote}:{remote_path}"
-    cmd = [
-    "rclone",
-    "--config", CONFIG_PATH,
-    "copy",
-    str(mp3_path),
-    f"{remote}:{remote_path}"
-    ]
+    def call(self, method: str, **params) -> dict:
+        """Llama a un método RC (arrancando el rcd si hace falta)."""
+        self.start()
+        params.setdefault("_config", {"Transfers": self.transfers, "Checkers": self.checkers})
+        with span(f"rclone.{method}"):
+            return self._post(method, params)
 
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    if proc.returncode != 0:
-        print(f"[Rc] Error subiendo {mp3_path.name}: {proc.stderr}")
-        return False
-    print(f"[Rc] Subido: {mp3_path.name}")
-    return True
+    def copy_dir(self, src: str, dst_fs: str, include: list | None = None) -> dict:
+        params = {"srcFs": src, "dstFs": dst_fs}
+        if include:
+            params["_filter"] = {"IncludeRule": include}
+        return self.call("sync/copy", **params)
 
-def upload_feed(config):
-    remote = config['rclone']['remote']
-    remote_path = config['rclone']['path']
-    feed_path = Path("/data/feed.xml")
-
-    cmd = [
-        "rclone",
-        "--config", CONFIG_PATH,
-        "copy",
-        str(feed_path),
-        f"{remote}:{remote_path}"
-    ]
+    def copy_file(self, src_path, dst_fs: str, dst_name: str | None = None) -> dict:
+        src_path = Path(src_path)
+        return self.call(
+            "operations/copyfile",
+            srcFs=str(src_path.parent),
+            srcRemote=src_path.name,
+            dstFs=dst_fs,
+            dstRemote=dst_name or src_path.name,
+        )
+
+    def stat(self, fs: str, remote: str) -> dict | None:
+        """Tamaño y hashes de un archivo remoto, o None si no existe."""
+        res = self.call(
+            "operations/stat", fs=fs, remote=remote,
+            opt={"showHash": True, "hashTypes": ["md5"]},
+        )
+        return res.get("item")
+
+    def delete(self, fs: str, min_age: str | None = None) -> dict:
+        params = {"fs": fs}
+        if min_age:
+            params["_filter"] = {"MinAge": min_age}
+        return self.call("operations/delete", **params)
+
+    def delete_files(self, fs: str, names: list) -> dict:
+        """
+        Borra una lista de archivos en un solo trabajo. Con FilesFromRaw
+        rclone va directo a cada archivo sin listar el directorio remoto.
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("\n".join(names) + "\n")
+        try:
+            return self.call("operations/delete", fs=fs, _filter={"FilesFromRaw": [f.name]})
+        finally:
+            os.unlink(f.name)
 
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    if proc.returncode == 0:
-        print("[Rc] Feed subido")
-    else:
-        print("[Rc] Error subiendo feed:", proc.stderr)
 
-def rclone_cleanup(remote: str, remote_path: str, retention_days: int):
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def rclone_backend(config: dict) -> RcloneRC:
     """
-    Borra archivos del remoto más antiguos que retention_days usando rclone.
-    Si retention_days == 0 no hace nada (modo desactivado).
+    Backend compartido: se arranca la primera vez que se usa y se para al
+    salir del proceso. En modo daemon se reutiliza entre pasadas, salvo
+    que config.yaml cambie rclone.config o rclone.rc_addr: entonces se
+    para el rcd anterior y se arranca otro con la nueva config.
     """
-    if not retention_days or retention_days <= 0:
-        print("[Rc] Limpieza remota desactivada (retention_days <= 0)")
-        return
+    global _backend
+    cfg = config.get("rclone", {})
+    config_path = cfg.get("config", CONFIG_PATH)
+    addr = cfg.get("rc_addr", RC_ADDR)
+    with _backend_lock:
+        if _backend is not None and (_backend.config_path, _backend.addr) != (config_path, addr):
+            _backend.stop()
+            _backend = None
+        if _backend is None:
+            _backend = RcloneRC(config_path=config_path, addr=addr)
+            atexit.register(_backend.stop)
+        _backend.transfers = cfg.get("transfers", 4)
+        _backend.checkers = cfg.get("checkers", 8)
+    return _backend
 
-    print(f"[Rc] Borrando > {retention_days} días")
-    cmd = [
-        "rclone",
-        "--config", "/app/config/rclone.conf",
-        "delete",
-        f"{remote}:{remote_path}",
-        "--min-age", f"{retention_days}d"
-    ]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+def _fs(remote: str, remote_path: str) -> str:
+    return f"{remote}:{remote_path}"
 
-    if result.returncode != 0:
-        print("[Rc] Error limpieza remota:")
-        print(result.stderr)
-    else:
-        print("[Rc] Limpieza remota OK")
 
-def flush_pending_audio(base_path, audio_dir, remote, remote_path):
+class UploadManifest:
     """
-    Sube archivos *.mp3 pendientes en la carpeta audio y luego la limpia.
+    Registro por archivo de lo que se ha subido (tabla 'uploads' de state.db).
+
+    Al encolar un .mp3 se guardan su tamaño y md5; la copia local sólo se
+    borra cuando el remoto tiene un archivo con el mismo tamaño (y el mismo
+    md5 si el remoto lo ofrece, como Drive). Lo que no se verifica se queda
+    en audio/ y se reintenta en la siguiente ejecución sin volver a
+    descargarlo. Cada cambio es una fila, y la entrada se olvida en cuanto
+    se borra la copia local verificada, así que no crece con el histórico.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS uploads (
+        name        TEXT PRIMARY KEY,
+        size        INTEGER NOT NULL,
+        md5         TEXT NOT NULL,
+        status      TEXT NOT NULL,
+        recorded_at REAL NOT NULL,
+        checked_at  REAL
+    );
     """
-    audio_path = os.path.join(base_path, audio_dir)
 
-    if not os.path.isdir(audio_path):
-        print(f"[Rc] {audio_path} no existe")
-        return
+    def __init__(self, path: Path | None = None):
+        self.path = Path(path or state_store.STATE_DB)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate_json()
+
+    def _migrate_json(self):
+        """Importa upload_manifest.json (formato anterior) y lo renombra a .migrated."""
+        if not MANIFEST_FILE.exists():
+            return
+        try:
+            with MANIFEST_FILE.open("r") as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"[Rc] Error leyendo {MANIFEST_FILE}, no se migra: {e}")
+            return
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for name, e in entries.items():
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO uploads (name, size, md5, status, recorded_at, checked_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (name, e["size"], e["md5"], e.get("status", "pendiente"),
+                     e.get("recorded_at", 0), e.get("checked_at")),
+                )
+            self._conn.execute("COMMIT")
+        os.replace(MANIFEST_FILE, MANIFEST_FILE.with_suffix(".json.migrated"))
+        print(f"[Rc] Migradas {len(entries)} entradas de {MANIFEST_FILE} a {self.path}")
+
+    def record(self, path: Path) -> dict:
+        md5 = hashlib.md5()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                md5.update(block)
+        entry = {
+            "size": path.stat().st_size,
+            "md5": md5.hexdigest(),
+            "status": "pendiente",
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads (name, size, md5, status, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (path.name, entry["size"], entry["md5"], entry["status"], entry["recorded_at"]),
+            )
+        return entry
+
+    def get(self, name: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, md5, status, recorded_at, checked_at FROM uploads WHERE name = ?", (name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def forget(self, names):
+        with self._lock:
+            self._conn.executemany("DELETE FROM uploads WHERE name = ?", [(n,) for n in names])
+
+    def mark(self, name: str, status: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE uploads SET status = ?, checked_at = ? WHERE name = ?",
+                (status, time.time(), name),
+            )
+
+    def prune(self, audio_path: Path) -> int:
+        """Olvida las entradas verificadas cuyo archivo ya no está en audio_path."""
+        with self._lock:
+            names = [r["name"] for r in self._conn.execute(
+                "SELECT name FROM uploads WHERE status = 'verificado'"
+            )]
+        gone = [n for n in names if not (Path(audio_path) / n).exists()]
+        self.forget(gone)
+        return len(gone)
+
+
+def verify_upload(rc: RcloneRC, manifest: UploadManifest, path: Path, dst_fs: str) -> bool:
+    """
+    Comprueba que 'path' está en dst_fs tal y como lo registró el manifest
+    (tamaño y, si el remoto lo da, md5) y que el local no ha cambiado.
+    """
+    entry = manifest.get(path.name)
+    if entry is None:
+        return False
+
+    try:
+        if path.stat().st_size != entry["size"]:
+            print(f"[Rc] {path.name} ha cambiado desde que se registró, no se verifica")
+            return False
+        item = rc.stat(dst_fs, path.name)
+    except Exception as e:
+        print(f"[Rc] No se pudo verificar {path.name}: {e}")
+        return False
+
+    remote_md5 = ((item or {}).get("Hashes") or {}).get("md5")
+    if not item or item.get("Size") != entry["size"] or (remote_md5 and remote_md5 != entry["md5"]):
+        print(f"[Rc] Verificación fallida para {path.name}, se reintentará")
+        manifest.mark(path.name, "fallido")
+        return False
+
+    manifest.mark(path.name, "verificado")
+    run_metrics().add("bytes_uploaded", entry["size"])
+    return True
+
 
-    # Buscar mp3 en la carpeta
-    mp3_files = glob.glob(os.path.join(audio_path, "*.mp3"))
+def _remove_verified(paths):
+    """Borra las copias locales ya verificadas y sus entradas del manifest."""
+    for path in paths:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+    upload_manifest().forget(path.name for path in paths)
 
-    if mp3_files:
-        print(f"[Rc] {len(mp3_files)} pendiente en {audio_path}")
 
-        for mp3 in mp3_files:
-            fname = os.path.basename(mp3)
-            remote_dest = f"{remote_path}/{fname}"
+class UploadStage:
+    """
+    Subida de cada MP3 en cuanto su downloader termina de codificarlo,
+    con como mucho 'workers' subidas a la vez, mientras las fuentes
+    siguen descargando.
+
+    submit(path) devuelve el mismo path para poder encadenarlo tras la
+    codificación. wait() espera a todas las subidas de la pasada, borra
+    las copias locales verificadas y devuelve sus nombres de archivo.
+    """
 
-            print(f"[Rc] Subiendo → {fname} → {remote}:{remote_dest}")
+    def __init__(self, rc: RcloneRC, manifest: UploadManifest, remote: str,
+                 remote_path: str, workers: int = 2):
+        self.rc = rc
+        self.manifest = manifest
+        self.dst_fs = _fs(remote, remote_path)
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload")
+        self._pending = {}
+        self._lock = threading.Lock()
 
+    def _upload(self, path: Path) -> bool:
+        start = time.monotonic()
+        metrics = run_metrics()
+        with metrics.phase("upload"):
             try:
-                rclone_upload(mp3, remote, remote_dest)
-                print(f"[Rc] Subido {fname}")
+                self.manifest.record(path)
+                self.rc.copy_file(path, self.dst_fs)
             except Exception as e:
-                print(f"[Rc][Error] Falló subida de {fname}: {e}")
-    else:
+                print(f"[Rc] Error subiendo {path.name}: {e}")
+                metrics.fail("upload")
+                return False
+            if not verify_upload(self.rc, self.manifest, path, self.dst_fs):
+                metrics.fail("upload")
+                return False
+        elapsed = time.monotonic() - start
+        metrics.observe("upload", elapsed)
+        print(f"[Rc] Subido: {path.name} ({elapsed:.1f} s)")
+        return True
+
+    def submit(self, path):
+        if path:
+            path = Path(path)
+            with self._lock:
+                self._pending[path] = self._pool.submit(self._upload, path)
+        return path
+
+    def wait(self) -> set:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        verified = [path for path, future in pending.items() if future.result()]
+        _remove_verified(verified)
+        return {path.name for path in verified}
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+_stage = None
+_manifest = None
+
+
+def upload_manifest() -> UploadManifest:
+    global _manifest
+    with _backend_lock:
+        if _manifest is None:
+            _manifest = UploadManifest()
+    return _manifest
+
+
+def upload_stage(config: dict) -> UploadStage:
+    """
+    Etapa de subida compartida por las fuentes (una por proceso). Se
+    rehace si cambian el backend, el destino o upload_workers (recarga de
+    config.yaml en modo daemon, siempre entre pasadas).
+    """
+    global _stage
+    cfg = config.get("rclone", {})
+    rc = rclone_backend(config)
+    manifest = upload_manifest()
+    dst_fs = _fs(cfg.get("remote"), cfg.get("path", ""))
+    workers = max(1, cfg.get("upload_workers", 2))
+    with _backend_lock:
+        if _stage is not None and (_stage.rc, _stage.dst_fs, _stage.workers) != (rc, dst_fs, workers):
+            _stage.close()
+            _stage = None
+        if _stage is None:
+            _stage = UploadStage(rc, manifest, cfg.get("remote"), cfg.get("path", ""), workers=workers)
+    return _stage
+
+
+def upload_audio_dir(rc: RcloneRC, base_path: str, audio_dir: str, remote: str, remote_path: str) -> set:
+    """
+    Sube de una sola vez los .mp3 que quedan en la carpeta /audio (subidas
+    fallidas o de ejecuciones anteriores) y borra sólo los verificados.
+    - base_path: por ejemplo "/data"
+    - audio_dir: por ejemplo "audio"
+    - remote: nombre del remoto en rclone.conf (p.ej. "gdrive")
+    - remote_path: ruta remota (directorio), p.ej. "podcasts/sherlocaster"
+
+    Devuelve los nombres de archivo verificados en el remoto.
+    """
+    audio_path = Path(base_path) / audio_dir
+
+    if not audio_path.is_dir():
+        print(f"[Rc] {audio_path} no existe o no es un directorio")
+        return set()
+
+    # entradas de archivos ya verificados y borrados por otra vía
+    upload_manifest().prune(audio_path)
+
+    now = time.time()
+    pending = [
+        p for p in sorted(audio_path.glob("*.mp3"))
+        if now - p.stat().st_mtime >= SETTLE_SECONDS
+    ]
+    if not pending:
         print(f"[Rc] No hay pendientes en {audio_path}")
+        return set()
 
-    # Limpiar carpeta audio
+    dst_fs = _fs(remote, remote_path)
+    manifest = upload_manifest()
+    print(f"[Rc] Subiendo {len(pending)} .mp3 pendientes desde {audio_path} → {dst_fs}")
+
+    with run_metrics().phase("upload"):
+        try:
+            for path in pending:
+                entry = manifest.get(path.name)
+                if entry is None or entry["size"] != path.stat().st_size:
+                    manifest.record(path)
+            # un solo trabajo para todos; rclone se salta lo que ya esté igual
+            rc.copy_dir(str(audio_path), dst_fs, include=[p.name for p in pending])
+        except Exception as e:
+            print("[Rc] Error subiendo carpeta audio:")
+            print(e)
+            return set()
+
+        verified = [p for p in pending if verify_upload(rc, manifest, p, dst_fs)]
+    _remove_verified(verified)
+    print(f"[Rc] Subida de carpeta audio: {len(verified)}/{len(pending)} verificados")
+    return {p.name for p in verified}
+
+
+def rclone_upload(rc: RcloneRC, mp3_path: Path, remote: str, remote_path: str):
+    mp3_path = Path(mp3_path)
     try:
-        shutil.rmtree(audio_path)
-        os.makedirs(audio_path, exist_ok=True)
-        print(f"[Rc][Clean] Carpeta {audio_path} limpiada.")
+        rc.copy_file(mp3_path, _fs(remote, remote_path))
     except Exception as e:
-        print(f"[Rc][Error] Error al limpiar {audio_path}: {e}")
+        print(f"[Rc] Error subiendo {mp3_path.name}: {e}")
+        return False
+    print(f"[Rc] Subido: {mp3_path.name}")
+    return True
+
 
+def upload_feed(rc: RcloneRC, config) -> bool:
+    """Sube feed.xml al remoto. Devuelve True si se ha subido."""
+    remote = config['rclone']['remote']
+    remote_path = config['rclone']['path']
+    path = feed_path(config)
+
+    try:
+        with run_metrics().phase("upload"):
+            rc.copy_file(path, _fs(remote, remote_path))
+    except Exception as e:
+        print("[Rc] Error subiendo feed:", e)
+        return False
+    run_metrics().add("bytes_uploaded", path.stat().st_size)
+    print("[Rc] Feed subido")
+    return True
+
+
+def flush_pending_audio(rc: RcloneRC, base_path, audio_dir, remote, remote_path) -> set:
+    """
+    Sube archivos *.mp3 pendientes en la carpeta audio.
+    Equivale a upload_audio_dir: sólo se borra lo verificado en el remoto.
+    """
+    return upload_audio_dir(rc, base_path, audio_dir, remote, remote_path)
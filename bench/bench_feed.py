@@ -0,0 +1,122 @@
+"""
+Mide generate_feed con un estado sintético de N episodios (5.000 por defecto):
+
+- frío:        sin feed_state.json ni feed_items.json, feedgen renderiza todo
+- un nuevo:    un episodio más que la pasada anterior (se renderiza sólo ese item)
+- sin cambios: mismas entradas que la pasada anterior (se reutiliza feed.xml)
+
+También cuenta las llamadas a os.stat sobre ficheros de audio, que
+deben ser cero.
+
+Uso:
+    python -m bench.bench_feed [--episodes 5000] [--runs 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import app.core.rss as rss
+from app.core.state import EpisodeStore
+
+
+CONFIG = {
+    "feed": {
+        "file_name": "feed.xml",
+        "url_base": "http://example.org/sherlocaster/",
+        "title": "Bench",
+        "image": "http://example.org/artwork.jpg",
+    }
+}
+
+
+def _episode(i: int) -> dict:
+    ts = (datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(hours=i)).isoformat().replace("+00:00", "Z")
+    return {
+        "id": f"yt_bench{i:06d}",
+        "source": "youtube",
+        "title": f"Canal {i % 12} — Episodio {i} & <especial>",
+        "channel": f"Canal {i % 12}",
+        "original_url": f"https://www.youtube.com/watch?v=bench{i:06d}",
+        "published_at": ts,
+        "downloaded_at": ts,
+        "file_path": f"/data/audio/yt_bench{i:06d}.mp3",
+        "size": 20_000_000 + i,
+        "duration_sec": 1800,
+    }
+
+
+def _make_state(n: int, path: Path) -> EpisodeStore:
+    store = EpisodeStore(path)
+    store.add([_episode(i) for i in range(n)])
+    return store
+
+
+def _timed(runs: int, setup, fn) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        setup()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--episodes", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state = _make_state(args.episodes, Path(tmp) / "state.db")
+        rss.DATA_DIR = Path(tmp)
+        rss.FEED_STATE = Path(tmp) / "feed_state.json"
+        rss.ITEM_CACHE = Path(tmp) / "feed_items.json"
+        feed = Path(tmp) / "feed.xml"
+
+        def _cold():
+            rss.FEED_STATE.unlink(missing_ok=True)
+            rss.ITEM_CACHE.unlink(missing_ok=True)
+            feed.unlink(missing_ok=True)
+
+        extra = iter(range(args.episodes, args.episodes + args.runs))
+
+        def _one_new():
+            gen()  # caché al día con el estado actual
+            state.add([_episode(next(extra))])
+
+        gen = lambda: rss.generate_feed(CONFIG, state)
+
+        results = {
+            "frío": _timed(args.runs, _cold, gen),
+            "un nuevo": _timed(args.runs, _one_new, gen),
+            "sin cambios": _timed(args.runs, lambda: None, gen),
+        }
+
+        # contar stat() sobre ficheros de audio durante una generación
+        audio_stats = 0
+        real_stat = os.stat
+
+        def _counting_stat(path, *a, **kw):
+            nonlocal audio_stats
+            if str(path).endswith(".mp3"):
+                audio_stats += 1
+            return real_stat(path, *a, **kw)
+
+        os.stat = _counting_stat
+        try:
+            gen()
+        finally:
+            os.stat = real_stat
+
+    print()
+    for name, secs in results.items():
+        print(f"{name:12} {secs * 1000:8.1f} ms   ({args.episodes} episodios, mejor de {args.runs})")
+    print(f"stat() sobre audio: {audio_stats}")
+
+
+if __name__ == "__main__":
+    main()
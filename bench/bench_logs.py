@@ -0,0 +1,75 @@
+"""
+Mide el camino completo del log de una pasada con logs de varios tamaños:
+escritura con TeeLogger (rotación y compresión), publish_status,
+archive_last_run y publish_logs.
+
+Para cada tamaño muestra el tiempo de cada paso y el pico de memoria de
+Python (tracemalloc) durante la publicación, que no debe crecer con el
+tamaño del log.
+
+Uso:
+    python -m bench.bench_logs [--sizes 1,10,100] [--max-mb 20] [--backups 4]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import app.core.public as public
+from app.main import TeeLogger
+
+
+LINE = "[Yt] frame=12345 fps=250 q=-0.0 size=  10240kB time=00:10:00.00 bitrate= 64.0kbits/s <&>\n"
+
+
+def _timed(fn, *args) -> tuple:
+    """(segundos, pico de memoria en MB) de fn(*args)."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(*args)
+    secs = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return secs, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,10,100", help="MB de log por pasada")
+    parser.add_argument("--max-mb", type=float, default=20)
+    parser.add_argument("--backups", type=int, default=4)
+    args = parser.parse_args()
+
+    record = {"duration": 1.0, "episodes": 0, "timestamp": "2026-01-01T00:00:00+00:00"}
+    print(f"{'MB':>6} {'escritura':>10} {'status':>16} {'archivo':>16} {'logs':>16}  archivado")
+
+    for size_mb in (float(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            public.STATUS_DIR = os.path.join(tmp, "html")
+            public.LOG_DIR = os.path.join(tmp, "logs")
+            public.LAST_RUN = os.path.join(tmp, "last_run.log")
+
+            def _write():
+                tee = TeeLogger(public.LAST_RUN, int(args.max_mb * 2**20), args.backups)
+                tee.stdout = open(os.devnull, "w")
+                for _ in range(int(size_mb * 2**20 / len(LINE))):
+                    tee.write(LINE)
+                tee.close()
+                tee.stdout.close()
+
+            write_secs, _ = _timed(_write)
+            results = [
+                _timed(public.publish_status, "Bench", record),
+                _timed(public.archive_last_run, record),
+                _timed(public.publish_logs),
+            ]
+            archived = sum(f.stat().st_size for f in Path(public.LOG_DIR).glob("*.gz")) / 1e6
+
+        cols = " ".join(f"{s:>6.2f}s {m:>6.2f}MB" for s, m in results)
+        print(f"{size_mb:>6.0f} {write_secs:>9.2f}s {cols}  {archived:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Pasadas completas de app.main.run sin red ni herramientas externas.
+
+yt-dlp, curl_cffi (API de Kick), los feeds Atom, el HLS, twitch-dl,
+ffmpeg y ffprobe se sustituyen por los falsos de bench.fakes. Para rclone
+se usa un remoto 'type = local' con el rclone real si está instalado (o
+con un rcd falso si no, o con --fake-rclone).
+
+Cada escenario (canales × episodios guardados) corre en un proceso aparte
+con su propio /data temporal:
+
+- pasada 1 (fría): todos los canales tienen un vídeo nuevo, caché vacía
+- pasadas 2..N: sólo publica una fracción de canales (--active)
+
+Los resultados se añaden a bench/results.jsonl con el commit actual y se
+comparan con la última medida del mismo escenario en otro commit.
+
+Uso:
+    python -m bench.bench_run [--channels 10,100,1000] [--episodes 1000,10000,100000]
+                              [--passes 3] [--active 0.1] [--check]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+
+import yaml
+
+from bench import fakes
+
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_FILE = Path(__file__).with_name("results.jsonl")
+
+
+def _ints(text: str) -> list:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _git_commit() -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return "desconocido"
+    return f"{commit}-dirty" if dirty else commit
+
+
+# --- un escenario (proceso hijo) --------------------------------------------
+
+def _config(tmp: Path, catalog: fakes.Catalog, upstream: fakes.Upstream) -> dict:
+    """config.yaml del repo con canales, rutas y remoto del banco de pruebas."""
+    with (ROOT / "config.yaml").open() as f:
+        config = yaml.safe_load(f)
+
+    channels = catalog.channel_config()
+    for src in fakes.SOURCES:
+        config["sources"][src]["enabled"] = True
+        config["sources"][src]["channels"] = channels.get(src, [])
+    config["sources"]["youtube"]["feed_url"] = f"{upstream.url}/feeds/videos.xml?channel_id={{channel_id}}"
+
+    remote_dir = tmp / "remote"
+    remote_dir.mkdir()
+    rclone_conf = tmp / "rclone.conf"
+    rclone_conf.write_text("[bench]\ntype = local\n")
+
+    config["storage"]["base_path"] = str(tmp / "data")
+    config["rclone"].update({
+        "remote": "bench",
+        "path": str(remote_dir),
+        "config": str(rclone_conf),
+        "rc_addr": f"127.0.0.1:{_free_port()}",
+    })
+    config["feed"]["url_base"] = "http://bench.invalid/sherlocaster/"
+    config["polling"] = dict(config.get("polling") or {}, adaptive=False)
+    config["retention"] = {"days": 0, "max_items": None, "purge_audio": False}
+    config["metrics"] = {"serve": False}
+    return config
+
+
+def _seed(state, catalog: fakes.Catalog, n: int):
+    """n episodios ya subidos, anteriores a todo el catálogo, repartidos entre canales."""
+    channels = catalog.channel_names()
+    oldest = catalog.published(0) - n * fakes.PUBLISH_STEP
+    episodes = []
+    for i in range(n):
+        source, channel = channels[i % len(channels)] if channels else ("youtube", "Canal")
+        ts = datetime.fromtimestamp(oldest + i * fakes.PUBLISH_STEP, timezone.utc)
+        ts = ts.isoformat().replace("+00:00", "Z")
+        episodes.append({
+            "id": f"seed_{i:07d}",
+            "source": source,
+            "title": f"{channel} — Episodio guardado {i}",
+            "channel": channel,
+            "original_url": f"https://example.org/seed/{i}",
+            "published_at": ts,
+            "downloaded_at": ts,
+            "file_path": f"/data/audio/seed_{i:07d}.mp3",
+            "size": 20_000_000,
+            "duration_sec": fakes.DURATION,
+            "uploaded": True,
+        })
+    state.add(episodes)
+
+
+def _expected(catalog: fakes.Catalog) -> int:
+    """Episodios nuevos que debería encontrar la pasada del tick actual."""
+    total = len(catalog.channel_names())
+    if catalog.tick == 0:
+        return total
+    catalog.tick -= 1
+    before = {i: catalog.count(i) for src in fakes.SOURCES for i in catalog.channels[src]}
+    catalog.tick += 1
+    return sum(1 for i, c in before.items() if catalog.count(i) > c)
+
+
+def run_scenario(channels: int, episodes: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="sherlocaster-bench-") as tmp:
+        tmp = Path(tmp)
+        catalog = fakes.Catalog(channels, active=args.active, segments=args.segments,
+                                segment_bytes=args.segment_kb * 1024,
+                                latency=args.latency_ms / 1000)
+        upstream = fakes.Upstream(catalog)
+        use_real = fakes.real_rclone() is not None and not args.fake_rclone
+        fakes.install_tools(tmp / "bin", upstream, fake_rclone=not use_real)
+        fakes.install_modules(upstream)
+        fakes.relocate(tmp / "data")
+
+        import app.main
+        import app.uploader.rclone as rclone
+        from app.core.metrics import last_record
+        from app.core.state import EpisodeStore
+
+        config = _config(tmp, catalog, upstream)
+        state = EpisodeStore(tmp / "data" / "state.db")
+        t0 = time.perf_counter()
+        _seed(state, catalog, episodes)
+        seed_secs = time.perf_counter() - t0
+
+        passes = []
+        try:
+            for tick in range(args.passes):
+                catalog.tick = tick
+                expected = _expected(catalog)
+
+                wall0, cpu0, child0 = time.perf_counter(), time.process_time(), _children_cpu()
+                with open(os.devnull, "w") as null:
+                    sys.stdout = null
+                    try:
+                        app.main.run(config, state)
+                    finally:
+                        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+                wall = time.perf_counter() - wall0
+
+                record = last_record() or {}
+                passes.append({
+                    "wall": round(wall, 3),
+                    "cpu": round(time.process_time() - cpu0, 3),
+                    "child_cpu": round(_children_cpu() - child0, 3),
+                    "episodes": record.get("episodes", 0),
+                    "expected": expected,
+                    "failures": record.get("failures", {}),
+                    "phases": record.get("phases", {}),
+                })
+        finally:
+            if rclone._backend is not None:
+                rclone._backend.stop()
+            upstream.stop()
+            state.close()
+
+    steady = [p["wall"] for p in passes[1:]]
+    return {
+        "channels": channels,
+        "episodes": episodes,
+        "active": args.active,
+        "rclone": "real" if use_real else "falso",
+        "seed": round(seed_secs, 3),
+        "cold": passes[0]["wall"] if passes else None,
+        "steady": round(median(steady), 3) if steady else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "ok": all(p["episodes"] == p["expected"] and not p["failures"] for p in passes),
+        "passes": passes,
+    }
+
+
+# --- comparación entre commits -----------------------------------------------
+
+def _key(result: dict) -> tuple:
+    return (result["channels"], result["episodes"], result["active"], result["rclone"], result.get("host"))
+
+
+def _previous(path: Path, commit: str) -> dict:
+    """Última medida de cada escenario hecha en otro commit."""
+    previous = {}
+    try:
+        with path.open() as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if result.get("commit") != commit:
+                    previous[_key(result)] = result
+    except OSError:
+        pass
+    return previous
+
+
+def _delta(new, old) -> str:
+    if not new or not old:
+        return ""
+    return f"{100 * (new - old) / old:+.0f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--channels", type=_ints, default=[10, 100, 1000])
+    parser.add_argument("--episodes", type=_ints, default=[1000, 10000, 100000])
+    parser.add_argument("--passes", type=int, default=3)
+    parser.add_argument("--active", type=float, default=0.1,
+                        help="fracción de canales que publica en cada pasada tras la primera")
+    parser.add_argument("--segments", type=int, default=6, help="segmentos HLS por vídeo")
+    parser.add_argument("--segment-kb", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=0, help="latencia de cada petición falsa")
+    parser.add_argument("--fake-rclone", action="store_true", help="rcd falso aunque haya rclone")
+    parser.add_argument("--results", type=Path, default=RESULTS_FILE)
+    parser.add_argument("--threshold", type=float, default=10, help="%% a partir del que se avisa")
+    parser.add_argument("--check", action="store_true", help="sale con código 1 si hay regresiones")
+    parser.add_argument("--one", nargs=2, type=int, metavar=("CANALES", "EPISODIOS"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        print(json.dumps(run_scenario(*args.one, args)))
+        return
+
+    commit = _git_commit()
+    previous = _previous(args.results, commit)
+    scenario_args = [
+        "--passes", str(args.passes), "--active", str(args.active),
+        "--segments", str(args.segments), "--segment-kb", str(args.segment_kb),
+        "--latency-ms", str(args.latency_ms),
+    ] + (["--fake-rclone"] if args.fake_rclone else [])
+
+    print(f"Commit {commit}, {args.passes} pasadas por escenario, {args.active:.0%} de canales activos")
+    print(f"{'canales':>8} {'episodios':>10} {'fría':>9} {'estable':>9} {'RSS MB':>8}  vs. anterior")
+
+    regressions = []
+    for channels, episodes in itertools.product(args.channels, args.episodes):
+        proc = subprocess.run(
+            [sys.executable, "-m", "bench.bench_run", "--one", str(channels), str(episodes), *scenario_args],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{channels:>8} {episodes:>10}  error:\n{proc.stderr.strip()[-2000:]}")
+            continue
+
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result.update({
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+        })
+        args.results.parent.mkdir(parents=True, exist_ok=True)
+        with args.results.open("a") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+        old = previous.get(_key(result))
+        compare = ""
+        if old:
+            compare = f"{_delta(result['cold'], old['cold'])} / {_delta(result['steady'], old['steady'])} ({old['commit']})"
+            for name in ("cold", "steady"):
+                if result[name] and old.get(name) and result[name] > old[name] * (1 + args.threshold / 100):
+                    regressions.append((channels, episodes, name, old["commit"]))
+
+        steady = f"{result['steady']:.2f}s" if result["steady"] is not None else "-"
+        warn = "" if result["ok"] else "  ¡episodios o fallos inesperados!"
+        print(f"{channels:>8} {episodes:>10} {result['cold']:>8.2f}s {steady:>9} "
+              f"{result['peak_rss_mb']:>8.0f}  {compare}{warn}")
+
+    print(f"Resultados en {args.results}")
+    for channels, episodes, name, old_commit in regressions:
+        print(f"REGRESIÓN: {channels} canales, {episodes} episodios, pasada "
+              f"{'fría' if name == 'cold' else 'estable'} > {args.threshold:.0f}% respecto a {old_commit}")
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Compara el coste de CPU de la codificación de audio de YouTube:
+
+- antiguo: bestaudio → MP3 estéreo (FFmpegExtractAudio) → MP3 mono
+- nuevo:   bestaudio → MP3 mono en una sola pasada
+
+Uso:
+    python -m bench.bench_youtube_encode muestra.webm [--bitrate 64k] [--runs 3]
+"""
+import argparse
+import resource
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from app.downloader.youtube import _encode_to_mono_mp3
+
+
+def _ffmpeg(*args):
+    subprocess.run(
+        ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args],
+        check=True,
+    )
+
+
+def _old_path(sample: Path, work: Path, bitrate: str):
+    kbps = ''.join(ch for ch in bitrate if ch.isdigit()) or "64"
+    stereo = work / "old_stereo.mp3"
+    mono = work / "old_mono.mp3"
+    # lo que hacía FFmpegExtractAudio con preferredquality
+    _ffmpeg("-i", str(sample), "-vn", "-acodec", "libmp3lame", "-b:a", f"{kbps}k", str(stereo))
+    # lo que hacía _convert_mp3_to_mono
+    _ffmpeg("-i", str(stereo), "-ac", "1", "-acodec", "libmp3lame", "-b:a", bitrate, str(mono))
+
+
+def _new_path(sample: Path, work: Path, bitrate: str):
+    src = work / f"new{sample.suffix}"
+    src.write_bytes(sample.read_bytes())
+    _encode_to_mono_mp3(src, work, bitrate)
+
+
+def _measure(fn, *args) -> tuple:
+    """Devuelve (segundos de CPU de procesos hijo, segundos de reloj)."""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    t0 = time.perf_counter()
+    fn(*args)
+    wall = time.perf_counter() - t0
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return cpu, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sample", type=Path, help="fichero de audio local (webm, m4a...)")
+    parser.add_argument("--bitrate", default="64k")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {"antiguo": [], "nuevo": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        for _ in range(args.runs):
+            results["antiguo"].append(_measure(_old_path, args.sample, work, args.bitrate))
+            results["nuevo"].append(_measure(_new_path, args.sample, work, args.bitrate))
+
+    for name, runs in results.items():
+        cpu = min(r[0] for r in runs)
+        wall = min(r[1] for r in runs)
+        print(f"{name:8} CPU {cpu:7.2f} s   reloj {wall:7.2f} s   (mejor de {args.runs})")
+
+    old_cpu = min(r[0] for r in results["antiguo"])
+    new_cpu = min(r[0] for r in results["nuevo"])
+    if new_cpu > 0:
+        print(f"ahorro de CPU: x{old_cpu / new_cpu:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Sustitutos de los ejecutables externos para el banco de pruebas offline
+(bench.bench_run). Cada uno se lanza como
+
+    python fake_tools.py <herramienta> [argumentos...]
+
+desde los envoltorios que bench.fakes crea en un bin/ temporal:
+
+- twitch-dl: 'videos' e 'info' contra el servidor falso (BENCH_UPSTREAM),
+  'download' baja los segmentos a un archivo
+- ffmpeg:    copia la entrada (pipe:0, archivo o lista concat) a la salida
+- ffprobe:   duración fija
+- rclone:    'rcd' con los métodos RC que usa app.uploader.rclone sobre
+  remotos locales (sólo si no hay un rclone real instalado)
+
+No importa nada de app/ ni de bench/: así arranca rápido.
+"""
+import base64
+import configparser
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _get(path: str) -> bytes:
+    with urllib.request.urlopen(os.environ["BENCH_UPSTREAM"] + path, timeout=30) as r:
+        return r.read()
+
+
+def _option(args: list, name: str, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+# --- twitch-dl --------------------------------------------------------------
+
+def twitch_dl(args: list) -> int:
+    cmd, target = args[0], args[1]
+    if cmd == "videos":
+        sys.stdout.write(_get(f"/twitch/{target}/videos").decode())
+    elif cmd == "info":
+        url = f"{os.environ['BENCH_UPSTREAM']}/hls/{target}/160p/playlist.m3u8"
+        json.dump({"id": target, "playlists": [{"name": "audio_only", "url": url}]}, sys.stdout)
+    elif cmd == "download":
+        playlist = _get(f"/hls/{target}/160p/playlist.m3u8").decode()
+        with open(_option(args, "--output"), "wb") as f:
+            for line in playlist.splitlines():
+                if line and not line.startswith("#"):
+                    f.write(_get(f"/hls/{target}/160p/{line}"))
+    else:
+        print(f"twitch-dl (bench): comando no soportado {cmd!r}", file=sys.stderr)
+        return 2
+    return 0
+
+
+# --- ffmpeg / ffprobe ---------------------------------------------------------
+
+def ffmpeg(args: list) -> int:
+    src, dst = _option(args, "-i"), args[-1]
+    with open(dst, "wb") as out:
+        if src == "pipe:0":
+            shutil.copyfileobj(sys.stdin.buffer, out)
+        elif _option(args, "-f") == "concat":
+            with open(src) as listing:
+                for line in listing:
+                    line = line.strip()
+                    if line.startswith("file "):
+                        with open(line[5:].strip("'"), "rb") as part:
+                            shutil.copyfileobj(part, out)
+        else:
+            with open(src, "rb") as f:
+                shutil.copyfileobj(f, out)
+    return 0
+
+
+def ffprobe(args: list) -> int:
+    print("3600.000000")
+    return 0
+
+
+# --- rclone rcd -------------------------------------------------------------
+
+def _local_path(fs: str) -> str:
+    """'remoto:/ruta' de un remoto local → '/ruta' (igual que rclone)."""
+    if ":" in fs and not fs.startswith("/"):
+        return fs.split(":", 1)[1] or "."
+    return fs
+
+
+def _md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _copy(src: str, dst: str):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copyfile(src, dst)
+
+
+def _rc(method: str, params: dict) -> dict:
+    filters = params.get("_filter") or {}
+
+    if method == "rc/noop":
+        return params
+    if method == "core/quit":
+        return {}
+    if method == "operations/copyfile":
+        _copy(
+            os.path.join(_local_path(params["srcFs"]), params["srcRemote"]),
+            os.path.join(_local_path(params["dstFs"]), params["dstRemote"]),
+        )
+        return {}
+    if method == "sync/copy":
+        src, dst = _local_path(params["srcFs"]), _local_path(params["dstFs"])
+        include = filters.get("IncludeRule")
+        for name in sorted(os.listdir(src)):
+            if include and not any(fnmatch.fnmatch(name, rule) for rule in include):
+                continue
+            if os.path.isfile(os.path.join(src, name)):
+                _copy(os.path.join(src, name), os.path.join(dst, name))
+        return {}
+    if method == "operations/stat":
+        path = os.path.join(_local_path(params["fs"]), params["remote"])
+        if not os.path.isfile(path):
+            return {"item": None}
+        return {"item": {
+            "Path": params["remote"],
+            "Name": os.path.basename(path),
+            "Size": os.path.getsize(path),
+            "Hashes": {"md5": _md5(path)},
+        }}
+    if method == "operations/delete":
+        root = _local_path(params["fs"])
+        if filters.get("FilesFromRaw"):
+            names = []
+            for listing in filters["FilesFromRaw"]:
+                with open(listing) as f:
+                    names += [line.strip() for line in f if line.strip()]
+        else:
+            names = os.listdir(root) if os.path.isdir(root) else []
+        min_age = filters.get("MinAge")
+        for name in names:
+            path = os.path.join(root, name)
+            if min_age and time.time() - os.path.getmtime(path) < _seconds(min_age):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return {}
+    raise NotImplementedError(method)
+
+
+def _seconds(age: str) -> float:
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    return float(age[:-1]) * units[age[-1]] if age[-1] in units else float(age)
+
+
+def rclone(args: list) -> int:
+    if "rcd" not in args:
+        print("rclone (bench): sólo se soporta 'rcd'", file=sys.stderr)
+        return 2
+
+    # sólo remotos 'type = local'
+    conf = configparser.ConfigParser()
+    conf.read(_option(args, "--config", ""))
+    for name in conf.sections():
+        if conf[name].get("type") != "local":
+            print(f"rclone (bench): el remoto {name} no es local", file=sys.stderr)
+            return 2
+
+    host, port = _option(args, "--rc-addr").rsplit(":", 1)
+    user = _option(args, "--rc-user", os.environ.get("RCLONE_RC_USER"))
+    password = _option(args, "--rc-pass", os.environ.get("RCLONE_RC_PASS"))
+    auth = "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.headers.get("Authorization") != auth:
+                self._reply(401, {"error": "unauthorized"})
+                return
+            method = self.path.strip("/")
+            params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            try:
+                body = _rc(method, params)
+            except NotImplementedError:
+                self._reply(404, {"error": f"método desconocido {method}"})
+                return
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, body)
+            if method == "core/quit":
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+        def _reply(self, code: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *a):
+            pass
+
+    ThreadingHTTPServer((host, int(port)), Handler).serve_forever()
+    return 0
+
+
+TOOLS = {
+    "twitch-dl": twitch_dl,
+    "ffmpeg": ffmpeg,
+    "ffprobe": ffprobe,
+    "rclone": rclone,
+}
+
+
+if __name__ == "__main__":
+    sys.exit(TOOLS[sys.argv[1]](sys.argv[2:]))
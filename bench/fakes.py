@@ -0,0 +1,387 @@
+"""
+Backends falsos para ejecutar app.main.run sin red ni herramientas externas.
+
+- Catalog: vídeos sintéticos por fuente y canal. Cada 'tick' (pasada) una
+  fracción de canales publica un episodio nuevo.
+- Upstream: servidor HTTP local que hace de API de Kick, de feeds Atom de
+  YouTube, de listado de Twitch (para el twitch-dl falso) y de servidor
+  HLS (master, variante y segmentos).
+- install_modules(): yt_dlp y curl_cffi falsos en sys.modules; hay que
+  llamarlo antes de importar los downloaders.
+- install_tools(): twitch-dl, ffmpeg, ffprobe (y rclone si no hay uno
+  real) en un bin/ temporal que se antepone al PATH.
+- relocate(): apunta todas las rutas /data de app/ a un directorio temporal.
+"""
+import json
+import os
+import shutil
+import stat
+import sys
+import threading
+import time
+import types
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+SOURCES = ("youtube", "twitch", "kick")
+DURATION = 3600                # duración de cada vídeo (s)
+FIRST_PUBLISHED = 36 * 3600    # el primer vídeo de cada canal, hace 36 h
+PUBLISH_STEP = 600             # cada vídeo nuevo, 10 min después del anterior
+TOOLS = ("twitch-dl", "ffmpeg", "ffprobe")
+
+
+class Catalog:
+    """
+    Vídeos de 'channels' canales repartidos entre las tres fuentes.
+
+    En el tick 0 cada canal tiene un vídeo; en cada tick siguiente publica
+    otro uno de cada round(1 / active) canales (active=0 → ninguno).
+    """
+
+    def __init__(self, channels: int, active: float = 0.1, segments: int = 6,
+                 segment_bytes: int = 32768, latency: float = 0.0):
+        self.tick = 0
+        self.active = active
+        self.segments = segments
+        self.segment = bytes(range(256)) * (segment_bytes // 256)
+        self.latency = latency
+        self.epoch = time.time()
+        self.channels = {src: [] for src in SOURCES}
+        for i in range(channels):
+            self.channels[SOURCES[i % len(SOURCES)]].append(i)
+
+    def count(self, idx: int) -> int:
+        if self.active <= 0:
+            return 1
+        period = max(1, round(1 / self.active))
+        return 1 + sum(1 for t in range(1, self.tick + 1) if (idx + t) % period == 0)
+
+    def published(self, n: int) -> float:
+        return self.epoch - FIRST_PUBLISHED + n * PUBLISH_STEP
+
+    def videos(self, idx: int, limit: int) -> list:
+        """[(n, published)] del canal, del más reciente al más antiguo."""
+        newest = self.count(idx)
+        return [(n, self.published(n)) for n in range(newest, max(0, newest - limit), -1)]
+
+    # --- identificadores por fuente ---
+
+    @staticmethod
+    def youtube_id(idx: int, n: int) -> str:
+        return f"b{idx:05d}n{n:04d}"
+
+    @staticmethod
+    def twitch_id(idx: int, n: int) -> str:
+        return f"9{idx:05d}{n:04d}"
+
+    @staticmethod
+    def kick_id(idx: int, n: int) -> int:
+        return 8_000_000_000 + idx * 10_000 + n
+
+    @staticmethod
+    def parse_id(vid: str) -> tuple:
+        """(idx, n) de cualquiera de los ids anteriores."""
+        digits = "".join(ch for ch in str(vid) if ch.isdigit())
+        return int(digits[-9:-4]), int(digits[-4:])
+
+    def channel_config(self) -> dict:
+        """Listas de canales para config['sources'] con el formato de config.yaml."""
+        out = {}
+        for idx in self.channels["youtube"]:
+            out.setdefault("youtube", []).append({
+                "name": f"YT {idx:05d}",
+                "url": f"https://www.youtube.com/@bench{idx:05d}/videos",
+            })
+        for idx in self.channels["twitch"]:
+            out.setdefault("twitch", []).append({"channel": f"bench{idx:05d}", "name": f"TW {idx:05d}"})
+        for idx in self.channels["kick"]:
+            out.setdefault("kick", []).append({"channel": f"bench{idx:05d}", "name": f"KC {idx:05d}"})
+        return out
+
+    def channel_names(self) -> list:
+        """[(fuente, nombre de canal)] en el mismo orden que channel_config."""
+        prefix = {"youtube": "YT", "twitch": "TW", "kick": "KC"}
+        return [(src, f"{prefix[src]} {idx:05d}") for src in SOURCES for idx in self.channels[src]]
+
+    # --- respuestas ---
+
+    def youtube_listing(self, idx: int, limit: int) -> dict:
+        return {
+            "channel_id": f"UCbench{idx:05d}",
+            "entries": [
+                {
+                    "id": self.youtube_id(idx, n),
+                    "title": f"Vídeo {n}",
+                    "url": f"https://www.youtube.com/watch?v={self.youtube_id(idx, n)}",
+                    "duration": DURATION,
+                }
+                for n, _ in self.videos(idx, limit)
+            ],
+        }
+
+    def youtube_details(self, vid: str) -> dict:
+        idx, n = self.parse_id(vid)
+        return {
+            "id": vid,
+            "title": f"Vídeo {n}",
+            "timestamp": int(self.published(n)),
+            "duration": DURATION,
+        }
+
+    def youtube_feed(self, idx: int) -> tuple:
+        """(etag, xml) del feed Atom del canal."""
+        n, _ = self.videos(idx, 1)[0]
+        vid = self.youtube_id(idx, n)
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom" '
+            'xmlns:yt="http://www.youtube.com/xml/schemas/2015">'
+            f"<entry><yt:videoId>{vid}</yt:videoId><title>Vídeo {n}</title></entry>"
+            "</feed>"
+        )
+        return f'"{vid}"', xml.encode()
+
+    def twitch_videos(self, idx: int, limit: int = 10) -> dict:
+        return {"videos": [
+            {
+                "id": self.twitch_id(idx, n),
+                "title": f"Directo {n}",
+                "publishedAt": datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z"),
+                "lengthSeconds": DURATION,
+                "status": "RECORDED",
+            }
+            for n, ts in self.videos(idx, limit)
+        ]}
+
+    def kick_videos(self, idx: int, limit: int, base_url: str) -> list:
+        return [
+            {
+                "id": self.kick_id(idx, n),
+                "slug": f"directo-{n}",
+                "session_title": f"Directo {n}",
+                "start_time": datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                "duration": DURATION * 1000,
+                "source": f"{base_url}/hls/{self.kick_id(idx, n)}/master.m3u8",
+            }
+            for n, ts in self.videos(idx, limit)
+        ]
+
+    def playlist(self) -> str:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10"]
+        for i in range(self.segments):
+            lines += ["#EXTINF:10.0,", f"seg{i:05d}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def media(self) -> bytes:
+        """Contenido de un vídeo completo (lo que 'descarga' yt-dlp)."""
+        return self.segment * self.segments
+
+
+class _Handler(BaseHTTPRequestHandler):
+    upstream = None
+
+    def do_GET(self):
+        catalog = self.upstream.catalog
+        if catalog.latency:
+            time.sleep(catalog.latency)
+
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip("/").split("/")
+        try:
+            if url.path == "/feeds/videos.xml":
+                idx = int(query["channel_id"].removeprefix("UCbench"))
+                etag, body = catalog.youtube_feed(idx)
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, b"")
+                else:
+                    self._send(200, body, "application/atom+xml", {"ETag": etag})
+            elif parts[:3] == ["api", "v2", "channels"] and parts[4:] == ["videos"]:
+                idx = int(parts[3].removeprefix("bench"))
+                vods = catalog.kick_videos(idx, int(query.get("limit", 30)), self.upstream.url)
+                self._send(200, json.dumps(vods).encode(), "application/json")
+            elif parts[0] == "twitch" and parts[2:] == ["videos"]:
+                idx = int(parts[1].removeprefix("bench"))
+                self._send(200, json.dumps(catalog.twitch_videos(idx)).encode(), "application/json")
+            elif parts[0] == "hls" and parts[2:] == ["master.m3u8"]:
+                master = "#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=300000,RESOLUTION=284x160\n160p/playlist.m3u8\n"
+                self._send(200, master.encode(), "application/vnd.apple.mpegurl")
+            elif parts[0] == "hls" and parts[3:] == ["playlist.m3u8"]:
+                self._send(200, catalog.playlist().encode(), "application/vnd.apple.mpegurl")
+            elif parts[0] == "hls" and parts[-1].endswith(".ts"):
+                self._send(200, catalog.segment, "video/mp2t")
+            else:
+                self._send(404, b"not found")
+        except (KeyError, ValueError, IndexError):
+            self._send(400, b"bad request")
+
+    def _send(self, code: int, body: bytes, content_type: str = "text/plain", headers: dict | None = None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Upstream:
+    """Servidor HTTP local (hilo aparte) que sirve el catálogo."""
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        handler = type("UpstreamHandler", (_Handler,), {"upstream": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="bench-upstream").start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# --- yt_dlp y curl_cffi falsos ---------------------------------------------
+
+def _fake_yt_dlp(upstream: Upstream) -> types.ModuleType:
+    class YoutubeDL:
+        def __init__(self, opts=None):
+            self.opts = opts or {}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download=False):
+            catalog = upstream.catalog
+            if catalog.latency:
+                time.sleep(catalog.latency)
+
+            if "watch?v=" not in url:
+                idx = int(url.split("@bench")[1].split("/")[0])
+                return catalog.youtube_listing(idx, self.opts.get("playlistend") or 30)
+
+            vid = url.split("watch?v=")[1]
+            info = catalog.youtube_details(vid)
+            if download:
+                info["ext"] = "webm"
+                path = Path(self.prepare_filename(info))
+                path.write_bytes(catalog.media())
+                info["requested_downloads"] = [{"filepath": str(path)}]
+            return info
+
+        def prepare_filename(self, info):
+            return self.opts["outtmpl"] % {"ext": info.get("ext", "webm")}
+
+    module = types.ModuleType("yt_dlp")
+    module.YoutubeDL = YoutubeDL
+    return module
+
+
+def _fake_curl_cffi(upstream: Upstream) -> types.ModuleType:
+    class Response:
+        def __init__(self, status_code: int, content: bytes):
+            self.status_code = status_code
+            self.content = content
+
+        @property
+        def text(self):
+            return self.content.decode("utf-8", "replace")
+
+        def json(self):
+            return json.loads(self.content)
+
+    def get(url, headers=None, impersonate=None, timeout=30, **kwargs):
+        url = url.replace("https://kick.com", upstream.url)
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as r:
+                return Response(r.status, r.read())
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.read())
+
+    class Session:
+        def __init__(self, impersonate=None, **kwargs):
+            pass
+
+        def get(self, url, **kwargs):
+            return get(url, **kwargs)
+
+    requests = types.ModuleType("curl_cffi.requests")
+    requests.get = get
+    requests.Session = Session
+    module = types.ModuleType("curl_cffi")
+    module.requests = requests
+    return module
+
+
+def install_modules(upstream: Upstream):
+    """yt_dlp y curl_cffi falsos (aunque estén instalados: todo offline)."""
+    curl_cffi = _fake_curl_cffi(upstream)
+    sys.modules["yt_dlp"] = _fake_yt_dlp(upstream)
+    sys.modules["curl_cffi"] = curl_cffi
+    sys.modules["curl_cffi.requests"] = curl_cffi.requests
+
+
+# --- ejecutables falsos ------------------------------------------------------
+
+def install_tools(bin_dir: Path, upstream: Upstream, fake_rclone: bool) -> list:
+    """
+    Crea los envoltorios de bench/fake_tools.py en bin_dir y lo antepone
+    al PATH. Devuelve la lista de herramientas sustituidas.
+    """
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    script = Path(__file__).with_name("fake_tools.py").resolve()
+    tools = list(TOOLS) + (["rclone"] if fake_rclone else [])
+    for tool in tools:
+        wrapper = bin_dir / tool
+        wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" -S "{script}" {tool} "$@"\n')
+        wrapper.chmod(wrapper.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    os.environ["BENCH_UPSTREAM"] = upstream.url
+    os.environ.setdefault("AUTH_TOKEN", "bench")
+    return tools
+
+
+def real_rclone() -> str | None:
+    return shutil.which("rclone")
+
+
+# --- rutas ------------------------------------------------------------------
+
+def relocate(data_dir: Path):
+    """Redirige las rutas fijas bajo /data de app/ a data_dir."""
+    import app.main
+    import app.core.cache as cache
+    import app.core.metrics as metrics
+    import app.core.prom as prom
+    import app.core.public as public
+    import app.core.rss as rss
+    import app.core.state as state
+    import app.uploader.rclone as rclone
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    app.main.LAST_RUN_LOG = str(data_dir / "last_run.log")
+    app.main.PROFILE_DIR = data_dir / "profile"
+    cache.CACHE_DB = data_dir / "metadata_cache.db"
+    metrics.RUNS_FILE = data_dir / "runs.jsonl"
+    prom.TOTALS_FILE = data_dir / "metrics_totals.json"
+    public.STATUS_DIR = str(data_dir / "html")
+    public.LAST_RUN = str(data_dir / "last_run.log")
+    public.LOG_DIR = str(data_dir / "logs")
+    rss.DATA_DIR = data_dir
+    rss.FEED_STATE = data_dir / "feed_state.json"
+    rss.ITEM_CACHE = data_dir / "feed_items.json"
+    state.STATE_FILE = data_dir / "state.json"
+    state.STATE_DB = data_dir / "state.db"
+    rclone.MANIFEST_FILE = data_dir / "upload_manifest.json"